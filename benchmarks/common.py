@@ -0,0 +1,118 @@
+import contextlib
+import io
+import json
+import platform
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+import cv2
+
+
+Results = Dict[str, Dict[str, float]]
+
+
+def latency_stats(latencies_s: Sequence[float]) -> Dict[str, float]:
+    """Fasst die Laufzeiten in s zusammen (Zeiten in ms)."""
+    latencies = np.asarray(latencies_s)*1000
+    if len(latencies) == 0:
+        return {'n': 0}
+    return {'n': len(latencies),
+            'fps': 1000/latencies.mean() if latencies.mean() > 0 else float('inf'),
+            'mean_ms': latencies.mean(),
+            'p50_ms': np.percentile(latencies, 50),
+            'p99_ms': np.percentile(latencies, 99),
+            'max_ms': latencies.max()}
+
+
+def measure(func: Callable[[Any], Any], inputs: Sequence[Any], repeat: int = 1, warmup: int = 2,
+            memory: bool = True) -> Dict[str, float]:
+    """Ruft func für jedes Element von inputs repeat-mal auf und gibt die Statistik der Laufzeiten, die Anzahl der
+    Fehler (Ausnahmen) und die Spitze des mit tracemalloc gemessenen Speichers in KiB zurück. Speicher, den OpenCV
+    selbst anlegt, sieht tracemalloc nicht."""
+
+    latencies = []
+    failures = 0
+    # die alten Erkennungsfunktionen schreiben mit print, das soll nicht mitgemessen werden
+    with contextlib.redirect_stdout(io.StringIO()):
+        for item in list(inputs)[:warmup]:
+            _call(func, item)
+        for _ in range(repeat):
+            for item in inputs:
+                start = time.perf_counter()
+                ok = _call(func, item)
+                latencies.append(time.perf_counter() - start)
+                failures += not ok
+
+        stats = latency_stats(latencies)
+        stats['failures'] = failures
+
+        if memory:
+            # getrennt gemessen, weil tracemalloc die Laufzeit stark erhöht
+            tracemalloc.start()
+            try:
+                for item in list(inputs)[:3]:
+                    _call(func, item)
+                stats['peak_kib'] = tracemalloc.get_traced_memory()[1]/1024
+            finally:
+                tracemalloc.stop()
+    return stats
+
+
+def _call(func: Callable[[Any], Any], item: Any) -> bool:
+    try:
+        func(item)
+    except Exception:
+        return False
+    return True
+
+
+def environment() -> Dict[str, str]:
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'opencv': cv2.__version__,
+            'machine': platform.machine(), 'processor': platform.processor(),
+            'time': time.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+def save_results(path: str, results: Results, **meta):
+    """Speichert die Ergebnisse als JSON zusammen mit den Versionen der Bibliotheken."""
+    data = {'meta': dict(environment(), **meta), 'results': results}
+    with open(path, 'w') as file:
+        json.dump(data, file, indent=2, default=float)
+
+
+def load_results(path: str) -> Results:
+    with open(path) as file:
+        return json.load(file)['results']
+
+
+def compare_results(results: Results, baseline: Results, tolerance: float = 0.2, key: str = 'p50_ms') \
+        -> List[str]:
+    """Gibt die Namen der Messungen zurück, deren key um mehr als tolerance (relativ) schlechter als in baseline
+    ist."""
+    regressions = []
+    for name, stats in results.items():
+        old = baseline.get(name, {}).get(key)
+        if old and stats.get(key) is not None and stats[key] > old*(1 + tolerance):
+            regressions.append(name)
+    return regressions
+
+
+def print_results(results: Results, baseline: Optional[Results] = None, columns: Iterable[str] = ()):
+    columns = list(columns) or ['fps', 'p50_ms', 'p99_ms', 'peak_kib', 'failures']
+    width = max([len(name) for name in results] + [10])
+    print(f"{'':{width}}  " + '  '.join(f'{column:>10}' for column in columns)
+          + ('  p50/Basis' if baseline else ''))
+    for name, stats in results.items():
+        line = f'{name:{width}}  ' + '  '.join(_format(stats.get(column)) for column in columns)
+        if baseline and baseline.get(name, {}).get('p50_ms'):
+            line += f"  {stats['p50_ms']/baseline[name]['p50_ms']:9.2f}x"
+        print(line)
+
+
+def _format(value) -> str:
+    if value is None:
+        return f"{'-':>10}"
+    if isinstance(value, int):
+        return f'{value:10d}'
+    return f'{value:10.2f}'
@@ -0,0 +1,220 @@
+"""Benchmark der ganzen Regelschleife von PlasmaWatcher mit dem Emulator.
+
+Gemessen werden PlasmaHolder._check, PlasmaWatcher.move_plasma_to und PlasmaWatcher.get_jet_position. Die Laufzeit
+jedes Aufrufs wird in Stufen aufgeteilt:
+    frame_wait     Warten auf Frames (get_frame der Kameras, FramePairSynchronizer.wait_pair)
+    recognition    Erkennung (find der RayTracker und PlasmaTracker)
+    triangulation  Umrechnung in Motorkoordinaten (CameraCoordinates.cc_to_mc)
+    motor          Befehle und Abfragen der Motoren (MotorsCluster und Motor: go, go_to, position)
+    other          der Rest, u.a. die Rechnung zwischen den Stufen und der Python-Overhead
+Die zweite Kamera wird parallel in einem Pool ausgewertet. Ihre Stufen sind als "[parallel]" getrennt aufgeführt
+und nicht in other abgezogen.
+
+Aufruf aus dem Hauptordner des Projekts:
+    python -m benchmarks.control_loop -n 50 -o control_loop.json
+    python -m benchmarks.control_loop --stream --compare control_loop.json
+"""
+import argparse
+import contextlib
+import io
+import sys
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from tests.test_PlasmaWatcher import prepare_jet_watcher_to_test
+from benchmarks.common import Results, latency_stats, save_results, load_results, compare_results, print_results
+
+
+STAGES = ['frame_wait', 'recognition', 'triangulation', 'motor']
+
+
+class StageTimer:
+    """Ersetzt Methoden einzelner Objekte durch Wrapper, die die Laufzeit der Aufrufe einer Stufe aufsummieren.
+
+    Verschachtelte Aufrufe (z.B. Motor.go innerhalb von MotorsCluster.go) werden nur einmal gezählt. Aufrufe aus
+    einem anderen Thread als dem, der die Messung mit begin gestartet hat, werden unter "<Stufe> [parallel]"
+    gezählt."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._patched: List[Tuple[Any, str]] = []
+        self._durations: Dict[str, float] = defaultdict(float)
+        self._thread: Optional[threading.Thread] = None
+
+    def wrap(self, obj: Any, method: str, stage: str):
+        original = getattr(obj, method)
+
+        def wrapper(*args, **kwargs):
+            if getattr(self._local, 'depth', 0):
+                return original(*args, **kwargs)
+            self._local.depth = 1
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self._local.depth = 0
+                self._add(stage, time.perf_counter() - start)
+
+        setattr(obj, method, wrapper)
+        self._patched.append((obj, method))
+
+    def restore(self):
+        """Entfernt alle Wrapper wieder."""
+        for obj, method in reversed(self._patched):
+            delattr(obj, method)
+        self._patched.clear()
+
+    def begin(self):
+        with self._lock:
+            self._durations = defaultdict(float)
+            self._thread = threading.current_thread()
+
+    def end(self) -> Dict[str, float]:
+        with self._lock:
+            durations, self._durations = dict(self._durations), defaultdict(float)
+        return durations
+
+    def _add(self, stage: str, duration: float):
+        if threading.current_thread() is not self._thread:
+            stage += ' [parallel]'
+        with self._lock:
+            self._durations[stage] += duration
+
+
+def instrument(pl_watcher) -> StageTimer:
+    """Setzt die Wrapper für alle Stufen an pl_watcher und seinen Kameras, Trackern und Motoren."""
+    timer = StageTimer()
+    for camera in (pl_watcher.camera1, pl_watcher.camera2):
+        timer.wrap(camera, 'get_frame', 'frame_wait')
+    timer.wrap(pl_watcher.frame_sync, 'wait_pair', 'frame_wait')
+    for tracker in (pl_watcher.ray_tracker1, pl_watcher.ray_tracker2,
+                    pl_watcher.plasma_tracker1, pl_watcher.plasma_tracker2):
+        timer.wrap(tracker, 'find', 'recognition')
+    for coord in (pl_watcher.camera1_coord, pl_watcher.camera2_coord):
+        timer.wrap(coord, 'cc_to_mc', 'triangulation')
+    for method in ('go', 'go_to'):
+        timer.wrap(pl_watcher.motors_cl, method, 'motor')
+    motors = {id(motor): motor for motor in (pl_watcher.jet_x, pl_watcher.jet_z, pl_watcher.laser_z,
+                                             pl_watcher.laser_y) if motor is not None}
+    for motor in motors.values():
+        for method in ('go', 'go_to', 'position'):
+            timer.wrap(motor, method, 'motor')
+    return timer
+
+
+def operations(pl_watcher, step: float = 100, wait: bool = False) -> Dict[str, Callable[[int], Any]]:
+    """Gibt die gemessenen Operationen als Name -> Funktion(i) zurück. move_plasma_to fährt abwechselnd um step
+    (in displ-Einheiten) hin und zurück."""
+    holder = pl_watcher.plasma_holder
+    x0, y0, z0, _ = pl_watcher.find_plasma()
+    if x0 is None:
+        raise RuntimeError('Der Emulator zeigt kein Plasma.')
+    holder.position = [x0, y0, z0]
+
+    def move(i: int):
+        shift = step if i % 2 == 0 else 0
+        pl_watcher.move_plasma_to(x0 + shift, y0, z0 + shift, wait=wait)
+
+    return {
+        'get_jet_position': lambda i: pl_watcher.get_jet_position(),
+        'PlasmaHolder._check': lambda i: holder._check(position=True, brightness=True),
+        'move_plasma_to': move,
+    }
+
+
+def measure_stages(timer: StageTimer, func: Callable[[int], Any], n: int, warmup: int = 2) -> Results:
+    """Ruft func n-mal auf und gibt die Statistik der ganzen Aufrufe ('total') und jeder Stufe zurück."""
+    totals = []
+    stages: Dict[str, List[float]] = defaultdict(list)
+    failures = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(warmup):
+            _call(func, i)
+        for i in range(n):
+            timer.begin()
+            start = time.perf_counter()
+            failures += not _call(func, i)
+            total = time.perf_counter() - start
+            durations = timer.end()
+            totals.append(total)
+            for stage in set(STAGES) | set(durations):
+                stages[stage].append(durations.get(stage, 0.0))
+            stages['other'].append(total - sum(durations.get(stage, 0.0) for stage in STAGES))
+
+    results = {'total': dict(latency_stats(totals), failures=failures)}
+    mean_total = np.mean(totals) if totals else 0
+    for stage in STAGES + ['other'] + sorted(set(stages) - set(STAGES) - {'other'}):
+        stats = latency_stats(stages[stage])
+        stats['share_%'] = 100*stats['mean_ms']/1000/mean_total if mean_total else 0.0
+        del stats['fps']
+        results[stage] = stats
+    return results
+
+
+def _call(func: Callable[[int], Any], i: int) -> bool:
+    try:
+        func(i)
+    except Exception:
+        return False
+    return True
+
+
+def run(n: int = 30, select: str = '', stream: bool = False, step: float = 100, wait: bool = False,
+        warmup: int = 2) -> Results:
+    pl_watcher, jet_emulator, camera1, camera2 = prepare_jet_watcher_to_test()
+    if stream:
+        camera1.start_stream()
+        camera2.start_stream()
+    timer = instrument(pl_watcher)
+    results = {}
+    try:
+        for name, func in operations(pl_watcher, step, wait).items():
+            if select and select not in name:
+                continue
+            for stage, stats in measure_stages(timer, func, n, warmup).items():
+                results[f'{name}/{stage}'] = stats
+    finally:
+        timer.restore()
+        if stream:
+            camera1.stop_stream()
+            camera2.stop_stream()
+        pl_watcher.close()
+    return results
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark der Regelschleife von PlasmaWatcher mit dem Emulator.')
+    parser.add_argument('-n', type=int, default=30, help='Aufrufe jeder Operation')
+    parser.add_argument('--select', default='', help='nur Operationen, deren Name diesen Text enthält')
+    parser.add_argument('--stream', action='store_true', help='Kameras streamen lassen (sonst einzelne Frames)')
+    parser.add_argument('--step', type=float, default=100, help='Schritt von move_plasma_to in displ-Einheiten')
+    parser.add_argument('--wait', action='store_true', help='move_plasma_to wartet auf das Ende der Bewegung')
+    parser.add_argument('-o', '--output', help='Ergebnisse als JSON speichern')
+    parser.add_argument('--compare', help='JSON mit früheren Ergebnissen zum Vergleich')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='erlaubte relative Verschlechterung von p50')
+    args = parser.parse_args(argv)
+
+    results = run(args.n, args.select, args.stream, args.step, args.wait)
+
+    baseline = load_results(args.compare) if args.compare else None
+    print_results(results, baseline, columns=['mean_ms', 'p50_ms', 'p99_ms', 'share_%', 'failures'])
+    if args.output:
+        save_results(args.output, results, benchmark='control_loop', n=args.n, stream=args.stream,
+                     step=args.step, wait=args.wait)
+    if baseline:
+        # nur die ganzen Aufrufe vergleichen, die einzelnen Stufen schwanken zu stark
+        regressions = [name for name in compare_results(results, baseline, args.tolerance)
+                       if name.endswith('/total')]
+        if regressions:
+            print('Langsamer als die Basis:', ', '.join(regressions))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
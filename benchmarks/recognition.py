@@ -0,0 +1,167 @@
+"""Benchmark der Erkennungsfunktionen aus plasma_watcher.
+
+Die Funktionen laufen über Frames aus dem Emulator (JetEmulator.render_batch) und optional über gespeicherte Frames,
+jeweils auf dem ganzen Frame und auf Ausschnitten verschiedener Größe. Für jede Messung werden Frames pro Sekunde,
+p50/p99 der Laufzeit und die Speicherspitze ausgegeben und als JSON gespeichert.
+
+Aufruf aus dem Hauptordner des Projekts:
+    python -m benchmarks.recognition -n 50 -o recognition.json
+    python -m benchmarks.recognition --frames ordner_mit_bmp --compare recognition.json
+"""
+import argparse
+import glob
+import os
+import sys
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import cv2
+
+from mscontr.microwatcher.plasma_camera_emulator import JetEmulator
+from mscontr.microwatcher.plasma_watcher import find_ray, find_ray0, find_ray_1, find_plasma, find_nozzle, \
+    merge_close_lines, RayDetector, RAY_STRATEGIES, find_ray_subpixel, find_plasma_moments
+from benchmarks.common import Results, measure, save_results, load_results, compare_results, print_results
+
+
+class BenchFrame:
+    """Ein Frame mit der (wahren oder erkannten) Position von Jet und Plasma für die Ausschnitte."""
+
+    def __init__(self, frame: np.ndarray, jet_x: Optional[float], plasma: Optional[Tuple[float, float]]):
+        self.frame = frame
+        self.jet_x = jet_x
+        self.plasma = plasma
+
+
+def emulator_frames(n: int, seed: int = 0) -> List[BenchFrame]:
+    """Erzeugt n Frames der ersten Kamera mit zufälligen Positionen von Jet und Laser."""
+    rng = np.random.default_rng(seed)
+    jet_emulator = JetEmulator(def_init=False, flicker_sigma=0.1)
+    jet_emulator.laser_on = True
+    x = rng.uniform(-3000, 3000, n)
+    z = rng.uniform(-3000, 3000, n)
+    l_y = rng.uniform(-1500, 1500, n)
+    l_z = z + rng.normal(0, 20, n)
+    frames, _, truth, _ = jet_emulator.render_batch(x, z, l_y, l_z, seeds=np.arange(n) + seed)
+    return [BenchFrame(frame, t['jet_x'], None if np.isnan(t['plasma_x']) else (t['plasma_x'], t['plasma_y']))
+            for frame, t in zip(frames, truth)]
+
+
+def stored_frames(folder: str) -> List[BenchFrame]:
+    """Liest die Frames (bmp, png, tif) aus folder. Die Positionen für die Ausschnitte werden mit find_ray und
+    find_plasma bestimmt."""
+    paths = sorted(path for pattern in ['*.bmp', '*.png', '*.tif', '*.tiff']
+                   for path in glob.glob(os.path.join(folder, pattern)))
+    frames = []
+    for path in paths:
+        frame = cv2.imread(path, 0)
+        if frame is None:
+            continue
+        x, y, _ = find_plasma(frame)
+        frames.append(BenchFrame(frame, find_ray(frame), None if x is None else (x, y)))
+    return frames
+
+
+def random_lines(n: int, rng: np.random.Generator) -> np.ndarray:
+    """Erzeugt n fast senkrechte Geraden (x1, y1, x2, y2) in wenigen Gruppen wie aus HoughLinesP."""
+    centers = rng.uniform(200, 1800, max(1, n//10))
+    x1 = rng.choice(centers, n) + rng.integers(-2, 3, n)
+    x2 = x1 + rng.integers(-1, 2, n)
+    return np.column_stack([x1, rng.integers(500, 1088, n), x2, rng.integers(0, 500, n)]).astype(float)
+
+
+def _window(center: Optional[float], half: int, size: int) -> Tuple[int, int]:
+    if center is None:
+        center = size/2
+    return max(0, round(center) - half), min(size, round(center) + half)
+
+
+def cases(frames: Sequence[BenchFrame], seed: int = 0) -> Dict[str, Tuple[Callable[[Any], Any], List[Any]]]:
+    """Gibt die Messungen als Name -> (Funktion, Eingaben) zurück."""
+
+    def ray_window(item: BenchFrame) -> Tuple[np.ndarray, Tuple[int, int]]:
+        return item.frame, _window(item.jet_x, 100, item.frame.shape[1])
+
+    def plasma_roi(item: BenchFrame, half: int) -> Tuple[np.ndarray, Tuple[int, int, int, int]]:
+        ym, xm = item.frame.shape
+        x, y = item.plasma if item.plasma is not None else (None, None)
+        x1, x2 = _window(x, half, xm)
+        y1, y2 = _window(y, half, ym)
+        return item.frame, (x1, y1, x2, y2)
+
+    images = [item.frame for item in frames]
+    rng = np.random.default_rng(seed)
+    return {
+        'find_ray[full]': (find_ray, images),
+        'find_ray[crop 300:800]': (lambda frame: find_ray(frame, crop=(300, 800)), images),
+        'find_ray[window 500x200]': (lambda args: find_ray(args[0], crop=(300, 800), x_crop=args[1]),
+                                     [ray_window(item) for item in frames]),
+        'find_ray_subpixel[crop 300:800]': (lambda frame: find_ray_subpixel(frame, crop=(300, 800)), images),
+        'find_ray0[full]': (find_ray0, images),
+        'find_ray0[crop 300:800]': (lambda frame: find_ray0(frame, crop=(300, 800)), images),
+        'find_ray_1[full]': (find_ray_1, images),
+        'find_ray_1[crop 300:800]': (lambda frame: find_ray_1(frame, crop=(300, 800)), images),
+        **{f'RayDetector[{name} crop 300:800]': (RayDetector(name, crop=(300, 800)).find, images)
+           for name in RAY_STRATEGIES},
+        'RayDetector[edge_hough+row_max crop 300:800]': (RayDetector(['edge_hough', 'row_max'], crop=(300, 800)).find,
+                                                         images),
+        'find_plasma[full]': (find_plasma, images),
+        'find_plasma[crop_top 300]': (lambda frame: find_plasma(frame, crop_top=300), images),
+        'find_plasma[roi 400x400]': (lambda args: find_plasma(args[0], roi=args[1]),
+                                     [plasma_roi(item, 200) for item in frames]),
+        'find_plasma[roi 120x120]': (lambda args: find_plasma(args[0], roi=args[1]),
+                                     [plasma_roi(item, 60) for item in frames]),
+        'find_plasma_moments[crop_top 300]': (lambda frame: find_plasma_moments(frame, crop_top=300), images),
+        'find_plasma_moments[roi 120x120]': (lambda args: find_plasma_moments(args[0], roi=args[1]),
+                                             [plasma_roi(item, 60) for item in frames]),
+        'find_nozzle[full]': (find_nozzle, images),
+        'merge_close_lines[10]': (merge_close_lines, [random_lines(10, rng) for _ in frames]),
+        'merge_close_lines[100]': (merge_close_lines, [random_lines(100, rng) for _ in frames]),
+        'merge_close_lines[300]': (merge_close_lines, [random_lines(300, rng) for _ in frames]),
+        'merge_close_lines[1000]': (merge_close_lines, [random_lines(1000, rng) for _ in frames]),
+    }
+
+
+def run(frames: Sequence[BenchFrame], repeat: int = 1, select: str = '', memory: bool = True, seed: int = 0) \
+        -> Results:
+    results = {}
+    for name, (func, inputs) in cases(frames, seed).items():
+        if select and select not in name:
+            continue
+        results[name] = measure(func, inputs, repeat=repeat, memory=memory)
+    return results
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark der Erkennungsfunktionen aus plasma_watcher.')
+    parser.add_argument('-n', type=int, default=30, help='Anzahl der Frames aus dem Emulator')
+    parser.add_argument('--frames', help='Ordner mit gespeicherten Frames (statt des Emulators)')
+    parser.add_argument('--repeat', type=int, default=1, help='Durchläufe über alle Frames')
+    parser.add_argument('--select', default='', help='nur Messungen, deren Name diesen Text enthält')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', action='store_true', help='Speicherspitze nicht messen')
+    parser.add_argument('-o', '--output', help='Ergebnisse als JSON speichern')
+    parser.add_argument('--compare', help='JSON mit früheren Ergebnissen zum Vergleich')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='erlaubte relative Verschlechterung von p50')
+    args = parser.parse_args(argv)
+
+    frames = stored_frames(args.frames) if args.frames else emulator_frames(args.n, args.seed)
+    if not frames:
+        print('Keine Frames gefunden.')
+        return 2
+    results = run(frames, args.repeat, args.select, not args.no_memory, args.seed)
+
+    baseline = load_results(args.compare) if args.compare else None
+    print_results(results, baseline)
+    if args.output:
+        save_results(args.output, results, benchmark='recognition', n_frames=len(frames),
+                     source=args.frames or 'emulator', repeat=args.repeat, seed=args.seed)
+    if baseline:
+        regressions = compare_results(results, baseline, args.tolerance)
+        if regressions:
+            print('Langsamer als die Basis:', ', '.join(regressions))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -276,6 +276,8 @@ class PlasmaMotorWindow(QWidget):
         self.plasma_watcher.jet_z.stop()
 
     def closeEvent(self, a0: QtGui.QCloseEvent):
+        if getattr(self, 'plasma_watcher', None) is not None:
+            self.plasma_watcher.close()
         self.camera1.stop_stream()
         self.camera2.stop_stream()
         print('closed')
@@ -1958,6 +1958,7 @@ class PlasmaMotorWindow(MotorWindow):
     def init_plasma_watcher(self):
 
         self.stop_all_tasks()
+        self._close_plasma_watcher()
 
         jet_x = self.motors_widgets['JetX'].motor
         jet_z = self.motors_widgets['JetZ'].motor
@@ -1980,10 +1981,15 @@ class PlasmaMotorWindow(MotorWindow):
         else:
             self.plasma_watcher = None
 
+    def _close_plasma_watcher(self):
+        if self.plasma_watcher is not None:
+            self.plasma_watcher.close()
+        self.plasma_watcher = None
+
     def discard_plasma_watcher(self):
 
         self.stop_all_tasks()
-        self.plasma_watcher = None
+        self._close_plasma_watcher()
         self.CalEnlBtn.setEnabled(False)
         self.centreBtn.setEnabled(False)
         self.CalPlasmaBtn.setEnabled(False)
@@ -2314,6 +2320,7 @@ class PlasmaMotorWindow(MotorWindow):
     def closeEvent(self, a0: QtGui.QCloseEvent):
 
         self.stop_all_tasks()
+        self._close_plasma_watcher()
         for camera in [self.camera1, self.camera2]:
             try:
                 if camera is not None:
@@ -1,11 +1,13 @@
+import logging
 import threading
+import weakref
+from collections import deque
 from copy import deepcopy
-from time import sleep
-from typing import Callable, Set
+from time import sleep, monotonic
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
 import numpy as np
 
 import cv2
-import timeout_decorator
 
 
 def show_video_frame(frame):
@@ -13,17 +15,173 @@ def show_video_frame(frame):
     cv2.waitKey(1)
 
 
+class FrameInfo(NamedTuple):
+    """Aufnahmezeit (CameraInterf.time in s) und Nummer eines Frames."""
+    timestamp: float
+    frame_id: int
+
+
+class _RingSlot:
+    def __init__(self, shape: Tuple[int, ...], dtype: np.dtype):
+        self.array = np.empty(shape, dtype)
+        self.refs = 0
+
+
+class FrameRingBuffer:
+    """Vorab angelegter Ringpuffer für die Frames einer Kamera.
+
+    Jeder Frame wird einmal in einen freien Platz kopiert und als schreibgeschützte Ansicht herausgegeben. Ein Platz
+    ist belegt, solange die Ansicht oder ein davon abgeleitetes Array (Ausschnitt, reshape usw.) existiert, und wird
+    erst danach wieder beschrieben. Sind alle Plätze belegt, wird der Frame in ein neues Array kopiert und in
+    overflows gezählt."""
+
+    def __init__(self, size: int = 8):
+        self.size = size
+        self.overflows = 0
+        self._slots: List[_RingSlot] = []
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def store(self, frame: np.ndarray) -> np.ndarray:
+        """Kopiert den Frame in den Puffer und gibt eine schreibgeschützte Ansicht zurück."""
+
+        with self._lock:
+            slots = self._slots
+            if not slots or slots[0].array.shape != frame.shape or slots[0].array.dtype != frame.dtype:
+                # noch benutzte alte Plätze bleiben durch ihre Ansichten erhalten
+                self._slots = [_RingSlot(frame.shape, frame.dtype) for _ in range(self.size)]
+                self._next = 0
+            slot = self._take_free_slot()
+
+        if slot is None:
+            self.overflows += 1
+            frame = frame.copy()
+            frame.flags.writeable = False
+            return frame
+
+        np.copyto(slot.array, frame)
+        view = self._view(slot)
+        self._release(slot)
+        return view
+
+    def used_slots(self) -> int:
+        """Gibt die Anzahl der Plätze zurück, die noch von Ansichten belegt sind."""
+        with self._lock:
+            return sum(1 for slot in self._slots if slot.refs > 0)
+
+    def _take_free_slot(self) -> Optional[_RingSlot]:
+        for i in range(self.size):
+            slot = self._slots[(self._next + i) % self.size]
+            if slot.refs == 0:
+                self._next = (self._next + i + 1) % self.size
+                # bis zur Herausgabe der Ansicht für das Schreiben reserviert
+                slot.refs = 1
+                return slot
+        return None
+
+    def _view(self, slot: _RingSlot) -> np.ndarray:
+        # Die Ansicht liegt auf einem eigenen memoryview, deshalb verweisen alle davon abgeleiteten Arrays auf sie
+        # und der Platz wird erst frei, wenn keins davon mehr existiert.
+        view = np.asarray(memoryview(slot.array))
+        view.flags.writeable = False
+        with self._lock:
+            slot.refs += 1
+        weakref.finalize(view, self._release, slot)
+        return view
+
+    def _release(self, slot: _RingSlot):
+        with self._lock:
+            slot.refs -= 1
+
+
+class StreamSubscriber:
+    """Verbindung einer action mit dem Stream einer Kamera.
+
+    Die action läuft in einem eigenen Thread, der die Frames aus einer Warteschlange mit queue_size Plätzen holt. Ist
+    die Warteschlange voll, wird der älteste Frame verworfen und in dropped gezählt, so dass der Aufnahme-Thread der
+    Kamera nie auf die action wartet. Bei direct=True wird die action sofort im Aufnahme-Thread aufgerufen, das ist
+    nur für actions gedacht, die nicht blockieren (z.B. Frames in einen Puffer legen)."""
+
+    def __init__(self, camera: 'CameraInterf', action: Callable, with_info: bool = False, queue_size: int = 1,
+                 direct: bool = False):
+        self.camera = camera
+        self.action = action
+        self.with_info = with_info
+        self.direct = direct
+        self.dropped = 0
+
+        self._queue = deque(maxlen=queue_size)
+        self._cond = threading.Condition()
+        self._busy = False
+        self._running = True
+
+        if not direct:
+            name = getattr(action, '__name__', 'action')
+            threading.Thread(target=self._dispatch_loop, name=f'stream_{name}', daemon=True).start()
+
+    def put(self, frame: np.ndarray, info: 'FrameInfo'):
+        if self.direct:
+            self._call(frame, info)
+            return
+        with self._cond:
+            if len(self._queue) == self._queue.maxlen:
+                self.dropped += 1
+            self._queue.append((frame, info))
+            self._cond.notify_all()
+
+    def flush(self, timeout_s: Optional[float] = None) -> bool:
+        """Wartet, bis alle Frames in der Warteschlange verarbeitet sind. Gibt False zurück, wenn timeout_s
+        überschritten wurde."""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._queue and not self._busy, timeout_s)
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._queue.clear()
+            self._cond.notify_all()
+
+    def _call(self, frame: np.ndarray, info: 'FrameInfo'):
+        if self.with_info:
+            self.action(frame, info)
+        else:
+            self.action(frame)
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._queue or not self._running)
+                if not self._running:
+                    return
+                frame, info = self._queue.popleft()
+                self._busy = True
+            try:
+                self._call(frame, info)
+            except Exception as err:
+                logging.exception(err)
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+            # Frame weg, bevor gewartet wird, damit sein Platz im Ringpuffer frei wird
+            del frame
+            if self.camera.stream_delay:
+                sleep(self.camera.stream_delay)
+
+
 class CameraInterf:
 
     def __init__(self):
-        self._connected_to_stream: Set[Callable] = set()
+        self._connected_to_stream: Dict[Callable, StreamSubscriber] = {}
         self.stream_delay = 0
         self._frame: np.ndarray = np.zeros(self.get_resolution())
-        self._record_on = False
-        self._record_fps = 30
-
-        self._frame_is_new = False
-        self.new_frame_signal = threading.Event()
+        self._frame_info = FrameInfo(0, -1)
+        self._next_frame_id = 0
+        self._frame_buffer = FrameRingBuffer(size=8)
+        # Nummer des letzten Frames aus dem Stream, wartende Threads werden über _frame_cond geweckt
+        self._frame_seq = 0
+        self._frame_cond = threading.Condition()
+        self._recorder: Optional[VideoRecorder] = None
 
     def is_streaming(self) -> bool:
         raise NotImplementedError
@@ -49,42 +207,79 @@ class CameraInterf:
     def stop_stream(self):
         raise NotImplementedError
 
-    def get_frame(self, timeout_s: float = 3) -> np.ndarray:
+    def get_frame(self, timeout_s: float = 3, writable: bool = False) -> np.ndarray:
+        """Gibt den nächsten Frame zurück. Der Frame ist eine schreibgeschützte Ansicht in den Ringpuffer der Kamera,
+        nur bei writable=True wird eine veränderbare Kopie erstellt."""
         if self.is_streaming():
-            self.new_frame_signal.clear()
-            self.new_frame_signal.wait(timeout=timeout_s)
-            return self._frame.copy()
+            _, frame, _ = self.wait_frame(timeout_s=timeout_s)
         else:
-            frame = self.get_single_frame(timeout_s=timeout_s)
+            frame = self._frame_buffer.store(self.get_single_frame(timeout_s=timeout_s))
             self._frame = frame
-            return frame.copy()
+        return frame.copy() if writable else frame
 
     def get_single_frame(self, timeout_s: float) -> np.ndarray:
         raise NotImplementedError
 
-    def connect_to_stream(self, action: Callable):
-        self._connected_to_stream.add(action)
+    def time(self) -> float:
+        """Gibt die aktuelle Zeit in der Zeitbasis der Aufnahmezeiten zurück (Standard: time.monotonic)."""
+        return monotonic()
+
+    def get_frame_info(self) -> FrameInfo:
+        """Gibt die Aufnahmezeit und die Nummer des letzten Frames zurück."""
+        return self._frame_info
+
+    def get_frame_seq(self) -> int:
+        """Gibt die fortlaufende Nummer des letzten Frames aus dem Stream zurück."""
+        return self._frame_seq
+
+    def wait_frame(self, after_seq: Optional[int] = None, timeout_s: float = 3) -> (int, np.ndarray, FrameInfo):
+        """Wartet auf einen Frame aus dem Stream mit einer Nummer größer als after_seq (Standard: der letzte Frame)
+        und gibt die Nummer, den Frame und seine FrameInfo zurück. Beliebig viele Threads können gleichzeitig
+        warten."""
+        with self._frame_cond:
+            if after_seq is None:
+                after_seq = self._frame_seq
+            if not self._frame_cond.wait_for(lambda: self._frame_seq > after_seq, timeout_s):
+                raise FrameTimeoutError(f"Innerhalb von {timeout_s} s ist kein neuer Frame angekommen.")
+            return self._frame_seq, self._frame, self._frame_info
+
+    def connect_to_stream(self, action: Callable, with_info: bool = False, queue_size: int = 1,
+                          direct: bool = False) -> StreamSubscriber:
+        """Verbindet action mit dem Stream. action wird mit jedem neuen Frame aufgerufen, bei with_info=True als
+        action(frame, info) mit der FrameInfo des Frames. Die action läuft in einem eigenen Thread, siehe
+        StreamSubscriber."""
+        self.disconnect_from_stream(action)
+        subscriber = StreamSubscriber(self, action, with_info, queue_size, direct)
+        self._connected_to_stream[action] = subscriber
+        return subscriber
 
     def disconnect_from_stream(self, action: Callable):
-        self._connected_to_stream.discard(action)
-        # self.disconnect_from_stream(show_video_frame)
-
-    def new_frame_event(self, frame: np.ndarray):
-        frame = frame.copy()
-        self._frame = frame
-        self.new_frame_signal.set()
-        for action in self._connected_to_stream.copy():
-            action(frame)
-        sleep(self.stream_delay)
-
-    # TODO удалить функции wait
-    def wait_new_frame(self, timeout_s=10):
-        timeout_decorator.timeout(timeout_s, use_signals=False)(self._wait_new_frame)()
-
-    def _wait_new_frame(self):
-        self._frame_is_new = False
-        while not self._frame_is_new:
-            sleep(1/60)
+        subscriber = self._connected_to_stream.pop(action, None)
+        if subscriber is not None:
+            subscriber.stop()
+
+    def get_dropped_frames(self) -> Dict[Callable, int]:
+        """Gibt für jede verbundene action die Anzahl der verworfenen Frames zurück."""
+        return {action: subscriber.dropped for action, subscriber in self._connected_to_stream.copy().items()}
+
+    def new_frame_event(self, frame: np.ndarray, timestamp: Optional[float] = None, frame_id: Optional[int] = None):
+        """Verteilt einen neuen Frame aus dem Stream. timestamp ist die Aufnahmezeit nach self.time (Standard:
+        jetzt), frame_id die Nummer des Frames (Standard: fortlaufend)."""
+        if timestamp is None:
+            timestamp = self.time()
+        if frame_id is None:
+            frame_id = self._next_frame_id
+        self._next_frame_id = frame_id + 1
+        info = FrameInfo(timestamp, frame_id)
+
+        frame = self._frame_buffer.store(frame)
+        with self._frame_cond:
+            self._frame = frame
+            self._frame_info = info
+            self._frame_seq += 1
+            self._frame_cond.notify_all()
+        for subscriber in list(self._connected_to_stream.values()):
+            subscriber.put(frame, info)
 
     def show_frame(self):
         frame = self.get_frame()
@@ -103,24 +298,219 @@ class CameraInterf:
                 break
 
     def start_video_record(self, video_addres: str = 'jet_video.avi', fps: float = 30, start_stream: bool = False):
-        fourcc = cv2.VideoWriter_fourcc(*'MJPG')
-        out = cv2.VideoWriter(video_addres, fourcc, fps, self.get_resolution(), 0)
-        self._record_on = True
-        self._record_fps = fps
+        self.stop_video_record()
+        self._recorder = VideoRecorder([self], [video_addres], fps)
+        self._recorder.start()
         if start_stream and not self.is_streaming():
             self.start_stream()
-        threading.Thread(target=self._video_record, args=(out,)).start()
-
-    def _video_record(self, out: cv2.VideoWriter):
-        while self._record_on:
-            out.write(self.get_frame())
-            sleep(1/self._record_fps)
-        out.release()
 
     def stop_video_record(self):
-        self._record_on = False
+        if self._recorder is not None:
+            self._recorder.stop()
+            self._recorder = None
+
+
+class FramePair(NamedTuple):
+    """Zwei Frames von zwei Kameras, die ungefähr gleichzeitig aufgenommen wurden."""
+    frame1: np.ndarray
+    frame2: np.ndarray
+    info1: FrameInfo
+    info2: FrameInfo
+
+    def skew(self) -> float:
+        """Gibt den Zeitabstand zwischen den Aufnahmen in s zurück."""
+        return self.info2.timestamp - self.info1.timestamp
+
+    def timestamp(self) -> float:
+        """Gibt die mittlere Aufnahmezeit der beiden Frames zurück."""
+        return (self.info1.timestamp + self.info2.timestamp)/2
+
+
+class FramePairSynchronizer:
+    """Bildet aus den Streams von zwei Kameras Paare von Frames, deren Aufnahmezeiten höchstens max_skew Sekunden
+    auseinander liegen.
+
+    Zu jedem neuen Frame wird unter den letzten history Frames der anderen Kamera der zeitlich nächste gesucht. Frames,
+    die älter als ein gebildetes Paar sind, werden verworfen und in dropped gezählt."""
+
+    def __init__(self, camera1: CameraInterf, camera2: CameraInterf, max_skew: float = 0.02, history: int = 4):
+        self.camera1 = camera1
+        self.camera2 = camera2
+        self.max_skew = max_skew
+        self.dropped = 0
+
+        self._buffers: Tuple[deque, deque] = (deque(maxlen=history), deque(maxlen=history))
+        self._cond = threading.Condition()
+        self._pair: Optional[FramePair] = None
+        self._pair_seq = 0
+
+        camera1.connect_to_stream(self._new_frame1_event, with_info=True, direct=True)
+        camera2.connect_to_stream(self._new_frame2_event, with_info=True, direct=True)
+
+    def close(self):
+        self.camera1.disconnect_from_stream(self._new_frame1_event)
+        self.camera2.disconnect_from_stream(self._new_frame2_event)
+
+    def _new_frame1_event(self, frame: np.ndarray, info: FrameInfo):
+        self._add_frame(0, frame, info)
+
+    def _new_frame2_event(self, frame: np.ndarray, info: FrameInfo):
+        self._add_frame(1, frame, info)
+
+    def _add_frame(self, n: int, frame: np.ndarray, info: FrameInfo):
+        with self._cond:
+            own, other = self._buffers[n], self._buffers[1 - n]
+            if len(own) == own.maxlen:
+                self.dropped += 1
+            own.append((info, frame))
+            if not other:
+                return
+
+            skews = [abs(other_info.timestamp - info.timestamp) for other_info, _ in other]
+            j = skews.index(min(skews))
+            if skews[j] > self.max_skew:
+                return
+
+            # alle älteren Frames werden nicht mehr gebraucht
+            other_info, other_frame = other[j]
+            self.dropped += len(own) - 1 + j
+            own.clear()
+            for _ in range(j + 1):
+                other.popleft()
+
+            if n == 0:
+                self._pair = FramePair(frame, other_frame, info, other_info)
+            else:
+                self._pair = FramePair(other_frame, frame, other_info, info)
+            self._pair_seq += 1
+            self._cond.notify_all()
+
+    def latest_pair(self) -> (int, Optional[FramePair]):
+        """Gibt die Nummer und das letzte gebildete Paar zurück."""
+        with self._cond:
+            return self._pair_seq, self._pair
+
+    def wait_pair(self, after_seq: int = 0, timeout_s: float = 3) -> (int, FramePair):
+        """Wartet auf ein Paar mit einer Nummer größer als after_seq und gibt die Nummer und das Paar zurück."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._pair_seq > after_seq, timeout_s):
+                raise FrameTimeoutError(f"Innerhalb von {timeout_s} s wurde kein synchrones Paar von Frames "
+                                        f"gebildet.")
+            return self._pair_seq, self._pair
+
+
+class _RecordTrack:
+    """Videodatei einer Kamera in VideoRecorder."""
+
+    def __init__(self, camera: CameraInterf, writer: cv2.VideoWriter, fps: float, t0: float):
+        self.camera = camera
+        self.writer = writer
+        self.fps = fps
+        self.t0 = t0
+        self.written = 0
+        self.duplicated = 0
+        self.skipped = 0
+        self.subscriber: Optional[StreamSubscriber] = None
+        self._last_frame: Optional[np.ndarray] = None
+
+    def write(self, frame: np.ndarray, info: FrameInfo):
+        # Bildnummer im Video nach der Aufnahmezeit
+        n = round((info.timestamp - self.t0)*self.fps)
+        if n < self.written:
+            self.skipped += 1
+            return
+        if self._last_frame is None:
+            # eine später gestartete Kamera beginnt mit ihrem ersten Frame
+            self._last_frame = frame
+        self._fill(n)
+        self.writer.write(frame)
+        self.written += 1
+        self._last_frame = frame
+
+    def finish(self, n_end: int):
+        if self._last_frame is not None:
+            self._fill(n_end)
+        self._last_frame = None
+        self.writer.release()
+
+    def _fill(self, n: int):
+        # Lücken werden mit dem letzten Frame gefüllt, damit die Zeitachse stimmt
+        while self.written < n:
+            self.writer.write(self._last_frame)
+            self.written += 1
+            self.duplicated += 1
+
+
+class VideoRecorder:
+    """Nimmt die Streams einer oder mehrerer Kameras in Videodateien auf.
+
+    Die Frames kommen über einen StreamSubscriber mit queue_size Plätzen, kodiert wird im Thread des Subscribers.
+    Jeder Frame wird nach seiner Aufnahmezeit an die Stelle round((timestamp - t0)*fps) im Video geschrieben, Lücken
+    werden mit dem vorherigen Frame gefüllt und überzählige Frames übersprungen. Alle Dateien haben dieselbe
+    Startzeit t0 und werden bei stop bis zur selben Länge aufgefüllt, so dass sie Bild für Bild synchron sind."""
+
+    def __init__(self, cameras: Sequence[CameraInterf], paths: Sequence[str], fps: float = 30, queue_size: int = 8,
+                 fourcc: str = 'MJPG'):
+        if len(cameras) != len(paths):
+            raise ValueError('Für jede Kamera muss genau eine Videodatei angegeben werden.')
+        self.cameras = list(cameras)
+        self.paths = list(paths)
+        self.fps = fps
+        self.queue_size = queue_size
+        self.fourcc = fourcc
+        self.t0: Optional[float] = None
+        self._tracks: List[_RecordTrack] = []
+        self._recording = False
+
+    def is_recording(self) -> bool:
+        return self._recording
+
+    def start(self, t0: Optional[float] = None):
+        """Startet die Aufnahme. t0 ist die gemeinsame Startzeit nach CameraInterf.time (Standard: jetzt)."""
+        if self.is_recording():
+            raise CameraError('Die Aufnahme läuft bereits.')
+        self.t0 = self.cameras[0].time() if t0 is None else t0
+        fourcc = cv2.VideoWriter_fourcc(*self.fourcc)
+        self._tracks = []
+        for camera, path in zip(self.cameras, self.paths):
+            writer = cv2.VideoWriter(path, fourcc, self.fps, camera.get_resolution(), 0)
+            if not writer.isOpened():
+                for track in self._tracks:
+                    track.finish(0)
+                raise CameraError(f'Die Videodatei "{path}" kann nicht geöffnet werden.')
+            self._tracks.append(_RecordTrack(camera, writer, self.fps, self.t0))
+        for track in self._tracks:
+            track.subscriber = track.camera.connect_to_stream(track.write, with_info=True,
+                                                              queue_size=self.queue_size)
+        self._recording = True
+
+    def stop(self, t_stop: Optional[float] = None, timeout_s: float = 5):
+        """Beendet die Aufnahme. Die schon angekommenen Frames werden noch geschrieben (höchstens timeout_s lang)
+        und alle Dateien bis t_stop (Standard: jetzt) aufgefüllt."""
+        if not self._recording:
+            return
+        if t_stop is None:
+            t_stop = self.cameras[0].time()
+        for track in self._tracks:
+            if not track.subscriber.flush(timeout_s):
+                logging.warning(f'Die Aufnahme der Kamera {track.camera} wurde nicht vollständig geschrieben.')
+            track.camera.disconnect_from_stream(track.write)
+        n_end = round((t_stop - self.t0)*self.fps)
+        for track in self._tracks:
+            track.finish(n_end)
+        self._recording = False
+
+    def stats(self) -> List[Dict[str, int]]:
+        """Gibt für jede Kamera die Anzahl der geschriebenen, duplizierten und verworfenen Frames zurück. dropped
+        zählt die Frames, die wegen voller Warteschlange oder als überzählig nicht geschrieben wurden."""
+        return [{'written': track.written, 'duplicated': track.duplicated,
+                 'dropped': track.subscriber.dropped + track.skipped} for track in self._tracks]
 
 
 class CameraError(Exception):
     """Alle Fehler, die mit Camera verbunden sind."""
 
+
+class FrameTimeoutError(CameraError, TimeoutError):
+    """Innerhalb der gegebenen Zeit ist kein neuer Frame angekommen."""
+
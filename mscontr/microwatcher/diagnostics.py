@@ -0,0 +1,90 @@
+import logging
+import os
+import queue
+import threading
+from time import monotonic
+from typing import Callable, Dict, Union
+
+import numpy as np
+import cv2
+
+
+Image = Union[np.ndarray, Callable[[], np.ndarray]]
+
+
+class DiagnosticsSink:
+    """Senke für die Diagnosebilder der Erkennungsfunktionen. Diese Basisklasse verwirft alle Bilder."""
+
+    enabled = False
+
+    def dump(self, name: str, image: Image):
+        """Übergibt ein Diagnosebild. name ist der relative Dateipfad (z.B. 'jet_errors/jet_error.png'). Statt
+        des Bildes kann auch eine Funktion übergeben werden, die das Bild erst bei Bedarf erzeugt."""
+
+    def close(self):
+        pass
+
+
+class AsyncImageSink(DiagnosticsSink):
+    """Speichert die Diagnosebilder in einem Hintergrund-Thread.
+
+    Pro Name wird höchstens ein Bild je min_interval Sekunden angenommen. Wenn die Warteschlange voll ist, wird
+    das Bild verworfen und gezählt, damit die Erkennung nie auf die Festplatte warten muss."""
+
+    enabled = True
+
+    def __init__(self, directory: str = '.', min_interval: float = 1, max_queue: int = 16):
+        self.directory = directory
+        self.min_interval = min_interval
+        self.dropped = 0
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._last_dump: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+    def dump(self, name: str, image: Image):
+        now = monotonic()
+        with self._lock:
+            last = self._last_dump.get(name)
+            if last is not None and now - last < self.min_interval:
+                return
+            self._last_dump[name] = now
+
+        if callable(image):
+            image = image()
+        else:
+            # der Frame kann vom Aufrufer weiterverwendet werden
+            image = np.array(image)
+
+        try:
+            self._queue.put_nowait((name, image))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def flush(self):
+        """Wartet, bis alle angenommenen Bilder gespeichert sind."""
+        self._queue.join()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                name, image = item
+                path = os.path.join(self.directory, name)
+                os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+                if not cv2.imwrite(path, image):
+                    logging.warning(f'Diagnosebild "{path}" konnte nicht gespeichert werden.')
+            except Exception as err:
+                logging.exception(err)
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,167 @@
+import json
+import threading
+from bisect import bisect_left
+from time import perf_counter
+from typing import Dict, List, Optional
+
+
+class Histogram:
+    """Histogramm von Dauern in s mit festen, logarithmisch verteilten Klassen von 1 µs bis 100 s (10 Klassen pro
+    Dekade). Die Quantile werden aus den Klassen geschätzt und sind auf etwa 12 % genau. Nicht thread-sicher, das
+    übernimmt MetricsRegistry."""
+
+    BOUNDS: List[float] = [10**(k/10) for k in range(-60, 21)]
+
+    def __init__(self):
+        self.counts = [0]*(len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+
+    def add(self, value: float):
+        self.counts[bisect_left(self.BOUNDS, value)] += 1
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Schätzt das q-Quantil (0 <= q <= 1) durch lineare Interpolation innerhalb der Klasse."""
+        if not self.count:
+            return None
+        rank = q*self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                low = self.BOUNDS[i - 1] if i > 0 else 0.0
+                high = self.BOUNDS[i] if i < len(self.BOUNDS) else self.max
+                value = low + (high - low)*(rank - seen)/n
+                return min(max(value, self.min), self.max)
+            seen += n
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        """Kennzahlen in ms."""
+        if not self.count:
+            return {'count': 0}
+        return {'count': self.count,
+                'mean_ms': 1000*self.total/self.count,
+                'min_ms': 1000*self.min,
+                'p50_ms': 1000*self.quantile(0.5),
+                'p90_ms': 1000*self.quantile(0.9),
+                'p99_ms': 1000*self.quantile(0.99),
+                'max_ms': 1000*self.max}
+
+
+class _NullStage:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class Metrics:
+    """Ablage für die Laufzeiten der Stufen und die Zähler der Erkennung. Diese Basisklasse verwirft alles."""
+
+    enabled = False
+
+    def stage(self, name: str):
+        """Gibt einen Kontextmanager zurück, der die Dauer des with-Blocks unter name aufzeichnet."""
+        return _NULL_STAGE
+
+    def observe(self, name: str, seconds: float):
+        """Zeichnet eine Dauer in s unter name auf."""
+
+    def count(self, name: str, n: int = 1):
+        """Erhöht den Zähler name um n."""
+
+    def record_call(self, name: str, seconds: float, ok: bool):
+        """Zeichnet einen ganzen Aufruf auf: die Dauer unter name und das Ergebnis in den Zählern name.ok bzw.
+        name.failed."""
+
+    def snapshot(self) -> dict:
+        return {'counters': {}, 'histograms': {}}
+
+    def dump(self, path: str):
+        """Speichert snapshot() als JSON."""
+        with open(path, 'w') as file:
+            json.dump(self.snapshot(), file, indent=2)
+
+    def reset(self):
+        pass
+
+
+class _Stage:
+    __slots__ = ('_registry', '_name', '_start')
+
+    def __init__(self, registry: 'MetricsRegistry', name: str):
+        self._registry = registry
+        self._name = name
+
+    def __enter__(self):
+        self._start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._registry.observe(self._name, perf_counter() - self._start)
+        return False
+
+
+class MetricsRegistry(Metrics):
+    """Thread-sichere Ablage mit einem Histogramm pro Stufe und Zählern. Ein Eintrag kostet etwa 2 µs, das ist
+    gegenüber der Erkennung (Millisekunden) vernachlässigbar."""
+
+    enabled = True
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, Histogram] = {}
+        self._counters: Dict[str, int] = {}
+
+    def stage(self, name: str) -> _Stage:
+        return _Stage(self, name)
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.add(seconds)
+
+    def count(self, name: str, n: int = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def record_call(self, name: str, seconds: float, ok: bool):
+        self.observe(name, seconds)
+        self.count(f'{name}.ok' if ok else f'{name}.failed')
+
+    def histogram(self, name: str) -> Dict[str, float]:
+        """Kennzahlen (in ms) der Stufe name."""
+        with self._lock:
+            histogram = self._histograms.get(name)
+            return histogram.summary() if histogram is not None else {'count': 0}
+
+    def counter(self, name: str) -> int:
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def snapshot(self) -> dict:
+        """Gibt alle Zähler und die Kennzahlen aller Histogramme (in ms) zurück."""
+        with self._lock:
+            return {'counters': dict(sorted(self._counters.items())),
+                    'histograms': {name: histogram.summary()
+                                   for name, histogram in sorted(self._histograms.items())}}
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
@@ -1,5 +1,11 @@
-import threading, random
-from copy import deepcopy
+import sys, threading, random
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from multiprocessing.util import Finalize
+from typing import NamedTuple, Optional, Tuple, Union
 from time import sleep
 
 import numpy as np
@@ -11,72 +17,117 @@ from motor_controller import Motor, Box
 from motor_controller.Phytron_MCC2 import MCC2BoxEmulator
 import mscontr.microwatcher as microwatcher
 from mscontr.microwatcher.plasma_watcher import CameraCoordinates, show
+from mscontr.microwatcher.sim_clock import WallClock
 
 DATA_FOLDER = microwatcher.__file__[:-11]+"data/"
 
 
 def paint_circle(frame: np.ndarray, x: float, y: float, radius: float) -> None:
     if radius > 0:
-        i_a = np.arange(2048)
-        range_ = np.arange(1088)
-        range_ = range_[np.abs(1088 - range_ - y - 1088 / 2) < radius + 60]
-        # print(range_)
-        for j in range_:
-            r = np.sqrt((i_a - x - 2048 / 2) ** 2 + (1088 - j - y - 1088 / 2) ** 2)
+        # Außerhalb von radius + 60 ist der Zuwachs kleiner als 1 und geht beim Speichern als uint8 verloren, es
+        # reicht also, das umgebende Rechteck zu zeichnen.
+        rows = np.arange(1088)
+        rows = rows[np.abs(1088 - rows - y - 1088 / 2) < radius + 60]
+        cols = np.arange(2048)
+        cols = cols[np.abs(cols - x - 2048 / 2) < radius + 60]
+        if len(rows) == 0 or len(cols) == 0:
+            return
+        rows = rows[:, np.newaxis]
+
+        r = np.sqrt((cols - x - 2048 / 2) ** 2 + (1088 - rows - y - 1088 / 2) ** 2)
+        window = frame[rows[0, 0]:rows[-1, 0] + 1, cols[0]:cols[-1] + 1]
+
+        line = window + 255 / (0.1 * (r - radius + 1) ** 2 + 1)
+        line[r < radius] = 255
+        np.minimum(line, 255, out=line)
+
+        window[:, :] = line
+
+
+@lru_cache(maxsize=64)
+def _line_profile_shape(frac: float, d: float) -> (int, np.ndarray):
+    """Gibt die erste Spalte relativ zu floor(line_x) und das Profil sin(arccos(...)) eines Jets zurück, dessen Mitte
+    frac Pixel rechts von einer ganzen Spalte liegt."""
+    k = np.arange(np.floor(frac - d/2), np.ceil(frac + d/2) + 1)
+    k = k[np.abs(k - frac) < d/2]
+    profile = np.sin(np.arccos((k - frac)*2/d))
+    profile.flags.writeable = False
+    return (int(k[0]) if len(k) else 0), profile
+
+
+def _line_profile(line_x: float, d: float) -> (int, np.ndarray):
+    """Gibt die erste Spalte und das Profil sin(arccos(...)) des Jets über seine Spalten im Frame zurück.
+
+    Das Profil hängt nur vom Bruchteil der Position ab (auf 1/1000 Pixel gerundet), deshalb wird es auch bei einem
+    bewegten Jet aus dem Cache genommen und nur verschoben."""
+    center = line_x + 2048 / 2
+    n = int(np.floor(center))
+    k0, profile = _line_profile_shape(round(center - n, 3), d)
+    c0 = n + k0
+    c1 = c0 + len(profile)
+    profile = profile[max(-c0, 0):len(profile) - max(c1 - 2048, 0)]
+    return min(max(c0, 0), 2048), profile
 
-            line = np.zeros(2048)
-            line = frame[j, :] + 255 / (0.1 * (r - radius + 1) ** 2 + 1)
-            line[r < radius] = 255
-            line[line > 255] = 255
-
-            frame[j, :] = line
 
 def paint_line(frame: np.ndarray, line_x: float, d: float, transp=0.8) -> None:
-    range_ = np.arange(2048)
-    range_ = range_[np.abs(range_ - line_x - 2048 / 2) < d/2]
-    # print(range_)
-    line_frame = 254*np.ones(frame.shape)
-    for i in range_:
-        line_frame[:, i] = line_frame[:, i]*(1-transp)*np.sin(np.arccos((i - line_x - 2048 / 2)*2/d))
-
-    mask = np.array(frame)
-    frame[:,:] = frame[:,:] + line_frame[:,:]
-    mask[:, :] = mask[:, :] + line_frame[:, :]
-
-    frame[mask > 254] = 254
-
-
-def paint_nozzle(frame: np.ndarray, nozzle: np.ndarray, nozzle_x: float) -> None:
-
-    nozzle = nozzle.copy()
-    ym, xm = nozzle.shape
-    # show(frame)
-    # show(nozzle)
-
-    if nozzle_x < - xm/2 - 200 or nozzle_x > xm/2 + 200:
-        return
-
-    big_nozzle_frame = np.ones((300, xm*3))
-
-    shift = round(nozzle_x)
-
-    big_nozzle_frame[0:300, xm+shift:2*xm+shift] = nozzle[0:300, :]
-    # show(big_nozzle_frame)
-
-    nozzle[:300, :] = big_nozzle_frame[:, xm:2*xm]
-    # show(nozzle)
-
-    mask = nozzle != 1
-    frame[mask] = nozzle[mask]
-    # show(frame)
+    c0, profile = _line_profile(line_x, d)
+    # Nur die Spalten des Jets werden geändert, der Hintergrund bleibt wie er ist
+    band = frame[:, c0:c0 + len(profile)] + 254*(1-transp)*profile
+    np.minimum(band, 254, out=band)
+    frame[:, c0:c0 + len(profile)] = band
+
+
+class NozzleSprite:
+    """Vorbereitetes Bild der Düse für paint_nozzle.
+
+    Das Bild hat die Größe des Frames, der Wert 1 ist durchsichtig. Die oberen shift_rows Zeilen werden mit der Düse
+    verschoben, der Rest bleibt stehen. Maske und umgebendes Rechteck der sichtbaren Pixel werden einmal berechnet,
+    pro Frame wird nur noch dieser Bereich kopiert."""
+
+    def __init__(self, nozzle: np.ndarray, shift_rows: int = 300):
+        self.shape = nozzle.shape
+        self._moving = self._crop(nozzle, 0, shift_rows)
+        self._static = self._crop(nozzle, shift_rows, nozzle.shape[0])
+
+    @staticmethod
+    def _crop(nozzle: np.ndarray, row1: int, row2: int) \
+            -> Optional[Tuple[np.ndarray, np.ndarray, Tuple[int, int, int, int]]]:
+        part = nozzle[row1:row2]
+        mask = part != 1
+        rows = np.nonzero(mask.any(axis=1))[0]
+        cols = np.nonzero(mask.any(axis=0))[0]
+        if len(rows) == 0:
+            return None
+        y1, y2, x1, x2 = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+        return part[y1:y2, x1:x2].copy(), mask[y1:y2, x1:x2].copy(), (row1 + y1, row1 + y2, x1, x2)
+
+    def paint(self, frame: np.ndarray, nozzle_x: float) -> None:
+        ym, xm = self.shape
+        if nozzle_x < - xm/2 - 200 or nozzle_x > xm/2 + 200:
+            return
+
+        shift = round(nozzle_x)
+        if self._moving is not None:
+            sprite, mask, (y1, y2, x1, x2) = self._moving
+            dst1, dst2 = max(x1 + shift, 0), min(x2 + shift, xm)
+            if dst1 < dst2:
+                src = slice(dst1 - shift - x1, dst2 - shift - x1)
+                np.copyto(frame[y1:y2, dst1:dst2], sprite[:, src], where=mask[:, src])
+        if self._static is not None:
+            sprite, mask, (y1, y2, x1, x2) = self._static
+            np.copyto(frame[y1:y2, x1:x2], sprite, where=mask)
+
+
+def paint_nozzle(frame: np.ndarray, nozzle: Union[np.ndarray, NozzleSprite], nozzle_x: float) -> None:
+    if not isinstance(nozzle, NozzleSprite):
+        nozzle = NozzleSprite(nozzle)
+    nozzle.paint(frame, nozzle_x)
 
 
 def paint_line_white(frame: np.ndarray, line_x: float, d: float, transp=0.4) -> None:
-    range_ = np.arange(2048)
-    range_ = range_[np.abs(range_ - line_x - 2048 / 2) < d/2]
-    # print(range_)
-    for i in range_:
-        frame[:, i] = frame[:, i]*(1 - (1-transp)*np.sin(np.arccos((i - line_x - 2048 / 2)*2/d)))
+    c0, profile = _line_profile(line_x, d)
+    band = frame[:, c0:c0 + len(profile)]
+    band[:, :] = band*(1 - (1-transp)*profile)
 
 
 def intens_from_dist(dist: float, d: float, intens_max: float = 1) -> float:
@@ -90,21 +141,197 @@ def plasma_radius_from_intens(intens: float, radius_max: float = 1, intens_max:
     return intens*radius_max/intens_max
 
 
-def flicker(mu: float, sigma: float):
+def flicker(mu: float, sigma: float, rng: random.Random = random):
     if sigma == 0:
         return mu
     if mu == 0:
         return 0
-    res = random.normalvariate(mu, sigma)
+    res = rng.normalvariate(mu, sigma)
     if res < 0:
         return 0
     return res
 
 
+class RenderSettings(NamedTuple):
+    """Alles außer den Motorpositionen, was render_frame für einen Frame braucht. Lässt sich an andere Prozesse
+    übergeben."""
+    bg: np.ndarray
+    nozzle: NozzleSprite
+    psi1: float  # Winkel der Kamera 1 zur X-Achse in rad
+    psi2: float
+    g1: float
+    g2: float
+    jet_d: float
+    laser_jet_shift: float
+    flicker_sigma: float
+    exposure: float
+    normal_exposure: float
+    dark_exposure: float
+    laser_on: bool
+
+
+class FrameTruth(NamedTuple):
+    """Wahre Positionen in einem emulierten Frame in Pixel (Spalte, Zeile). Ohne Plasma sind plasma_x und plasma_y
+    nan und plasma_r 0."""
+    jet_x: float
+    plasma_x: float
+    plasma_y: float
+    plasma_r: float
+
+
+TRUTH_DTYPE = np.dtype([(name, float) for name in FrameTruth._fields])
+
+
+def _project(settings: RenderSettings, camera_n: int, x: float, z: float, l_y: float) -> (float, float, float):
+    """Gibt die Position des Jets und die Höhe des Lasers im Bild der Kamera (relativ zur Mitte) und die Vergrößerung
+    zurück."""
+    if camera_n == 1:
+        g = settings.g1
+        pl_x, pl_z = CameraCoordinates(settings.psi1, None, None).mc_to_cc(x, z)
+    else:
+        g = settings.g2
+        pl_x, pl_z = CameraCoordinates(settings.psi2, None, None).mc_to_cc(x, z)
+    return pl_z/g, l_y/g, g
+
+
+def render_static_layer(settings: RenderSettings, pl_z: float, g: float, out: np.ndarray) -> None:
+    """Zeichnet Hintergrund, Jet und Düse bei der Belichtung aus settings in out."""
+    out[:, :] = settings.bg
+
+    paint_line(out, line_x=pl_z, d=settings.jet_d / g, transp=0.6)
+    paint_nozzle(out, settings.nozzle, nozzle_x=pl_z)
+
+    k = settings.exposure / settings.normal_exposure
+    scaled = out*k
+    out[:, :] = scaled
+    out[scaled > 254] = 254
+    out[out < 1] = 1
+
+
+def _paint_plasma(frame: np.ndarray, settings: RenderSettings, z: float, l_z: float, pl_z: float, pl_y: float,
+                  g: float, rng: random.Random) -> FrameTruth:
+    plasma_radius = 0
+    if settings.laser_on:
+        intens = intens_from_dist(dist=abs(z - l_z - settings.laser_jet_shift), d=settings.jet_d)
+        intens = flicker(intens, settings.flicker_sigma, rng)
+        intens *= settings.exposure / settings.dark_exposure
+        plasma_radius = plasma_radius_from_intens(intens, radius_max=6*settings.jet_d/(2*g))
+        paint_circle(frame, pl_z, pl_y, plasma_radius)
+
+    ym, xm = frame.shape
+    if plasma_radius > 0:
+        return FrameTruth(pl_z + xm/2, pl_z + xm/2, ym/2 - pl_y, plasma_radius)
+    return FrameTruth(pl_z + xm/2, np.nan, np.nan, 0)
+
+
+def render_frame(settings: RenderSettings, camera_n: int, x: float, z: float, l_y: float, l_z: float,
+                 rng: random.Random = random, out: Optional[np.ndarray] = None) -> (np.ndarray, FrameTruth):
+    """Zeichnet den Frame der Kamera camera_n für die angegebenen Motorpositionen (in displ) und gibt ihn mit den
+    wahren Positionen zurück. Hängt nur von den Argumenten ab."""
+    if out is None:
+        out = np.empty(settings.bg.shape, dtype='uint8')
+    pl_z, pl_y, g = _project(settings, camera_n, x, z, l_y)
+    render_static_layer(settings, pl_z, g, out)
+    return out, _paint_plasma(out, settings, z, l_z, pl_z, pl_y, g, rng)
+
+
+def _render_range(settings: RenderSettings, frames1: np.ndarray, frames2: np.ndarray, params: np.ndarray, start: int,
+                  stop: int) -> np.ndarray:
+    truth = np.empty((stop - start, 2), dtype=TRUTH_DTYPE)
+    static_layers = {}
+    for i in range(start, stop):
+        x, z, l_y, l_z, exposure, seed = params[i]
+        frame_settings = settings._replace(exposure=exposure)
+        for camera_n, frames in [(1, frames1), (2, frames2)]:
+            pl_z, pl_y, g = _project(frame_settings, camera_n, x, z, l_y)
+            # der Jet steht in Datensätzen oft still, dann wird nur das Plasma neu gezeichnet
+            key = (pl_z, exposure)
+            if static_layers.get(camera_n, (None,))[0] != key:
+                render_static_layer(frame_settings, pl_z, g, frames[i])
+                static_layers[camera_n] = (key, frames[i].copy())
+            else:
+                frames[i] = static_layers[camera_n][1]
+            rng = random.Random(f'{int(seed)}/{camera_n}')
+            truth[i - start, camera_n - 1] = _paint_plasma(frames[i], frame_settings, z, l_z, pl_z, pl_y, g, rng)
+    return truth
+
+
+class SharedFrames:
+    """Frame-Paare (frames1, frames2, je (n, 1088, 2048) uint8) in Shared Memory für JetEmulator.render_batch.
+
+    Mit processes > 0 schreiben die Prozesse direkt hinein, ohne Kopie. Der Speicher bleibt bis close (oder dem Ende
+    des with-Blocks) bestehen, danach dürfen frames1 und frames2 nicht mehr benutzt werden."""
+
+    def __init__(self, n: int, frame_shape: Tuple[int, int] = (1088, 2048)):
+        self._shm = SharedMemory(create=True, size=2*n*frame_shape[0]*frame_shape[1])
+        self.name = self._shm.name
+        self.frames: Optional[np.ndarray] = np.ndarray((2, n) + tuple(frame_shape), dtype='uint8',
+                                                       buffer=self._shm.buf)
+        self.frames1, self.frames2 = self.frames
+
+    def close(self):
+        """Gibt den Speicher frei. Wirft BufferError, wenn noch Ansichten der Frames benutzt werden."""
+        if self.frames is None:
+            return
+        self.frames = self.frames1 = self.frames2 = None
+        self._shm.close()
+        self._shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+
+# Zustand der Prozesse von JetEmulator.render_batch
+_worker_state = {}
+
+
+def _attach_shared_memory(name: str) -> SharedMemory:
+    """Öffnet einen vorhandenen Shared-Memory-Block, ohne ihn dem resource_tracker zu überlassen.
+
+    Freigegeben (unlink) wird der Block nur von dem, der ihn angelegt hat. Ab Python 3.13 meldet track=False ihn gar
+    nicht erst an. Davor meldet SharedMemory jeden geöffneten Block an: teilt der Prozess den resource_tracker mit dem
+    Hauptprozess (so bei ProcessPoolExecutor), ist der Name dort schon angemeldet und darf nicht abgemeldet werden, sonst
+    fehlt die Anmeldung des Hauptprozesses. Hat der Prozess einen eigenen resource_tracker, wird wieder abgemeldet,
+    sonst löscht dieser den Block, sobald der Prozess endet."""
+    if sys.version_info >= (3, 13):
+        return SharedMemory(name=name, track=False)
+    own_tracker = resource_tracker._resource_tracker._fd is None
+    shm = SharedMemory(name=name)
+    if own_tracker:
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+def _init_render_worker(settings: RenderSettings, shm_name: str, shape: Tuple[int, ...], params: np.ndarray):
+    shm = _attach_shared_memory(shm_name)
+    frames = np.ndarray(shape, dtype='uint8', buffer=shm.buf)
+    _worker_state.update(settings=settings, shm=shm, frames=frames, params=params)
+    # atexit läuft in den Prozessen von multiprocessing nicht, Finalize mit exitpriority schon
+    Finalize(None, _close_render_worker, exitpriority=0)
+
+
+def _close_render_worker():
+    """Schließt beim Ende eines Prozesses von render_batch den Shared-Memory-Block (ohne unlink)."""
+    shm = _worker_state.pop('shm', None)
+    _worker_state.clear()
+    if shm is not None:
+        shm.close()
+
+
+def _render_worker_range(start: int, stop: int) -> (int, np.ndarray):
+    state = _worker_state
+    truth = _render_range(state['settings'], state['frames'][0], state['frames'][1], state['params'], start, stop)
+    return start, truth
+
+
 class JetEmulator:
     def __init__(self, def_init: bool = True, jet_x: Motor = None, jet_z: Motor = None, laser_z: Motor = None, laser_y: Motor = None,
                  phi: float = 90, psi: float = 45, g1: float = 10, g2: float = 10,
-                 jet_d: float = 70, laser_d: float = 70, laser_jet_shift: float = 0, flicker_sigma: float = 0):
+                 jet_d: float = 70, laser_d: float = 70, laser_jet_shift: float = 0, flicker_sigma: float = 0,
+                 clock: WallClock = None, seed: Optional[int] = None):
 
         if def_init:
             self.box_emulator = MCC2BoxEmulator(n_bus=2, n_axes=2, realtime=False)
@@ -149,27 +376,47 @@ class JetEmulator:
 
         self._bg = cv2.imread(DATA_FOLDER+'hintg.bmp', 0)
         self._bg[:, :] = 0.1*self._bg[:, :]
-        self._nozzle = cv2.imread(DATA_FOLDER + 'nozzle.bmp', 0)
+        self._nozzle = NozzleSprite(cv2.imread(DATA_FOLDER + 'nozzle.bmp', 0))
 
         self.laser_on = False
 
         self._drift_on = False
 
+        # Zeitbasis für Stream und Drift, mit VirtualClock schneller als in Echtzeit
+        self.clock = WallClock() if clock is None else clock
+        # Flackern mit eigenem Zufallsgenerator pro Kamera, damit es bei gegebenem seed reproduzierbar ist
+        self._flicker_rng = {camera_n: random.Random(None if seed is None else f'{seed}/{camera_n}')
+                             for camera_n in [1, 2]}
+
+        # die Kameras können gleichzeitig Frames anfordern, die Motoren werden nacheinander abgefragt
+        self._motors_lock = threading.Lock()
+
+        # Hintergrund, Jet und Düse ändern sich nur mit der Jet-Position und der Belichtung und werden gespeichert,
+        # pro Frame wird nur das Plasma neu gezeichnet
+        self.static_cache_size = 8
+        self._static_cache = OrderedDict()
+        self._static_cache_lock = threading.Lock()
+
     def realtime(self, realtime: bool):
         self.box_emulator.realtime = realtime
 
     def plasma_drift_on(self, speed: float = 2, max_shift: float = 1000, update_freq: float = 4):
         def drift(self, speed: float, max_shift: float, update_freq: float):
             direction = 1
-            while self._drift_on:
-                if abs(self.laser_jet_shift) > max_shift:
-                    direction = -self.laser_jet_shift/abs(self.laser_jet_shift)
-                self.laser_jet_shift += direction*speed/update_freq
-                sleep(1/update_freq)
+            try:
+                while self._drift_on:
+                    if abs(self.laser_jet_shift) > max_shift:
+                        direction = -self.laser_jet_shift/abs(self.laser_jet_shift)
+                    self.laser_jet_shift += direction*speed/update_freq
+                    self.clock.sleep(1/update_freq)
+            finally:
+                self.clock.unregister()
             print('drift_on:', self._drift_on)
 
         self._drift_on = True
-        threading.Thread(target=drift, args=(self, speed, max_shift, update_freq)).start()
+        thread = threading.Thread(target=drift, args=(self, speed, max_shift, update_freq))
+        self.clock.register(thread)
+        thread.start()
 
     def plasma_drift_off(self):
         self._drift_on = False
@@ -198,37 +445,102 @@ class JetEmulator:
         if camera_n not in [1, 2]:
             raise ValueError(f'Unerwartete Kameranummer "{camera_n}"')
 
-        x = self.j_x()
-        z = self.j_z()
-        if camera_n == 1:
-            g = self.g1
-            pl_x, pl_z = self.camera1_coord.mc_to_cc(x, z)
-            pl_z /= g
-        else:
-            g = self.g2
-            pl_x, pl_z = self.camera2_coord.mc_to_cc(x, z)
-            pl_z /= g
-        pl_y = self.l_y()/g
-
-        frame = deepcopy(self._bg)
-
-        paint_line(frame, line_x=pl_z, d=self.jet_d / g, transp=0.6)
-        paint_nozzle(frame, self._nozzle, nozzle_x=pl_z)
-
-        k = self.exposure / self.normal_exposure
-        mask = np.array(frame)*k
-        frame[:,:] = frame[:,:] * k
-        frame[mask > 254] = 254
-        frame[frame < 1] = 1
+        with self._motors_lock:
+            x = self.j_x()
+            z = self.j_z()
+            l_y = self.l_y()
+            l_z = self.l_z()
 
+        settings = self.render_settings()
+        pl_z, pl_y, g = _project(settings, camera_n, x, z, l_y)
+        frame = self._static_layer(settings, camera_n, pl_z, g).copy()
+        _paint_plasma(frame, settings, z, l_z, pl_z, pl_y, g, self._flicker_rng[camera_n])
+        return frame
 
-        if self.laser_on:
-            intens = intens_from_dist(dist=abs(self.j_z()-self.l_z()-self.laser_jet_shift), d=self.jet_d)
-            intens = flicker(intens, self.flicker_sigma)
-            intens *= self.exposure / self.dark_exposure
-            plasma_radius = plasma_radius_from_intens(intens, radius_max=6*self.jet_d/(2*g))
-            paint_circle(frame, pl_z, pl_y, plasma_radius)
-
+    def render_settings(self) -> RenderSettings:
+        """Gibt die aktuellen Einstellungen für render_frame zurück."""
+        return RenderSettings(self._bg, self._nozzle, self.camera1_coord.psi, self.camera2_coord.psi, self.g1, self.g2,
+                              self.jet_d, self.laser_jet_shift, self.flicker_sigma, self.exposure,
+                              self.normal_exposure, self.dark_exposure, self.laser_on)
+
+    def render_batch(self, x, z, l_y, l_z, exposure=None, seeds=None, processes: int = 0,
+                     out1: Optional[np.ndarray] = None, out2: Optional[np.ndarray] = None,
+                     shared: Optional[SharedFrames] = None) -> (np.ndarray, np.ndarray, np.ndarray, np.ndarray):
+        """Zeichnet N Frame-Paare für die Motorpositionen x, z, l_y, l_z (in displ, Arrays der Länge N oder Zahlen)
+        unabhängig von den Motoren des Emulators.
+
+        exposure ist die Belichtung pro Frame (Standard: self.exposure), seeds die Startwerte für das Flackern pro Frame
+        (Standard: 0 bis N-1). Bei processes > 0 wird auf so vielen Prozessen über Shared Memory gezeichnet. Gibt
+        frames1, frames2 (N, 1088, 2048) und die wahren Positionen truth1, truth2 (N Einträge mit den Feldern von
+        FrameTruth) zurück. Die Frames werden in out1 und out2 geschrieben, wenn angegeben, oder in shared
+        (SharedFrames für N Paare), dann sind frames1 und frames2 shared.frames1 und shared.frames2.
+
+        Ohne shared zeichnen die Prozesse in einen eigenen Shared-Memory-Block, der danach in frames1 und frames2
+        kopiert wird: das kostet eine Kopie aller Frames und bis zum Ende zusätzlich den Speicher des ganzen Batches
+        (2*N*2.2 MB). Für große Batches sollte deshalb shared benutzt werden."""
+
+        if exposure is None:
+            exposure = self.exposure
+        x, z, l_y, l_z, exposure = np.broadcast_arrays(*np.atleast_1d(x, z, l_y, l_z, exposure))
+        n = len(x)
+        if seeds is None:
+            seeds = np.arange(n)
+        params = np.column_stack([x, z, l_y, l_z, exposure, np.broadcast_to(seeds, (n,))]).astype(float)
+
+        settings = self.render_settings()
+        shape = (n,) + settings.bg.shape
+        if shared is not None:
+            if out1 is not None or out2 is not None:
+                raise ValueError('Entweder out1/out2 oder shared angeben.')
+            if shared.frames.shape[1:] != shape:
+                raise ValueError(f'shared hat die Form {shared.frames.shape[1:]}, gebraucht wird {shape}.')
+            out1, out2 = shared.frames1, shared.frames2
+        frames1 = np.empty(shape, dtype='uint8') if out1 is None else out1
+        frames2 = np.empty(shape, dtype='uint8') if out2 is None else out2
+        truth = np.empty((n, 2), dtype=TRUTH_DTYPE)
+
+        if processes <= 0 or n < 2:
+            truth[:] = _render_range(settings, frames1, frames2, params, 0, n)
+            return frames1, frames2, truth[:, 0], truth[:, 1]
+
+        own_shared = shared is None
+        if own_shared:
+            shared = SharedFrames(n, settings.bg.shape)
+        try:
+            chunk = max(1, -(-n // (4*processes)))
+            with ProcessPoolExecutor(processes, initializer=_init_render_worker,
+                                     initargs=(settings, shared.name, shared.frames.shape, params)) as pool:
+                futures = [pool.submit(_render_worker_range, start, min(start + chunk, n))
+                           for start in range(0, n, chunk)]
+                for future in futures:
+                    start, chunk_truth = future.result()
+                    truth[start:start + len(chunk_truth)] = chunk_truth
+            if own_shared:
+                frames1[:] = shared.frames1
+                frames2[:] = shared.frames2
+        finally:
+            if own_shared:
+                shared.close()
+        return frames1, frames2, truth[:, 0], truth[:, 1]
+
+    def _static_layer(self, settings: RenderSettings, camera_n: int, pl_z: float, g: float) -> np.ndarray:
+        """Gibt den Frame ohne Plasma (Hintergrund, Jet und Düse bei der aktuellen Belichtung) zurück."""
+
+        key = (camera_n, pl_z, g, settings.jet_d, settings.exposure, settings.normal_exposure)
+        with self._static_cache_lock:
+            frame = self._static_cache.get(key)
+            if frame is not None:
+                self._static_cache.move_to_end(key)
+                return frame
+
+        frame = np.empty(settings.bg.shape, dtype='uint8')
+        render_static_layer(settings, pl_z, g, frame)
+        frame.flags.writeable = False
+
+        with self._static_cache_lock:
+            self._static_cache[key] = frame
+            while len(self._static_cache) > self.static_cache_size:
+                self._static_cache.popitem(last=False)
         return frame
 
     # def plasma_intens(self) -> float:
@@ -276,15 +588,25 @@ class CameraEmulator(CameraInterf):
     def get_gain(self) -> float:
         return 0
 
+    def time(self) -> float:
+        return self.jet_emulator.clock.time()
+
     def start_stream(self, delay: float = 0):
         self.stream_on = True
-        threading.Thread(target=self._stream).start()
+        thread = threading.Thread(target=self._stream)
+        self.jet_emulator.clock.register(thread)
+        thread.start()
         self.mode = 'stream'
 
     def _stream(self):
-        while self.stream_on:
-            self.new_frame_event(self.get_frame())
-            sleep(1/self.fps)
+        clock = self.jet_emulator.clock
+        try:
+            while self.stream_on:
+                timestamp = clock.time()
+                self.new_frame_event(self.get_frame(), timestamp)
+                clock.sleep(1/self.fps)
+        finally:
+            clock.unregister()
 
     def stop_stream(self):
         self.stream_on = False
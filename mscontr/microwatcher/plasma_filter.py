@@ -0,0 +1,176 @@
+import threading
+from typing import NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+class AxisState(NamedTuple):
+    """Gefilterter Wert einer Größe, ihre Änderungsrate (pro s) und deren Kovarianzmatrix (2x2)."""
+    value: float
+    rate: float
+    covariance: np.ndarray
+
+    @property
+    def sigma(self) -> float:
+        return float(np.sqrt(self.covariance[0, 0]))
+
+    @property
+    def rate_sigma(self) -> float:
+        return float(np.sqrt(self.covariance[1, 1]))
+
+
+class AxisKalman:
+    """Kalman-Filter für eine Größe mit ungefähr konstanter Änderungsrate.
+
+    process_noise ist die spektrale Dichte der zufälligen Beschleunigung (Einheit²/s³), measurement_noise die
+    Standardabweichung einer Messung. Die erste Messung setzt den Wert, die Rate startet bei 0 mit der
+    Standardabweichung initial_rate_sigma (Standard: das Rauschen der ersten Messung pro s). Messungen, die mehr als
+    gate Standardabweichungen von der Vorhersage abweichen, werden verworfen. Nach max_outliers solchen Messungen
+    hintereinander wird der Filter auf die Messung neu gesetzt (z.B. nach einer Bewegung, von der der Filter nichts
+    weiß). Nicht thread-sicher, das übernimmt PlasmaFilter."""
+
+    def __init__(self, process_noise: float, measurement_noise: float, initial_rate_sigma: Optional[float] = None,
+                 gate: float = 4, max_outliers: int = 3):
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.initial_rate_sigma = initial_rate_sigma
+        self.gate = gate
+        self.max_outliers = max_outliers
+        self.reset()
+
+    def reset(self):
+        self.t: Optional[float] = None
+        self._x: Optional[np.ndarray] = None
+        self._p: Optional[np.ndarray] = None
+        self.samples = 0
+        self.outliers = 0
+
+    def state(self, t: Optional[float] = None) -> Optional[AxisState]:
+        """Gibt den Zustand zur Zeit t (Standard: Zeit der letzten Messung) zurück, None vor der ersten Messung."""
+        if self._x is None:
+            return None
+        x, p = self._predict(self.t if t is None else t)
+        return AxisState(float(x[0]), float(x[1]), p)
+
+    def update(self, t: float, value: float, sigma: float = 0, noise: Optional[float] = None) -> bool:
+        """Verarbeitet eine Messung zur Zeit t. sigma ist die Unsicherheit der Erkennung, sie wird zum Rauschen noise
+        (Standard: measurement_noise) quadratisch addiert. Gibt False zurück, wenn die Messung verworfen wurde."""
+        r = (self.measurement_noise if noise is None else noise)**2 + sigma**2
+        if self._x is None:
+            self._init(t, value, r)
+            return True
+
+        x, p = self._predict(t)
+        innovation = value - x[0]
+        s = p[0, 0] + r
+        if innovation**2 > self.gate**2*s:
+            self.outliers += 1
+            if self.outliers >= self.max_outliers:
+                self._init(t, value, r)
+                return True
+            return False
+
+        gain = p[:, 0]/s
+        self._x = x + gain*innovation
+        self._p = p - np.outer(gain, p[0, :])
+        self.t = max(t, self.t)
+        self.samples += 1
+        self.outliers = 0
+        return True
+
+    def _init(self, t: float, value: float, r: float):
+        self.t = t
+        self._x = np.array([value, 0.0])
+        self._p = np.diag([r, r if self.initial_rate_sigma is None else self.initial_rate_sigma**2])
+        self.samples = 1
+        self.outliers = 0
+
+    def _predict(self, t: float) -> Tuple[np.ndarray, np.ndarray]:
+        dt = max(t - self.t, 0)
+        f = np.array([[1, dt], [0, 1]])
+        q = self.process_noise*np.array([[dt**3/3, dt**2/2],
+                                         [dt**2/2, dt]])
+        return f @ self._x, f @ self._p @ f.T + q
+
+
+class PlasmaState(NamedTuple):
+    """Gefilterter Zustand der Plasmakugel zur Zeit t: Position (x, y, z) und Radius r, jeweils mit Rate und
+    Kovarianz."""
+    t: float
+    x: AxisState
+    y: AxisState
+    z: AxisState
+    r: AxisState
+    samples: int
+
+    @property
+    def position(self) -> Tuple[float, float, float]:
+        return self.x.value, self.y.value, self.z.value
+
+    @property
+    def velocity(self) -> Tuple[float, float, float]:
+        return self.x.rate, self.y.rate, self.z.rate
+
+    @property
+    def sigma(self) -> Tuple[float, float, float, float]:
+        """Standardabweichungen von (x, y, z, r)."""
+        return self.x.sigma, self.y.sigma, self.z.sigma, self.r.sigma
+
+
+class PlasmaFilter:
+    """Glättet die Messungen von PlasmaWatcher.find_plasma mit je einem AxisKalman für x, y, z und den Radius.
+
+    Alle Größen in den Einheiten von find_plasma (displ), die Zeit in s. Das Rauschen des Radius ist relativ
+    (radius_noise*r), weil das Flackern der Helligkeit den Radius proportional ändert. Nach max_misses Frames
+    hintereinander ohne Plasma gilt es als verloren, dann gibt state None zurück. Thread-sicher."""
+
+    def __init__(self, position_noise: float = 1, position_process: float = 1, radius_noise: float = 0.1,
+                 radius_process: float = 1, gate: float = 4, max_outliers: int = 3, max_misses: int = 3):
+        self.radius_noise = radius_noise
+        self.max_misses = max_misses
+        self._lock = threading.Lock()
+        self._axes = [AxisKalman(position_process, position_noise, gate=gate, max_outliers=max_outliers)
+                      for _ in range(3)]
+        self._radius = AxisKalman(radius_process, 0, gate=gate, max_outliers=max_outliers)
+        self.misses = 0
+
+    def reset(self):
+        """Vergisst den Zustand, z.B. nach einer Bewegung der Motoren."""
+        with self._lock:
+            for axis in self._axes + [self._radius]:
+                axis.reset()
+            self.misses = 0
+
+    def update(self, t: float, x: float, y: float, z: float, r: float,
+               sigma: Optional[Sequence[float]] = None):
+        """Verarbeitet eine Messung (x, y, z, r) zur Zeit t. sigma sind die Standardabweichungen der Erkennung von
+        (x, y, z, r), falls bekannt (PlasmaWatcher.get_plasma_sigma)."""
+        sigma = sigma or (0, 0, 0, 0)
+        with self._lock:
+            for axis, value, s in zip(self._axes, (x, y, z), sigma):
+                axis.update(t, value, s)
+            state = self._radius.state(t)
+            level = state.value if state is not None else r
+            self._radius.update(t, r, sigma[3], noise=self.radius_noise*level)
+            self.misses = 0
+
+    def miss(self):
+        """Meldet einen Frame ohne Plasma."""
+        with self._lock:
+            self.misses += 1
+
+    @property
+    def lost(self) -> bool:
+        with self._lock:
+            return self._radius.t is None or self.misses >= self.max_misses
+
+    def state(self, t: Optional[float] = None) -> Optional[PlasmaState]:
+        """Gibt den Zustand zur Zeit t (Standard: Zeit der letzten Messung) zurück, None vor der ersten Messung und
+        wenn das Plasma verloren ist."""
+        with self._lock:
+            if self._radius.t is None or self.misses >= self.max_misses:
+                return None
+            if t is None:
+                t = self._radius.t
+            x, y, z = (axis.state(t) for axis in self._axes)
+            return PlasmaState(t, x, y, z, self._radius.state(t), self._radius.samples)
@@ -1,10 +1,12 @@
+import heapq
 import logging
 import threading
-from copy import deepcopy
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import partial, wraps
 from math import pi, cos, sin, isclose
 from statistics import mean, pstdev
-from time import sleep
-from typing import List, Callable, Optional, Set, Tuple, Union
+from time import perf_counter
+from typing import Dict, List, Callable, NamedTuple, Optional, Sequence, Set, Tuple, Union
 
 from PyQt6.QtGui import QColor
 from lmfit import models
@@ -15,349 +17,524 @@ import cv2
 from motor_controller import Motor, Box, MotorsCluster
 from motor_controller.interface import MotorError, StopIndicator
 
-from mscontr.microwatcher.camera_interface import CameraInterf
+from mscontr.microwatcher.camera_interface import CameraInterf, FramePairSynchronizer, FrameTimeoutError
+from mscontr.microwatcher.diagnostics import DiagnosticsSink, Image
+from mscontr.microwatcher.metrics import Metrics, MetricsRegistry
+from mscontr.microwatcher.plasma_filter import PlasmaFilter, PlasmaState
+from mscontr.microwatcher.sim_clock import WallClock
 # import matplotlib
 
 # from mscontr.microwatcher.plasma_camera_emulator import JetEmulator, CameraEmulator
 
 
-def show(frame):
-    cv2.imshow('image', frame)
-    cv2.waitKey(0)
+_diagnostics = DiagnosticsSink()
 
 
-def find_ray(frame: np.ndarray, error_raise: bool = False, crop: Tuple[int, int] = ()) -> Optional[float]:
-    """Bestimmt die Position des Stickstoffstrahls auf dem Frame."""
-    gray = deepcopy(frame)
+def set_diagnostics_sink(sink: Optional[DiagnosticsSink]) -> DiagnosticsSink:
+    """Setzt die Senke für die Diagnosebilder der Erkennungsfunktionen (None schaltet sie aus) und gibt die
+    vorherige Senke zurück."""
+    global _diagnostics
+    previous = _diagnostics
+    _diagnostics = sink if sink is not None else DiagnosticsSink()
+    return previous
 
-    low_brightness_bound = 40
-    disp_bound = 20
 
-    y2 = gray.shape[0]
-    gray = cv2.GaussianBlur(gray, (11, 11), 0)
+# Wie _diagnostics standardmäßig aus, eingeschaltet wird mit set_metrics(MetricsRegistry())
+_metrics: Metrics = Metrics()
 
-    if crop:
-        gray = gray[crop[0]:crop[1], :]
 
-    ym, zm = gray.shape
+def set_metrics(metrics: Optional[Metrics]) -> Metrics:
+    """Setzt die Ablage für die Laufzeiten und Zähler der Erkennung und von PlasmaWatcher, z.B. MetricsRegistry()
+    (None schaltet sie aus), und gibt die vorherige Ablage zurück."""
+    global _metrics
+    previous = _metrics
+    _metrics = metrics if metrics is not None else Metrics()
+    return previous
 
-    z_range = np.arange(zm)
 
-    z_values = np.zeros(gray.shape)
+def get_metrics() -> Metrics:
+    """Gibt die aktuelle Ablage zurück, z.B. für get_metrics().snapshot() oder get_metrics().dump(path)."""
+    return _metrics
 
-    frame_max = np.copy(gray) * 0
-    frame_80 = np.copy(gray) * 0
-    medians = []
-    for i in range(ym):
-        frame_line = gray[i, :]
-        line_max = np.max(frame_line)
 
-        if line_max >= low_brightness_bound:
-            z_values[i, :] = z_range[:]
-            z_values[i, frame_line != line_max] = 0
-            medians.append(np.median(z_values[i, frame_line == line_max]))
+def _nothing_found(result) -> bool:
+    return result is None or (isinstance(result, tuple) and len(result) > 0 and result[0] is None)
 
-        # frame_max[i, frame_line == np.max(frame_line)] = frame_line[frame_line == np.max(frame_line)]
-        # frame_80[i, frame_line >= 0.8 * np.max(frame_line)] = frame_line[frame_line >= 0.8 * np.max(frame_line)]
 
-    z = np.median(z_values[z_values != 0])
-    medians = np.array(medians)
+def _measured(name: str, failed: Callable[[object], bool] = _nothing_found) -> Callable:
+    """Dekorator, der die Dauer jedes Aufrufs unter name aufzeichnet. Ein Aufruf zählt als fehlgeschlagen, wenn er
+    eine Ausnahme wirft oder failed(Ergebnis) wahr ist (Standard: nichts gefunden, also None bzw. ein Tupel, das mit
+    None beginnt)."""
 
-    # prüfen, ob Jet-Strahl da ist.
-    if np.sum(z_values != 0) > 150:
-        if np.sum(np.abs(medians - z) < disp_bound) >= 0.7*ym:
-            return z
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _metrics.enabled:
+                return func(*args, **kwargs)
+            start = perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                _metrics.record_call(name, perf_counter() - start, ok=False)
+                raise
+            _metrics.record_call(name, perf_counter() - start, ok=not failed(result))
+            return result
+        return wrapper
+    return decorator
 
-    if error_raise:
-        cv2.imwrite('jet_errors/jet_error_None1.png', gray)
-        mask = z_values.copy()
-        mask[z_values > 0] = 254
-        cv2.imwrite('jet_errors/jet_error_None_mask1.png', mask)
-        raise NoJetError("Es wurde kein Jet-Strahl gefunden!")
-    else:
-        return None
 
+def show(frame):
+    cv2.imshow('image', frame)
+    cv2.waitKey(0)
 
-def find_ray_1(frame: np.ndarray, error_raise: bool = False, crop: Tuple[int, int] = ()) -> Optional[float]:
-    """Bestimmt die Position des Stickstoffstrahls auf dem Frame."""
-    frame0 = deepcopy(frame)
 
-    HG = 40
+def blur_and_crop(frame: np.ndarray, kernel_size: int, crop: Tuple[int, int] = (),
+                  x_crop: Tuple[int, int] = ()) -> np.ndarray:
+    """Glättet den Frame mit einem Gauß-Filter und schneidet die Zeilen crop[0]:crop[1] und die Spalten
+    x_crop[0]:x_crop[1] aus.
 
-    gray = cv2.GaussianBlur(frame0, (11, 11), 0)
+    Es wird nur der benötigte Ausschnitt (plus Rand für den Filterkern) geglättet, das Ergebnis ist gleich dem
+    Ausschnitt des vollständig geglätteten Frames."""
 
-    if crop:
-        gray = gray[crop[0]:crop[1], :]
+    if not crop and not x_crop:
+        return cv2.GaussianBlur(frame, (kernel_size, kernel_size), 0)
 
-    ym, zm = gray.shape
+    margin = kernel_size // 2
+    y1, y2 = crop if crop else (0, frame.shape[0])
+    x1, x2 = x_crop if x_crop else (0, frame.shape[1])
+    top = max(y1 - margin, 0)
+    bottom = min(y2 + margin, frame.shape[0])
+    left = max(x1 - margin, 0)
+    right = min(x2 + margin, frame.shape[1])
+    blurred = cv2.GaussianBlur(frame[top:bottom, left:right], (kernel_size, kernel_size), 0)
+    return blurred[y1 - top:y2 - top, x1 - left:x2 - left]
 
-    frame_max = np.copy(gray) * 0
-    for i in range(ym):
-        frame_line = gray[i, :]
-        frame_max[i, frame_line == np.max(frame_line)] = frame_line[frame_line == np.max(frame_line)]
 
-    frame_max[frame_max < HG] = 0
-    frame_max[frame_max != 0] = 255
-    edges = frame_max
+def row_max_positions(gray: np.ndarray, low_brightness_bound: float) -> (np.ndarray, np.ndarray, np.ndarray):
+    """Findet in allen Zeilen, deren Maximum nicht kleiner als low_brightness_bound ist, die Spalten des Maximums.
 
-    rho = 2  # distance resolution in pixels of the Hough grid
-    theta = 0.6 * np.pi / 180  # angular resolution in radians of the Hough grid
-    threshold = 20  # minimum number of votes (intersections in Hough grid cell)
-    if crop:
-        min_line_length = 400  # minimum number of pixels making up a line
-        max_line_gap = 100  # maximum gap in pixels between connectable line segments
-    else:
-        min_line_length = 500
-        max_line_gap = 100
+    Gibt die Zeilen- und Spaltenindizes aller Maxima (zeilenweise sortiert) und den Median der Spaltenindizes
+    für jede helle Zeile zurück."""
 
-    lines = cv2.HoughLinesP(edges, rho, theta, threshold, np.array([]),
-                            min_line_length, max_line_gap)
+    row_max = gray.max(axis=1)
+    bright = row_max >= low_brightness_bound
+    rows, cols = np.nonzero((gray == row_max[:, np.newaxis]) & bright[:, np.newaxis])
 
-    if lines is not None:
-        lines = lines[:, 0, :]
-        lines_befor_merge = deepcopy(lines)
-        # lines = merge_close_lines(lines)
-
-    if lines is None or lines == []:
-        if error_raise:
-            cv2.imwrite('jet_errors/jet_error_None.png', frame0)
-            cv2.imwrite('jet_errors/jet_error_None_mask.png', edges)
-            raise NoJetError("Es wurde kein Jet-Strahl gefunden!")
-        else:
-            return None
-    elif len(lines) > 1:
-        print(len(lines_befor_merge), lines_befor_merge)
-        print(len(lines),lines)
-
-        frame0 = cv2.cvtColor(frame0, cv2.COLOR_BGR2RGB)
-        line_image = np.copy(frame0) * 0  # creating a blank to draw lines on
-        colors = ((0,0,255), (0,128,255), (0,255,128), (255,255,0), (255,0,0))
-        for i, line in enumerate(lines):
-
-            x1, y1, x2, y2 = line
-            if crop:
-                y1 += crop[0]
-                y2 += crop[0]
-            cv2.line(line_image, (round(x1), round(y1)), (round(x2), round(y2)), colors[i], 1)
-        lines_edges = cv2.addWeighted(frame0, 0.8, line_image, 1, 0)
-
-        cv2.imwrite('jet_errors/jet_error.png', lines_edges)
-        cv2.imwrite('jet_errors/jet_error_mask.png',
-                    edges)
-
-        # cv2.imshow('image', lines_edges)
-        # cv2.waitKey(0)
-        # cv2.imshow('image', gray)
-        # cv2.waitKey(0)
-        # cv2.imshow('image', edges)
-        # cv2.waitKey(0)
-        raise RecognitionError(f"Kein Stickstoffstrahl erkannt. {len(lines)} Linien wurde erkannt.")
-
-    x = []
-    for line in lines:
-        x1, y1, x2, y2 = line
-        if abs(x1-x2) > 100:
-            raise RecognitionError(f"Kein Stickstoffstrahl gefunden. Die erkannte Linien sind nicht vertikal.")
-        x.append(x1)
-        x.append(x2)
-
-    # cv2.imshow('image', frame0)
-    # cv2.waitKey(0)
-    # # cv2.imshow('image', gray)
-    # # cv2.waitKey(0)
-    # cv2.imshow('image', edges)
-    # cv2.waitKey(0)
-    return mean(x)
+    # Median pro Zeile: die Spalten sind innerhalb einer Zeile schon sortiert
+    counts = np.bincount(rows, minlength=gray.shape[0])[bright]
+    starts = np.cumsum(counts) - counts
+    medians = (cols[starts + (counts - 1)//2] + cols[starts + counts//2]) / 2
+    return rows, cols, medians
 
 
-def find_ray0(frame: np.ndarray, error_raise: bool = False, crop: Tuple[int, int] = ()) -> Optional[float]:
-    """Bestimmt die Position des Stickstoffstrahls auf dem Frame."""
-    frame0 = deepcopy(frame)
+class RayFrame:
+    """Ein Frame mit den Zwischenergebnissen der Strahlerkennung.
 
-    # cv2.imshow('image', frame0)
-    # cv2.waitKey(0)
+    Der Ausschnitt (Zeilen crop, Spalten x_crop) ist eine Sicht auf den Frame ohne Kopie. Geglätteter Ausschnitt,
+    Maxima der Zeilen und Kanten werden erst beim ersten Zugriff berechnet und von allen Verfahren geteilt, die mit
+    demselben RayFrame arbeiten."""
 
-    # frame = ~frame
-    gray = frame0
+    def __init__(self, frame: np.ndarray, crop: Tuple[int, int] = (), x_crop: Tuple[int, int] = (),
+                 blur_kernel: int = 11):
+        self.frame = frame
+        self.crop = crop
+        self.x_crop = x_crop
+        self.blur_kernel = blur_kernel
+        self.x_offset = x_crop[0] if x_crop else 0
 
-    if crop:
-        gray = gray[crop[0]:crop[1], :]
+        y1, y2 = crop if crop else (0, frame.shape[0])
+        x1, x2 = x_crop if x_crop else (0, frame.shape[1])
+        self.gray = frame[y1:y2, x1:x2]
 
-    # cv2.imshow('image', gray)
-    # cv2.waitKey(0)
+        self._blurred: Optional[np.ndarray] = None
+        self._row_max: Dict[float, Tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+        self._edges: Dict[Tuple[float, float], np.ndarray] = {}
 
-    # kernel_size = 5
-    # gray = cv2.GaussianBlur(gray,(kernel_size, kernel_size),0)
-    low_threshold = 50
-    high_threshold = 100
-    edges = cv2.Canny(gray, low_threshold, high_threshold, apertureSize = 3)
+    def blurred(self) -> np.ndarray:
+        """Der mit dem Gauß-Filter geglättete Ausschnitt (siehe blur_and_crop)."""
+        if self._blurred is None:
+            with _metrics.stage('ray.blur'):
+                self._blurred = blur_and_crop(self.frame, self.blur_kernel, self.crop, self.x_crop)
+        return self._blurred
 
-    # cv2.imshow('image', edges)
-    # cv2.waitKey(0)
+    def row_max(self, low_brightness_bound: float) -> (np.ndarray, np.ndarray, np.ndarray):
+        """row_max_positions des geglätteten Ausschnitts, die Spalten im Ausschnitt."""
+        if low_brightness_bound not in self._row_max:
+            blurred = self.blurred()
+            with _metrics.stage('ray.threshold'):
+                self._row_max[low_brightness_bound] = row_max_positions(blurred, low_brightness_bound)
+        return self._row_max[low_brightness_bound]
 
-    rho = 2  # distance resolution in pixels of the Hough grid
-    theta = 0.6*np.pi / 180  # angular resolution in radians of the Hough grid
-    threshold = 15  # minimum number of votes (intersections in Hough grid cell)
-    if crop:
-        min_line_length = 400  # minimum number of pixels making up a line
-        max_line_gap = 100    # maximum gap in pixels between connectable line segments
-    else:
-        min_line_length = 400
-        max_line_gap = 100
+    def edges(self, low_threshold: float, high_threshold: float) -> np.ndarray:
+        """Kanten (Canny) des ungeglätteten Ausschnitts."""
+        key = (low_threshold, high_threshold)
+        if key not in self._edges:
+            with _metrics.stage('ray.edges'):
+                self._edges[key] = cv2.Canny(self.gray, low_threshold, high_threshold, apertureSize=3)
+        return self._edges[key]
 
-    lines = cv2.HoughLinesP(edges, rho, theta, threshold, np.array([]),
-                        min_line_length, max_line_gap)
 
+class RayStrategy:
+    """Basisklasse der Verfahren zur Erkennung des Jet-Strahls. find gibt die Position des Strahls in Spalten des
+    ganzen Frames zurück oder None (bzw. wirft mit error_raise eine Ausnahme), wenn kein Strahl gefunden wurde."""
 
-    lines_befor_merge = deepcopy(lines)
+    name = ''
 
-    if lines is not None:
-        lines = lines[:, 0, :]
-        lines = merge_close_lines(lines)
+    def find(self, ray_frame: RayFrame, error_raise: bool = False) -> Optional[float]:
+        raise NotImplementedError
 
-    if lines is None or lines == []:
+    def estimate(self, ray_frame: RayFrame, error_raise: bool = False) -> (Optional[float], Optional[float]):
+        """Gibt die Position und ihre Standardabweichung in Pixel zurück. Verfahren ohne Fehlerabschätzung geben
+        als Standardabweichung None zurück."""
+        return self.find(ray_frame, error_raise), None
+
+    def _not_found(self, error_raise: bool, dumps: Dict[str, Image] = None) -> None:
         if error_raise:
-            cv2.imwrite('jet_errors/jet_error_None.png', frame0)
-            cv2.imwrite('jet_errors/jet_error_None_mask.png', edges)
+            for name, image in (dumps or {}).items():
+                _diagnostics.dump(name, image)
             raise NoJetError("Es wurde kein Jet-Strahl gefunden!")
-        else:
-            return None
-    elif len(lines) != 2:
-        # print(len(lines_befor_merge), lines_befor_merge)
-        # print(len(lines),lines)
-
-        frame0 = cv2.cvtColor(frame0, cv2.COLOR_BGR2RGB)
-        line_image = np.copy(frame0) * 0  # creating a blank to draw lines on
-        colors = ((0,0,255), (0,128,255), (0,255,128), (255,255,0), (255,0,0))
-        for i, line in enumerate(lines):
-
-            x1, y1, x2, y2 = line
-            if crop:
-                y1 += crop[0]
-                y2 += crop[0]
-            cv2.line(line_image, (round(x1), round(y1)), (round(x2), round(y2)), colors[i], 1)
-        lines_edges = cv2.addWeighted(frame0, 0.8, line_image, 1, 0)
-
-        cv2.imwrite('jet_errors/jet_error.png', lines_edges)
-        cv2.imwrite('jet_errors/jet_error_mask.png',
-                    edges)
-
-        # cv2.imshow('image', lines_edges)
-        # cv2.waitKey(0)
-        # cv2.imshow('image', gray)
-        # cv2.waitKey(0)
-        # cv2.imshow('image', edges)
-        # cv2.waitKey(0)
-        raise RecognitionError(f"Kein Stickstoffstrahl erkannt. {len(lines)} Linien wurde erkannt.")
+        return None
 
-    x = []
-    for line in lines:
-        x1, y1, x2, y2 = line
-        if abs(x1-x2) > 100:
+
+class RowMaxRay(RayStrategy):
+    """Der Strahl ist der Median der Spalten, in denen die Zeilen des geglätteten Ausschnitts ihr Maximum haben.
+    Die Maxima von mindestens 70 % der Zeilen müssen näher als disp_bound an diesem Median liegen."""
+
+    name = 'row_max'
+
+    def __init__(self, low_brightness_bound: float = 40, disp_bound: float = 20, min_points: int = 150):
+        self.low_brightness_bound = low_brightness_bound
+        self.disp_bound = disp_bound
+        self.min_points = min_points
+
+    def find(self, ray_frame: RayFrame, error_raise: bool = False) -> Optional[float]:
+        rows, cols, medians = ray_frame.row_max(self.low_brightness_bound)
+        # Maxima in der Spalte 0 des Frames werden nicht berücksichtigt
+        valid = cols + ray_frame.x_offset != 0
+        z_values = cols[valid] + ray_frame.x_offset
+
+        if len(z_values) > self.min_points:
+            z = np.median(z_values)
+            n_rows = ray_frame.gray.shape[0]
+            if np.sum(np.abs(medians + ray_frame.x_offset - z) < self.disp_bound) >= 0.7*n_rows:
+                return z
+
+        def draw_mask() -> np.ndarray:
+            mask = np.zeros(ray_frame.gray.shape)
+            mask[rows[valid], cols[valid]] = 254
+            return mask
+
+        return self._not_found(error_raise, {'jet_errors/jet_error_None1.png': ray_frame.blurred(),
+                                             'jet_errors/jet_error_None_mask1.png': draw_mask})
+
+
+class _HoughRay(RayStrategy):
+    """Gemeinsamer Teil der Verfahren, die Geraden mit HoughLinesP in einem Binärbild suchen."""
+
+    n_lines = 1
+    merge = False
+
+    def __init__(self, threshold: int = 20, min_line_length: int = 400, max_line_gap: int = 100,
+                 max_slope: float = 100):
+        self.rho = 2  # Auflösung des Abstands im Hough-Gitter in Pixel
+        self.theta = 0.6*np.pi/180  # Auflösung des Winkels im Hough-Gitter
+        self.threshold = threshold  # minimale Anzahl der Stimmen
+        self.min_line_length = min_line_length
+        self.max_line_gap = max_line_gap
+        self.max_slope = max_slope  # maximale Differenz von x1 und x2 einer Geraden in Pixel
+
+    def binary(self, ray_frame: RayFrame) -> np.ndarray:
+        raise NotImplementedError
+
+    def find(self, ray_frame: RayFrame, error_raise: bool = False) -> Optional[float]:
+        edges = self.binary(ray_frame)
+        with _metrics.stage('ray.hough'):
+            lines = cv2.HoughLinesP(edges, self.rho, self.theta, self.threshold,
+                                    minLineLength=self.min_line_length, maxLineGap=self.max_line_gap)
+        # je nach OpenCV-Version (N, 1, 4) oder (N, 4)
+        lines = np.zeros((0, 4)) if lines is None else lines.reshape(-1, 4)
+        if self.merge and len(lines):
+            with _metrics.stage('ray.merge'):
+                lines = merge_close_lines(lines)
+
+        if len(lines) == 0:
+            return self._not_found(error_raise, {'jet_errors/jet_error_None.png': ray_frame.frame,
+                                                 'jet_errors/jet_error_None_mask.png': edges})
+        if len(lines) != self.n_lines:
+            shown = lines + [ray_frame.x_offset, 0, ray_frame.x_offset, 0]
+            _diagnostics.dump('jet_errors/jet_error.png', lambda: draw_lines(ray_frame.frame, shown, ray_frame.crop))
+            _diagnostics.dump('jet_errors/jet_error_mask.png', edges)
+            raise RecognitionError(f"Kein Stickstoffstrahl erkannt. {len(lines)} Linien wurde erkannt.")
+        if np.any(np.abs(lines[:, 0] - lines[:, 2]) > self.max_slope):
             raise RecognitionError(f"Kein Stickstoffstrahl gefunden. Die erkannte Linien sind nicht vertikal.")
-        x.append(x1)
-        x.append(x2)
+        return float(np.mean(lines[:, [0, 2]])) + ray_frame.x_offset
+
+
+class EdgeHoughRay(_HoughRay):
+    """Sucht die beiden Ränder des Strahls als Geraden in den Kanten (Canny) des ungeglätteten Ausschnitts. Nahe
+    beieinander liegende Geraden werden mit merge_close_lines vereint, der Strahl liegt in der Mitte der beiden
+    Ränder."""
+
+    name = 'edge_hough'
+    n_lines = 2
+    merge = True
+
+    def __init__(self, low_threshold: float = 50, high_threshold: float = 100, threshold: int = 15,
+                 min_line_length: int = 400, max_line_gap: int = 100):
+        super().__init__(threshold, min_line_length, max_line_gap)
+        self.low_threshold = low_threshold
+        self.high_threshold = high_threshold
+
+    def binary(self, ray_frame: RayFrame) -> np.ndarray:
+        return ray_frame.edges(self.low_threshold, self.high_threshold)
+
+
+class MaxHoughRay(_HoughRay):
+    """Sucht genau eine Gerade durch die Maxima der Zeilen des geglätteten Ausschnitts."""
+
+    name = 'max_hough'
+
+    def __init__(self, low_brightness_bound: float = 40, threshold: int = 20, min_line_length: int = 400,
+                 max_line_gap: int = 100):
+        super().__init__(threshold, min_line_length, max_line_gap)
+        self.low_brightness_bound = low_brightness_bound
+
+    def binary(self, ray_frame: RayFrame) -> np.ndarray:
+        rows, cols, _ = ray_frame.row_max(self.low_brightness_bound)
+        mask = np.zeros(ray_frame.gray.shape, dtype='uint8')
+        mask[rows, cols] = 255
+        return mask
+
+
+class CentroidRay(RayStrategy):
+    """Subpixelgenaue Position als intensitätsgewichteter Schwerpunkt des Strahlprofils.
+
+    Die Zeilen werden wie bei RowMaxRay ausgewählt. In jeder Zeile wird im Fenster von ±half_width Pixel um die
+    Spalte des Maximums der Schwerpunkt der Helligkeit über dem Minimum des Fensters berechnet, alle Zeilen auf
+    einmal. Zeilen, deren Fenster über den Rand des Ausschnitts reicht, werden nicht verwendet. Die Position ist der
+    Mittelwert der Zeilen, die Standardabweichung der Standardfehler dieses Mittelwerts. Weil die Glättung
+    benachbarte Zeilen koppelt, wird dabei nur jede blur_kernel-te Zeile als unabhängig gezählt. Dazu kommt
+    quadratisch pixel_sigma: die Abtastung des schmalen Strahls durch die Pixel verschiebt den Schwerpunkt je nach
+    Lage zwischen den Spalten um bis zu etwa 0.1 Pixel, in allen Zeilen gleich."""
+
+    name = 'centroid'
+
+    def __init__(self, low_brightness_bound: float = 40, disp_bound: float = 20, half_width: int = 8,
+                 min_rows: int = 20, pixel_sigma: float = 0.05):
+        self.low_brightness_bound = low_brightness_bound
+        self.disp_bound = disp_bound
+        self.half_width = half_width
+        self.min_rows = min_rows
+        self.pixel_sigma = pixel_sigma
+
+    def find(self, ray_frame: RayFrame, error_raise: bool = False) -> Optional[float]:
+        return self.estimate(ray_frame, error_raise)[0]
+
+    def estimate(self, ray_frame: RayFrame, error_raise: bool = False) -> (Optional[float], Optional[float]):
+        rows, cols, medians = ray_frame.row_max(self.low_brightness_bound)
+        n_rows, width = ray_frame.gray.shape
+        if len(medians) >= max(self.min_rows, 2):
+            z = np.median(medians)
+            near = np.abs(medians - z) < self.disp_bound
+            if np.sum(near) >= 0.7*n_rows:
+                with _metrics.stage('ray.centroid'):
+                    x = self._row_centroids(ray_frame.blurred(), np.unique(rows)[near], medians[near], width)
+                x = x[~np.isnan(x)]
+                if len(x) >= max(self.min_rows, 2):
+                    n_independent = max(len(x)/ray_frame.blur_kernel, 1)
+                    sigma = float(np.sqrt(np.var(x, ddof=1)/n_independent + self.pixel_sigma**2))
+                    return float(np.mean(x)) + ray_frame.x_offset, sigma
+
+        return self._not_found(error_raise, {'jet_errors/jet_error_None1.png': ray_frame.blurred()}), None
+
+    def _row_centroids(self, gray: np.ndarray, rows: np.ndarray, centers: np.ndarray, width: int) -> np.ndarray:
+        offsets = np.arange(-self.half_width, self.half_width + 1)
+        columns = np.round(centers).astype(int)[:, np.newaxis] + offsets
+        inside = (columns[:, 0] >= 0) & (columns[:, -1] < width)
+        columns[~inside] = offsets + self.half_width  # Platzhalter, das Ergebnis dieser Zeilen ist nan
+        profile = gray[rows[:, np.newaxis], columns].astype(float)
+        weights = profile - profile.min(axis=1, keepdims=True)
+        total = weights.sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            x = (weights*columns).sum(axis=1)/total
+        x[~inside] = np.nan
+        return x
+
+
+RAY_STRATEGIES: Dict[str, Callable[[], RayStrategy]] = {
+    RowMaxRay.name: RowMaxRay,
+    EdgeHoughRay.name: EdgeHoughRay,
+    MaxHoughRay.name: MaxHoughRay,
+    CentroidRay.name: CentroidRay,
+}
+
+
+class RayDetector:
+    """Erkennt den Jet-Strahl mit einem oder mehreren Verfahren aus RAY_STRATEGIES (Name oder RayStrategy).
+
+    Bei mehreren Verfahren werden sie der Reihe nach probiert, bis eines den Strahl findet. Sie teilen sich die
+    Vorverarbeitung (Ausschnitt, Glättung, Maxima der Zeilen), die dabei nur einmal berechnet wird. Eine
+    RecognitionError eines Verfahrens gilt als nicht gefunden, solange noch ein weiteres folgt."""
+
+    def __init__(self, strategies: Union[str, RayStrategy, Sequence[Union[str, RayStrategy]]] = 'row_max',
+                 crop: Tuple[int, int] = (), blur_kernel: int = 11):
+        if isinstance(strategies, (str, RayStrategy)):
+            strategies = [strategies]
+        self.strategies: List[RayStrategy] = [self._make(strategy) for strategy in strategies]
+        if not self.strategies:
+            raise ValueError('Es muss mindestens ein Verfahren angegeben werden.')
+        self.crop = crop
+        self.blur_kernel = blur_kernel
+
+    @staticmethod
+    def _make(strategy: Union[str, RayStrategy]) -> RayStrategy:
+        if isinstance(strategy, RayStrategy):
+            return strategy
+        if strategy not in RAY_STRATEGIES:
+            raise ValueError(f'Unbekanntes Verfahren: "{strategy}". Möglich sind {", ".join(RAY_STRATEGIES)}.')
+        return RAY_STRATEGIES[strategy]()
+
+    def find(self, frame: np.ndarray, error_raise: bool = False, x_crop: Tuple[int, int] = ()) \
+            -> Optional[float]:
+        """Bestimmt die Position des Jet-Strahls auf dem Frame. Mit x_crop wird nur in den angegebenen Spalten
+        gesucht, die Position wird trotzdem in Koordinaten des ganzen Frames zurückgegeben."""
+        return self.estimate(frame, error_raise, x_crop)[0]
+
+    def estimate(self, frame: np.ndarray, error_raise: bool = False, x_crop: Tuple[int, int] = ()) \
+            -> (Optional[float], Optional[float]):
+        """Wie find, gibt aber zusätzlich die Standardabweichung der Position in Pixel zurück (None, wenn das
+        Verfahren keine liefert)."""
+
+        ray_frame = RayFrame(frame, self.crop, x_crop, self.blur_kernel)
+        *first, last = self.strategies
+        for strategy in first:
+            try:
+                x, sigma = strategy.estimate(ray_frame)
+            except RecognitionError:
+                x, sigma = None, None
+            if x is not None:
+                return x, sigma
+        return last.estimate(ray_frame, error_raise)
+
+
+@_measured('find_ray')
+def find_ray(frame: np.ndarray, error_raise: bool = False, crop: Tuple[int, int] = (),
+             x_crop: Tuple[int, int] = ()) -> Optional[float]:
+    """Bestimmt die Position des Stickstoffstrahls auf dem Frame mit dem Verfahren RowMaxRay. Mit x_crop wird nur in
+    den angegebenen Spalten gesucht, die Position wird trotzdem in Koordinaten des ganzen Frames zurückgegeben."""
+    return RowMaxRay().find(RayFrame(frame, crop, x_crop), error_raise)
+
+
+@_measured('find_ray_subpixel')
+def find_ray_subpixel(frame: np.ndarray, error_raise: bool = False, crop: Tuple[int, int] = (),
+                      x_crop: Tuple[int, int] = ()) -> Union[Tuple[float, float], Tuple[None, None]]:
+    """Bestimmt die Position des Stickstoffstrahls auf dem Frame subpixelgenau mit dem Verfahren CentroidRay und
+    gibt sie zusammen mit ihrer Standardabweichung (x, sigma) in Pixel zurück."""
+    return CentroidRay().estimate(RayFrame(frame, crop, x_crop), error_raise)
+
+
+@_measured('find_ray_1')
+def find_ray_1(frame: np.ndarray, error_raise: bool = False, crop: Tuple[int, int] = ()) -> Optional[float]:
+    """Bestimmt die Position des Stickstoffstrahls auf dem Frame mit dem Verfahren MaxHoughRay."""
+    strategy = MaxHoughRay() if crop else MaxHoughRay(min_line_length=500)
+    return strategy.find(RayFrame(frame, crop), error_raise)
 
-    # cv2.imshow('image', frame0)
-    # cv2.waitKey(0)
-    # # cv2.imshow('image', gray)
-    # # cv2.waitKey(0)
-    # cv2.imshow('image', edges)
-    # cv2.waitKey(0)
-    return mean(x)
 
+@_measured('find_ray0')
+def find_ray0(frame: np.ndarray, error_raise: bool = False, crop: Tuple[int, int] = ()) -> Optional[float]:
+    """Bestimmt die Position des Stickstoffstrahls auf dem Frame mit dem Verfahren EdgeHoughRay."""
+    return EdgeHoughRay().find(RayFrame(frame, crop), error_raise)
 
-def merge_close_lines(lines: np.ndarray) -> np.ndarray:
-    """Vereint die erkante Geraden, die nebeneinander liegen."""
-    def line_is_close(new_line: np.ndarray, close_lines: np.ndarray) -> bool:
-        for line in close_lines:
-            if abs(new_line[0] - line[0]) <= 1 and abs(new_line[2] - line[2]) <= 1:
-                return True
-        return False
-
-    def add_new_line(new_line: np.ndarray, close_lines: np.ndarray) -> np.ndarray:
-        close_lines = deepcopy(close_lines)
-        for line in close_lines:
-            if abs(new_line[0] - line[0]) <= 0.0001 and abs(new_line[2] - line[2]) <= 0.0001:
-                line[1] = min(line[1], new_line[1])
-                line[3] = max(line[3], new_line[3])
-                return close_lines
-        return np.append(close_lines, [new_line], axis=0)
-
-    def merge_lines(lines: np.ndarray) -> np.ndarray:
-        line = np.zeros(4)
-        line[0] = np.mean(lines[:, 0])
-        line[1] = max(lines[:, 1])
-        line[2] = np.mean(lines[:, 2])
-        line[3] = min(lines[:, 3])
-        return line
-
-    def merge_groups(group1: np.ndarray, group2: np.ndarray) -> np.ndarray:
-        res_group = np.concatenate((group1, group2), axis=0)
-        res_group = np.unique(res_group, axis=0)
-        return res_group
-
-    def have_repeated_elements(group1: np.ndarray, group2: np.ndarray) -> bool:
-        sum = np.concatenate((group1, group2), axis=0)
-        if len(np.unique(sum, axis=0)) < len(sum):
-            return True
-        else:
-            return False
 
-    def check_and_merge(lines_groups: List[np.ndarray]) -> List[np.ndarray]:
-        for i, group in enumerate(lines_groups):
-            for j, group2 in enumerate(lines_groups[i+1:]):
-                if have_repeated_elements(group, group2):
-                    lines_groups[i] = merge_groups(group, group2)
-                    lines_groups.pop(i+j+1)
-                    return check_and_merge(lines_groups)
-        return lines_groups
-
-    # sammeln die nebeneinander liegende Geraden in Gruppen
-    lines_groups = [lines[:1], ]
-    for line in lines[1:]:
-        added = False
-        for i, group in enumerate(lines_groups):
-            if line_is_close(line, group):
-                lines_groups[i] = add_new_line(line, group)
-                added = True
-        if not added:
-            lines_groups.append(np.array([line, ]))
-
-    # prüfen, ob die bekommene Gruppen nebeneinander liegen, und vereinen wenn solche vorhanden sind.
-    lines_groups = check_and_merge(lines_groups)
-
-    # vereinigen die nebeneinander liegende Geraden
-    res_lines = []
-    for group in lines_groups:
-        res_lines.append(merge_lines(group))
-
-    return np.array(res_lines)
-
-
-def find_plasma(frame: np.ndarray, HG: int = 254, crop_top: int = 0,  error_raise: bool = False) \
+def merge_close_lines(lines: np.ndarray) -> np.ndarray:
+    """Vereint die erkannten Geraden (x1, y1, x2, y2), die nebeneinander liegen.
+
+    Zwei Geraden liegen nebeneinander, wenn sich x1 und x2 jeweils um höchstens 1 unterscheiden. Eine Gruppe bilden
+    alle Geraden, die direkt oder über andere Geraden nebeneinander liegen. Für jede Gruppe wird eine Gerade mit den
+    gemittelten x-Werten, dem größten y1 und dem kleinsten y2 zurückgegeben, in der Reihenfolge des ersten Auftretens.
+    Geraden mit gleichen x-Werten zählen für den Mittelwert nur einmal.
+
+    Die Paare werden in einem Durchlauf über die nach x1 sortierten Geraden gefunden und mit Union-Find gruppiert.
+    Für fast senkrechte Geraden, wie sie HoughLinesP liefert, ist der Aufwand O(n log n)."""
+
+    lines = np.asarray(lines)
+    if len(lines) == 0:
+        return np.zeros((0, 4))
+
+    # gleiche x-Werte zusammenfassen, keys ist nach (x1, x2) sortiert
+    keys, first, inverse = np.unique(lines[:, [0, 2]], axis=0, return_index=True, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    n_keys = len(keys)
+
+    # Durchlauf: jeder Schlüssel wird mit den folgenden verglichen, deren x1 höchstens um 1 größer ist
+    x1, x2 = keys[:, 0], keys[:, 1]
+    counts = np.searchsorted(x1, x1 + 1, side='right') - np.arange(n_keys) - 1
+    i = np.repeat(np.arange(n_keys), counts)
+    j = i + 1 + np.arange(len(i)) - np.repeat(np.cumsum(counts) - counts, counts)
+    close = np.abs(x2[i] - x2[j]) <= 1
+
+    parent = list(range(n_keys))
+
+    def root(k: int) -> int:
+        while parent[k] != k:
+            parent[k] = parent[parent[k]]
+            k = parent[k]
+        return k
+
+    for a, b in zip(i[close].tolist(), j[close].tolist()):
+        root_a, root_b = root(a), root(b)
+        if root_a != root_b:
+            parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    _, group = np.unique([root(k) for k in range(n_keys)], return_inverse=True)
+    group = group.reshape(-1)
+    n_groups = group.max() + 1
+    size = np.bincount(group, minlength=n_groups)
+    res_lines = np.empty((n_groups, 4))
+    res_lines[:, 0] = np.bincount(group, x1, n_groups)/size
+    res_lines[:, 2] = np.bincount(group, x2, n_groups)/size
+    line_group = group[inverse]
+    res_lines[:, 1] = -np.inf
+    np.maximum.at(res_lines[:, 1], line_group, lines[:, 1])
+    res_lines[:, 3] = np.inf
+    np.minimum.at(res_lines[:, 3], line_group, lines[:, 3])
+
+    order = np.full(n_groups, len(lines))
+    np.minimum.at(order, group, first)
+    return res_lines[np.argsort(order)]
+
+
+@_measured('find_plasma')
+def find_plasma(frame: np.ndarray, HG: int = 254, crop_top: int = 0,  error_raise: bool = False,
+                roi: Tuple[int, int, int, int] = ()) \
         -> Union[Tuple[float, float, float], Tuple[None, None, None]]:
-    """Bestimmt die Position der Plasmakugel auf dem Frame."""
-
-    frame0 = frame.copy()
-    gray = frame0
+    """Bestimmt die Position der Plasmakugel auf dem Frame. Wenn roi = (x1, y1, x2, y2) angegeben ist, wird nur in
+    diesem Fenster gesucht, die Position wird trotzdem in Koordinaten des ganzen Frames zurückgegeben."""
 
-    if crop_top:
-        gray = gray[crop_top:, :]
+    if roi:
+        x_offset = max(roi[0], 0)
+        y_offset = max(roi[1], crop_top)
+        gray = frame[y_offset:roi[3], x_offset:roi[2]]
+    else:
+        x_offset = 0
+        y_offset = crop_top
+        gray = frame[crop_top:, :]
     # gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
     # cv2.imshow('image', gray)
     # cv2.waitKey(0)
-    thresh = cv2.threshold(gray, HG, 255, cv2.THRESH_BINARY)[1]
-    # cv2.imshow('image', thresh)
-    # cv2.waitKey(0)
-    thresh = cv2.erode(thresh, None, iterations=2)
-    # cv2.imshow('image', thresh)
-    # cv2.waitKey(0)
-    thresh = cv2.dilate(thresh, None, iterations=4)
-    # cv2.imshow('image', thresh)
-    # cv2.waitKey(0)
+    with _metrics.stage('find_plasma.threshold'):
+        thresh = cv2.threshold(gray, HG, 255, cv2.THRESH_BINARY)[1]
+        # cv2.imshow('image', thresh)
+        # cv2.waitKey(0)
+        thresh = cv2.erode(thresh, None, iterations=2)
+        # cv2.imshow('image', thresh)
+        # cv2.waitKey(0)
+        thresh = cv2.dilate(thresh, None, iterations=4)
+        # cv2.imshow('image', thresh)
+        # cv2.waitKey(0)
 
-    conts, h = cv2.findContours(thresh.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
+    with _metrics.stage('find_plasma.contours'):
+        conts, h = cv2.findContours(thresh.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
 
 
     # img = cv2.cvtColor(gray, cv2.COLOR_BGR2RGB)
@@ -371,8 +548,8 @@ def find_plasma(frame: np.ndarray, HG: int = 254, crop_top: int = 0,  error_rais
     if conts is None or conts == ():
         # print(None)
         if error_raise:
-            cv2.imwrite('PW_errors/no_plasma_error.png', frame)
-            cv2.imwrite('PW_errors/no_plasma_error_mask.png', thresh)
+            _diagnostics.dump('PW_errors/no_plasma_error.png', frame)
+            _diagnostics.dump('PW_errors/no_plasma_error_mask.png', thresh)
             # show(frame)
             # show(thresh)
             raise NoPlasmaError("Es wurde kein Plasmakugel gefunden!")
@@ -387,35 +564,285 @@ def find_plasma(frame: np.ndarray, HG: int = 254, crop_top: int = 0,  error_rais
         conts_with_areas.sort(key=lambda item: item[0], reverse=True)
 
         if conts_with_areas[0][0] < 4*conts_with_areas[1][0]:
-            img = cv2.cvtColor(gray, cv2.COLOR_BGR2RGB)
-            cv2.drawContours(img, conts, -1, (255, 0, 0), 3)
-            for cont in conts:
-                (x, y), r = cv2.minEnclosingCircle(cont)
-                cv2.circle(img, (round(x), round(y)), round(r), (0, 255, 0), 2)
-            # show(img)
-
-            cv2.imwrite('plasma_errors/plasma_error.png', frame)
+            def draw_objects() -> np.ndarray:
+                img = cv2.cvtColor(gray, cv2.COLOR_BGR2RGB)
+                cv2.drawContours(img, conts, -1, (255, 0, 0), 3)
+                for cont in conts:
+                    (x, y), r = cv2.minEnclosingCircle(cont)
+                    cv2.circle(img, (round(x), round(y)), round(r), (0, 255, 0), 2)
+                return img
+
+            _diagnostics.dump('plasma_errors/plasma_error.png', frame)
+            _diagnostics.dump('plasma_errors/plasma_error_objects.png', draw_objects)
             raise RecognitionError("Mehrere Objekte gefunden!")
 
     # Position ausrechnen
     x, y = np.sum(conts[0], axis=0)[0]/len(conts[0])
-    y += crop_top
+    x += x_offset
+    y += y_offset
 
     # effektives Radius ausrechnen
     area = cv2.contourArea(conts[0])
     equi_diameter = np.sqrt(4 * area / np.pi)
     r = equi_diameter/2
 
-    img = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-    cv2.circle(img, (round(x), round(y)), 0, (0, 0, 255), 3)
-    cv2.circle(img, (round(x), round(y)), round(r), (0, 255, 0), 2)
-    # show(img)
-    cv2.imwrite('plasma_det_new.png', img)
+    def draw_plasma() -> np.ndarray:
+        img = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        cv2.circle(img, (round(x), round(y)), 0, (0, 0, 255), 3)
+        cv2.circle(img, (round(x), round(y)), round(r), (0, 255, 0), 2)
+        return img
+
+    _diagnostics.dump('plasma_det_new.png', draw_plasma)
 
     # print(x,y,r)
     return x, y, r
 
 
+class PlasmaEstimate(NamedTuple):
+    """Position (x, y) und Radius r der Plasmakugel in Pixel mit ihren Standardabweichungen."""
+    x: Optional[float]
+    y: Optional[float]
+    r: Optional[float]
+    sigma_x: Optional[float]
+    sigma_y: Optional[float]
+    sigma_r: Optional[float]
+
+
+_NO_PLASMA = PlasmaEstimate(None, None, None, None, None, None)
+
+
+@_measured('find_plasma_moments')
+def find_plasma_moments(frame: np.ndarray, HG: int = 254, crop_top: int = 0, error_raise: bool = False,
+                        roi: Tuple[int, int, int, int] = (), weight_floor: Optional[float] = None,
+                        min_area: int = 5, margin: int = 5) -> PlasmaEstimate:
+    """Bestimmt die Position und den Radius der Plasmakugel auf dem Frame aus Bildmomenten, mit Unterpixel-Genauigkeit
+    und Standardabweichungen.
+
+    Objekte über HG mit einer Fläche kleiner als min_area (Rauschen) werden ignoriert. Die Position ist der mit der
+    Helligkeit über weight_floor (Standard: HG/2) gewichtete Schwerpunkt im Rechteck des größten Objekts plus margin
+    Pixel, der Radius der Radius eines Kreises mit der Fläche (Anzahl der Pixel über HG) des Objekts. Anders als bei
+    find_plasma wird dafür die Maske nicht erodiert und dilatiert. Die Standardabweichungen folgen aus dem Rauschen
+    der Pixel (geschätzt aus dem Hintergrund im Fenster) und für den Radius aus der Unsicherheit der Randpixel. roi
+    und crop_top wie bei find_plasma."""
+
+    if roi:
+        x_offset = max(roi[0], 0)
+        y_offset = max(roi[1], crop_top)
+        gray = frame[y_offset:roi[3], x_offset:roi[2]]
+    else:
+        x_offset = 0
+        y_offset = crop_top
+        gray = frame[crop_top:, :]
+    if weight_floor is None:
+        weight_floor = HG/2
+
+    with _metrics.stage('find_plasma_moments.threshold'):
+        thresh = cv2.threshold(gray, HG, 255, cv2.THRESH_BINARY)[1]
+        # einzelne gesättigte Pixel stören nur bei der Suche, gemessen wird auf der nicht erodierten Maske
+        conts = cv2.findContours(cv2.erode(thresh, None), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[0]
+    areas = [(cv2.contourArea(cont), cont) for cont in conts]
+    areas = sorted((item for item in areas if item[0] >= min_area), key=lambda item: item[0], reverse=True)
+
+    if not areas:
+        if error_raise:
+            _diagnostics.dump('PW_errors/no_plasma_error.png', frame)
+            _diagnostics.dump('PW_errors/no_plasma_error_mask.png', thresh)
+            raise NoPlasmaError("Es wurde kein Plasmakugel gefunden!")
+        return _NO_PLASMA
+
+    if len(areas) > 1 and areas[0][0] < 4*areas[1][0]:
+        _diagnostics.dump('plasma_errors/plasma_error.png', frame)
+        _diagnostics.dump('plasma_errors/plasma_error_objects.png', thresh)
+        raise RecognitionError("Mehrere Objekte gefunden!")
+
+    left, top, width, height = cv2.boundingRect(areas[0][1])
+    left, top, width, height = max(left - 1, 0), max(top - 1, 0), width + 2, height + 2
+    area = cv2.countNonZero(thresh[top:top + height, left:left + width])
+    x1, y1 = max(left - margin, 0), max(top - margin, 0)
+    x2, y2 = min(left + width + margin, gray.shape[1]), min(top + height + margin, gray.shape[0])
+    window = gray[y1:y2, x1:x2]
+
+    with _metrics.stage('find_plasma_moments.moments'):
+        weights = np.maximum(window.astype(np.float32) - np.float32(weight_floor), 0)
+        moments = cv2.moments(weights)
+        m00 = moments['m00']
+        x = moments['m10']/m00
+        y = moments['m01']/m00
+
+        # Rauschen der Pixel aus den zweiten Differenzen benachbarter Pixel des Hintergrunds (robust gegen Verläufe),
+        # gesättigte Pixel tragen nicht zum Rauschen bei
+        background = weights == 0
+        diffs = np.abs(np.diff(window.astype(np.int16), n=2, axis=1))[
+            background[:, 2:] & background[:, 1:-1] & background[:, :-2]]
+        noise = 1.4826*np.median(diffs)/np.sqrt(6) if diffs.size else 0.0
+        noisy = (weights > 0) & (window < 255)
+        ys, xs = np.nonzero(noisy)
+        sigma_x = noise*np.sqrt(np.sum((xs - x)**2))/m00
+        sigma_y = noise*np.sqrt(np.sum((ys - y)**2))/m00
+
+    r = np.sqrt(area/np.pi)
+    # etwa 2*pi*r Randpixel, von denen jedes mit Wahrscheinlichkeit 1/2 über oder unter HG liegen kann
+    sigma_r = np.sqrt(2*np.pi*r)/2/(2*np.pi*r)
+    return PlasmaEstimate(float(x + x1 + x_offset), float(y + y1 + y_offset), float(r),
+                          float(sigma_x), float(sigma_y), float(sigma_r))
+
+
+class RayTracker:
+    """Verfolgt den Jet-Strahl auf einer Kamera.
+
+    Nach einer erfolgreichen Erkennung wird im nächsten Frame nur in einem Spaltenfenster um die erwartete Position
+    gesucht. Die erwartete Position ist die letzte Position plus die mit predict_shift angekündigte Verschiebung.
+    Wenn der Strahl dort nicht gefunden wird oder am Rand des Fensters liegt, wird über die ganze Breite gesucht.
+    strategies wählt die Verfahren des RayDetector."""
+
+    def __init__(self, crop: Tuple[int, int] = (300, 800), half_width: int = 100, border: int = 20,
+                 refresh_every: int = 50,
+                 strategies: Union[str, RayStrategy, Sequence[Union[str, RayStrategy]]] = 'row_max'):
+        self.detector = RayDetector(strategies, crop)
+        self.half_width = half_width  # halbe Fensterbreite in Pixel
+        self.border = border  # minimaler Abstand vom Strahl zum Rand des Fensters in Pixel
+        self.refresh_every = refresh_every
+
+        self.enabled = True
+        self.last: Optional[float] = None
+        self.sigma: Optional[float] = None  # Standardabweichung von last in Pixel, falls das Verfahren sie liefert
+        self._roi_hits = 0
+
+    @property
+    def crop(self) -> Tuple[int, int]:
+        return self.detector.crop
+
+    @crop.setter
+    def crop(self, value: Tuple[int, int]):
+        self.detector.crop = value
+
+    def set_strategies(self, strategies: Union[str, RayStrategy, Sequence[Union[str, RayStrategy]]]):
+        """Wechselt die Verfahren der Erkennung, die letzte Position wird vergessen."""
+        self.detector = RayDetector(strategies, self.crop, self.detector.blur_kernel)
+        self.reset()
+
+    def reset(self):
+        """Vergisst die letzte Position, der nächste Frame wird über die ganze Breite durchsucht."""
+        self.last = None
+        self.sigma = None
+        self._roi_hits = 0
+
+    def predict_shift(self, shift: float):
+        """Verschiebt die erwartete Position um shift Pixel, z.B. nach einem Bewegungsbefehl der Motoren."""
+        if self.last is not None:
+            self.last += shift
+
+    def window(self, width: int) -> Tuple[int, int]:
+        """Gibt das Spaltenfenster (x1, x2) um die erwartete Position zurück."""
+        x1 = min(max(int(self.last - self.half_width), 0), width)
+        x2 = max(min(int(self.last + self.half_width) + 1, width), 0)
+        return x1, x2
+
+    def find(self, frame: np.ndarray, error_raise: bool = False) -> Optional[float]:
+        """Bestimmt die Position des Jet-Strahls auf dem Frame."""
+
+        width = frame.shape[1]
+        if self.enabled and self.last is not None and self._roi_hits < self.refresh_every:
+            x1, x2 = self.window(width)
+            if x2 - x1 > 2*self.border:
+                try:
+                    x, sigma = self.detector.estimate(frame, x_crop=(x1, x2))
+                except RecognitionError:
+                    x = None
+                if x is not None and (x1 == 0 or x - x1 > self.border) and (x2 == width or x2 - x > self.border):
+                    self.last, self.sigma = x, sigma
+                    self._roi_hits += 1
+                    return x
+
+        self.sigma = None
+        x, sigma = self.detector.estimate(frame, error_raise)
+        self.last, self.sigma = x, sigma
+        self._roi_hits = 0
+        return x
+
+
+class PlasmaTracker:
+    """Verfolgt die Plasmakugel auf einer Kamera.
+
+    Nach einer erfolgreichen Erkennung wird im nächsten Frame nur in einem Fenster um die letzte Position (x, y, r)
+    gesucht. Wenn das Plasma dort nicht eindeutig gefunden wird oder am Rand des Fensters liegt, wird der ganze
+    Frame durchsucht. Spätestens nach refresh_every Frames wird der ganze Frame erneut geprüft.
+
+    method wählt die Erkennung: 'contour' (find_plasma) oder 'moments' (find_plasma_moments, mit
+    Standardabweichungen in sigma)."""
+
+    METHODS = ('contour', 'moments')
+
+    def __init__(self, HG: int = 254, crop_top: int = 0, min_pad: int = 60, pad_factor: float = 4,
+                 border: int = 10, refresh_every: int = 50, method: str = 'contour'):
+        if method not in self.METHODS:
+            raise ValueError(f'Unbekanntes Verfahren {method!r}, möglich sind {", ".join(self.METHODS)}.')
+        self.method = method
+        self.HG = HG
+        self.crop_top = crop_top
+        self.min_pad = min_pad  # minimale halbe Fenstergröße in Pixel
+        self.pad_factor = pad_factor  # halbe Fenstergröße in Radien des Plasmas
+        self.border = border  # minimaler Abstand vom Plasma zum Rand des Fensters in Pixel
+        self.refresh_every = refresh_every
+
+        self.enabled = True
+        self.last: Optional[Tuple[float, float, float]] = None
+        # Standardabweichungen (x, y, r) der letzten Erkennung in Pixel, None mit method='contour'
+        self.sigma: Optional[Tuple[float, float, float]] = None
+        self._roi_hits = 0
+
+    def reset(self):
+        """Vergisst die letzte Position, der nächste Frame wird vollständig durchsucht."""
+        self.last = None
+        self.sigma = None
+        self._roi_hits = 0
+
+    def window(self, shape: Tuple[int, int]) -> Tuple[int, int, int, int]:
+        """Gibt das Suchfenster (x1, y1, x2, y2) um die letzte Position zurück."""
+        x, y, r = self.last
+        pad = max(self.min_pad, self.pad_factor*r)
+        return (max(int(x - pad), 0), max(int(y - pad), self.crop_top),
+                min(int(x + pad) + 1, shape[1]), min(int(y + pad) + 1, shape[0]))
+
+    def _is_inside(self, x: float, y: float, r: float, roi: Tuple[int, int, int, int], shape: Tuple[int, int]) \
+            -> bool:
+        x1, y1, x2, y2 = roi
+        margin = r + self.border
+        # am Rand des Frames wird auch im ganzen Frame nicht weiter gesucht
+        return ((x1 == 0 or x - x1 > margin) and (y1 == self.crop_top or y - y1 > margin) and
+                (x2 == shape[1] or x2 - x > margin) and (y2 == shape[0] or y2 - y > margin))
+
+    def find(self, frame: np.ndarray, error_raise: bool = False) \
+            -> Union[Tuple[float, float, float], Tuple[None, None, None]]:
+        """Bestimmt die Position der Plasmakugel (x, y, r) auf dem Frame."""
+
+        if self.enabled and self.last is not None and self._roi_hits < self.refresh_every:
+            roi = self.window(frame.shape)
+            try:
+                x, y, r = self._find(frame, roi=roi)
+            except RecognitionError:
+                x = None
+            if x is not None and self._is_inside(x, y, r, roi, frame.shape):
+                self.last = (x, y, r)
+                self._roi_hits += 1
+                return x, y, r
+
+        x, y, r = self._find(frame, error_raise)
+        self.last = (x, y, r) if x is not None else None
+        self._roi_hits = 0
+        return x, y, r
+
+    def _find(self, frame: np.ndarray, error_raise: bool = False, roi: Tuple[int, int, int, int] = ()) \
+            -> Union[Tuple[float, float, float], Tuple[None, None, None]]:
+        if self.method == 'contour':
+            self.sigma = None
+            return find_plasma(frame, self.HG, self.crop_top, error_raise, roi=roi)
+        estimate = find_plasma_moments(frame, self.HG, self.crop_top, error_raise, roi=roi)
+        self.sigma = estimate[3:] if estimate.x is not None else None
+        return estimate[:3]
+
+
+@_measured('find_nozzle')
 def find_nozzle(frame: np.ndarray, HG: int = 30, crop: int = 300,  error_raise: bool = False) \
         -> Union[Tuple[float, float], Tuple[None, None]]:
     """Bestimmt die Position der Plasmakugel auf dem Frame."""
@@ -429,19 +856,22 @@ def find_nozzle(frame: np.ndarray, HG: int = 30, crop: int = 300,  error_raise:
     # show(gray)
 
     kernel_size = 5
-    gray = cv2.GaussianBlur(gray,(kernel_size, kernel_size),0)
+    with _metrics.stage('find_nozzle.blur'):
+        gray = cv2.GaussianBlur(gray,(kernel_size, kernel_size),0)
     # show(gray)
 
-    thresh = cv2.threshold(gray, HG, 255, cv2.THRESH_BINARY)[1]
-    # show(thresh)
+    with _metrics.stage('find_nozzle.threshold'):
+        thresh = cv2.threshold(gray, HG, 255, cv2.THRESH_BINARY)[1]
+        # show(thresh)
 
-    thresh = cv2.erode(thresh, None, iterations=2)
-    # show(thresh)
+        thresh = cv2.erode(thresh, None, iterations=2)
+        # show(thresh)
 
-    thresh = cv2.dilate(thresh, None, iterations=9)
-    # show(thresh)
+        thresh = cv2.dilate(thresh, None, iterations=9)
+        # show(thresh)
 
-    conts, h = cv2.findContours(thresh.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
+    with _metrics.stage('find_nozzle.contours'):
+        conts, h = cv2.findContours(thresh.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
 
     # img = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
     # cv2.drawContours(img, conts, -1, (255, 0, 0), 3)
@@ -449,8 +879,8 @@ def find_nozzle(frame: np.ndarray, HG: int = 30, crop: int = 300,  error_raise:
     if conts is None or conts == []:
         # print(None)
         if error_raise:
-            cv2.imwrite('PW_errors/no_nozzle_error.png', frame)
-            cv2.imwrite('PW_errors/no_nozzle_error_mask.png', thresh)
+            _diagnostics.dump('PW_errors/no_nozzle_error.png', frame)
+            _diagnostics.dump('PW_errors/no_nozzle_error_mask.png', thresh)
             # show(frame)
             # show(thresh)
             raise NoNozzleError("Es wurde keine Düse gefunden!")
@@ -471,14 +901,16 @@ def find_nozzle(frame: np.ndarray, HG: int = 30, crop: int = 300,  error_raise:
         objects.sort(key=equi_diameter, reverse=True)
 
         if equi_diameter(objects[0]) < 4*equi_diameter(objects[1]):
-            img = cv2.cvtColor(gray, cv2.COLOR_BGR2RGB)
-            cv2.drawContours(img, conts, -1, (255, 0, 0), 3)
-            for obj in objects:
-                x1, dx, y1, dy = obj
-                cv2.rectangle(img, (round(x1), round(y1)), (round(x1+dx), round(y1+dy)), (0, 255, 0), 2)
-            # show(img)
-
-            cv2.imwrite('PW_errors/nozzle_error.png', frame)
+            def draw_objects() -> np.ndarray:
+                img = cv2.cvtColor(gray, cv2.COLOR_BGR2RGB)
+                cv2.drawContours(img, conts, -1, (255, 0, 0), 3)
+                for obj in objects:
+                    x1, dx, y1, dy = obj
+                    cv2.rectangle(img, (round(x1), round(y1)), (round(x1+dx), round(y1+dy)), (0, 255, 0), 2)
+                return img
+
+            _diagnostics.dump('PW_errors/nozzle_error.png', frame)
+            _diagnostics.dump('PW_errors/nozzle_error_objects.png', draw_objects)
             raise RecognitionError("Mehrere Objekte gefunden!")
 
     x1, dx, y1, dy = objects[0]
@@ -487,6 +919,21 @@ def find_nozzle(frame: np.ndarray, HG: int = 30, crop: int = 300,  error_raise:
     return x, d
 
 
+def draw_lines(frame: np.ndarray, lines: np.ndarray, crop: Tuple[int, int] = ()) -> np.ndarray:
+    """Zeichnet die erkannten Geraden farbig auf den Frame."""
+    frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    line_image = np.copy(frame) * 0  # creating a blank to draw lines on
+    colors = ((0,0,255), (0,128,255), (0,255,128), (255,255,0), (255,0,0))
+    for i, line in enumerate(lines):
+
+        x1, y1, x2, y2 = line
+        if crop:
+            y1 += crop[0]
+            y2 += crop[0]
+        cv2.line(line_image, (round(x1), round(y1)), (round(x2), round(y2)), colors[i % len(colors)], 1)
+    return cv2.addWeighted(frame, 0.8, line_image, 1, 0)
+
+
 def draw_circle(frame, x: float, y: float, r: float, center: bool = False) -> np.ndarray:
     frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2RGB)
     cv2.circle(frame, (round(x), round(y))
@@ -529,6 +976,25 @@ def fit_the_data(x: np.ndarray, y: np.ndarray, model: str = 'linear', n_sigma: f
     return np.array(list(out.best_values.values())), err
 
 
+def spread_order(n: int) -> List[int]:
+    """Gibt die Indizes 0..n-1 in einer Reihenfolge zurück, in der die ersten Punkte möglichst weit gestreut sind:
+    zuerst die beiden Enden, dann jeweils die Mitte der größten Lücke."""
+
+    if n <= 2:
+        return list(range(n))
+    order = [0, n - 1]
+    gaps = [(-(n - 1), 0, n - 1)]
+    while gaps:
+        _, a, b = heapq.heappop(gaps)
+        if b - a < 2:
+            continue
+        mid = (a + b)//2
+        order.append(mid)
+        heapq.heappush(gaps, (-(mid - a), a, mid))
+        heapq.heappush(gaps, (-(b - mid), mid, b))
+    return order
+
+
 def find_plasma_max_from_data(z: np.ndarray, r: np.ndarray) -> float:
     # koef, err = fit_the_data(x, r, 'gauss', plot=True)
 
@@ -590,7 +1056,8 @@ class PlasmaWatcher:
                  laser_z: Motor | None = None,
                  laser_y: Motor | None = None,
                  nozzle_d: float = 1000,
-                 tol_pixel: float = 1):
+                 tol_pixel: float = 1,
+                 clock: Optional[WallClock] = None):
         self.camera1 = camera1
         self.camera2 = camera2
 
@@ -638,18 +1105,73 @@ class PlasmaWatcher:
         self.jett_laser_dz = 0
         self.pl_r_max = 0
 
+        self.plasma_tracker1 = PlasmaTracker(crop_top=300, method='moments')
+        self.plasma_tracker2 = PlasmaTracker(crop_top=300, method='moments')
+        self.ray_tracker1 = RayTracker(crop=(300, 800), strategies='centroid')
+        self.ray_tracker2 = RayTracker(crop=(300, 800), strategies='centroid')
+
         self._frame1_is_new = True
         self._frame2_is_new = True
 
+        # die zweite Kamera wird parallel in diesem Pool ausgewertet, er wird beim ersten Gebrauch angelegt und mit
+        # close beendet
+        self.parallel_cameras = True
+        self._camera2_pool: Optional[ThreadPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+
+        # im Stream werden nur gleichzeitig aufgenommene Frames der beiden Kameras zusammen ausgewertet
+        self.frame_sync = FramePairSynchronizer(camera1, camera2, max_skew=0.02)
+        self._pair_seq = 0
+
+        # Zeitbasis für die Wartezeiten und den Filter, mit dem Emulator die VirtualClock des JetEmulator. Die
+        # Aufnahmezeiten der Kameras (CameraInterf.time) müssen auf derselben Uhr liegen.
+        self.clock = WallClock() if clock is None else clock
+        for camera in (camera1, camera2):
+            if abs(camera.time() - self.clock.time()) > 1:
+                logging.warning('Die Zeit der Kamera passt nicht zur Uhr des PlasmaWatcher, die Aufnahmezeiten im '
+                                'Stream sind dann für den Filter nicht brauchbar.')
+
+        # geglätteter Zustand des Plasmas aus allen Messungen von find_plasma
+        self.plasma_filter = PlasmaFilter()
+
         self.plasma_holder = PlasmaHolder(self, freq=1/3, brightness_tol=0.1)
         self._hold_plasma_is_on = False
         self.dont_move = False  # ein Marker um automatische bewegungen während der Messung zu verbitten
 
-        self.camera1.connect_to_stream(self._new_frame1_event)
-        self.camera2.connect_to_stream(self._new_frame2_event)
+        self.camera1.connect_to_stream(self._new_frame1_event, direct=True)
+        self.camera2.connect_to_stream(self._new_frame2_event, direct=True)
 
         self.displ_units = self.jet_z.config['display_units']
 
+    def close(self):
+        """Beendet das Halten des Plasmas und den Pool der zweiten Kamera und meldet sich von den Streams der Kameras
+        ab. Danach wird der PlasmaWatcher nicht mehr benutzt."""
+
+        if self.plasma_holder.is_alive():
+            self.plasma_holder.stop(wait=True)
+        self.frame_sync.close()
+        self.camera1.disconnect_from_stream(self._new_frame1_event)
+        self.camera2.disconnect_from_stream(self._new_frame2_event)
+        with self._pool_lock:
+            pool, self._camera2_pool = self._camera2_pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+    def set_ray_strategies(self, strategies: Union[str, RayStrategy, Sequence[Union[str, RayStrategy]]]):
+        """Wählt die Verfahren zur Erkennung des Jet-Strahls für beide Kameras (siehe RAY_STRATEGIES)."""
+
+        self.ray_tracker1.set_strategies(strategies)
+        self.ray_tracker2.set_strategies(strategies)
+
+    def set_plasma_method(self, method: str):
+        """Wählt das Verfahren zur Erkennung der Plasmakugel für beide Kameras (siehe PlasmaTracker)."""
+
+        if method not in PlasmaTracker.METHODS:
+            raise ValueError(f'Unbekanntes Verfahren {method!r}, möglich sind {", ".join(PlasmaTracker.METHODS)}.')
+        for tracker in (self.plasma_tracker1, self.plasma_tracker2):
+            tracker.method = method
+            tracker.reset()
+
     def laser_on_mode(self):
         """Passt die einstellungen für die eingeschaltete Laser an."""
 
@@ -690,106 +1212,208 @@ class PlasmaWatcher:
     def _new_frame2_event(self, frame: np.ndarray):
         self._frame2_is_new = True
 
+    def _for_both_cameras(self, action1: Callable, action2: Callable) -> tuple:
+        """Führt action1 (erste Kamera) und action2 (zweite Kamera) gleichzeitig aus und gibt beide Ergebnisse
+        zurück."""
+
+        if not self.parallel_cameras:
+            return action1(), action2()
+
+        with self._pool_lock:
+            if self._camera2_pool is None:
+                self._camera2_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='PlasmaWatcher_camera2')
+            pool = self._camera2_pool
+        future2 = pool.submit(action2)
+        try:
+            result1 = action1()
+        finally:
+            # die zweite Kamera muss fertig sein, bevor sie wieder benutzt wird
+            wait([future2])
+        return result1, future2.result()
+
+    def _acquire(self, camera: CameraInterf, error_raise: bool = False) -> Optional[np.ndarray]:
+        """Gibt den nächsten Frame der Kamera zurück. Kommt im Stream keiner an, wird None zurückgegeben bzw. mit
+        error_raise FrameTimeoutError geworfen."""
+
+        # im Stream wird auf den nächsten Frame gewartet, dafür muss eine VirtualClock weiterlaufen
+        try:
+            with _metrics.stage('PlasmaWatcher.acquire'), self.clock.detached():
+                return camera.get_frame()
+        except FrameTimeoutError:
+            _metrics.count('PlasmaWatcher.frame_timeouts')
+            if error_raise:
+                raise
+            logging.warning('Kein neuer Frame aus dem Stream bekommen, die Auswertung wird ausgelassen.')
+            return None
+
     def get_nozzle_z1(self, HG: int = 30, crop: int = 300, error_raise: bool = False) \
             -> Union[Tuple[float, float], Tuple[None, None]]:
         """Gibt die Position und den Diameter der Düse auf der ersten Kamera in Pixel zurück"""
 
-        frame1 = self.camera1.get_frame()
+        frame1 = self._acquire(self.camera1, error_raise)
+        if frame1 is None:
+            return None, None
         return find_nozzle(frame1, HG, crop, error_raise)
 
     def get_nozzle_z2(self, HG: int = 30, crop: int = 300, error_raise: bool = False) \
             -> Union[Tuple[float, float], Tuple[None, None]]:
         """Gibt die Position und den Diameter der Düse auf der ersten Kamera in Pixel zurück"""
 
-        frame2 = self.camera2.get_frame()
+        frame2 = self._acquire(self.camera2, error_raise)
+        if frame2 is None:
+            return None, None
         return find_nozzle(frame2, HG, crop, error_raise)
 
-    def _get_j_x1(self, error_raise: bool = False) -> float:
+    def _get_j_x1(self, error_raise: bool = False, frame: Optional[np.ndarray] = None) -> float:
         """Gibt Jet-Position auf der ersten Kamera in Pixel zurück"""
 
-        if self.camera1.mode == 'stream' and not self._frame1_is_new:
+        if frame is not None:
+            self._j_x1 = self.ray_tracker1.find(frame, error_raise)
+        elif self.camera1.mode == 'stream' and not self._frame1_is_new:
             pass
         else:
-            frame1 = self.camera1.get_frame()
+            frame1 = self._acquire(self.camera1, error_raise)
             self._frame1_is_new = False
-            self._j_x1 = find_ray(frame1, error_raise, crop=(300, 800))
+            self._j_x1 = None if frame1 is None else self.ray_tracker1.find(frame1, error_raise)
         return self._j_x1
 
-    def _get_j_x2(self, error_raise: bool = False) -> float:
+    def _get_j_x2(self, error_raise: bool = False, frame: Optional[np.ndarray] = None) -> float:
         """Gibt Jet-Position auf der zweiten Kamera in Pixel zurück"""
 
-        if self.camera2.mode == 'stream' and not self._frame2_is_new:
+        if frame is not None:
+            self._j_x2 = self.ray_tracker2.find(frame, error_raise)
+        elif self.camera2.mode == 'stream' and not self._frame2_is_new:
             pass
         else:
-            frame2 = self.camera2.get_frame()
+            frame2 = self._acquire(self.camera2, error_raise)
             self._frame2_is_new = False
-            self._j_x2 = find_ray(frame2, error_raise, crop=(300, 800))
+            self._j_x2 = None if frame2 is None else self.ray_tracker2.find(frame2, error_raise)
         return self._j_x2
 
-    def _find_plasma1(self, error_raise: bool = False) -> (float, float, float):
+    def _find_plasma1(self, error_raise: bool = False, frame: Optional[np.ndarray] = None) -> (float, float, float):
         """Gibt die Plasma-Position und den Radius (x, z, r) auf der ersten Kamera in Pixel zurück"""
 
-        if self.camera1.mode == 'stream' and not self._frame1_is_new:
+        if frame is not None:
+            self._pl_x1, self._pl_y1, self._pl_r1 = self.plasma_tracker1.find(frame, error_raise)
+        elif self.camera1.mode == 'stream' and not self._frame1_is_new:
             pass
         else:
-            frame1 = self.camera1.get_frame()
+            frame1 = self._acquire(self.camera1, error_raise)
             self._frame1_is_new = False
-            self._pl_x1, self._pl_y1, self._pl_r1 = find_plasma(frame1, error_raise=error_raise, crop_top=300)
+            if frame1 is None:
+                self._pl_x1, self._pl_y1, self._pl_r1 = None, None, None
+            else:
+                self._pl_x1, self._pl_y1, self._pl_r1 = self.plasma_tracker1.find(frame1, error_raise)
         return self._pl_x1, self._pl_y1, self._pl_r1
 
-    def _find_plasma2(self, error_raise: bool = False) -> (float, float, float):
+    def _find_plasma2(self, error_raise: bool = False, frame: Optional[np.ndarray] = None) -> (float, float, float):
         """Gibt die Plasma-Position und den Radius (x, z, r) auf der zweiten Kamera in Pixel zurück"""
 
-        if self.camera2.mode == 'stream' and not self._frame2_is_new:
+        if frame is not None:
+            self._pl_x2, self._pl_y2, self._pl_r2 = self.plasma_tracker2.find(frame, error_raise)
+        elif self.camera2.mode == 'stream' and not self._frame2_is_new:
             pass
         else:
-            frame2 = self.camera2.get_frame()
+            frame2 = self._acquire(self.camera2, error_raise)
             self._frame2_is_new = False
-            self._pl_x2, self._pl_y2, self._pl_r2 = find_plasma(frame2, error_raise=error_raise, crop_top=300)
+            if frame2 is None:
+                self._pl_x2, self._pl_y2, self._pl_r2 = None, None, None
+            else:
+                self._pl_x2, self._pl_y2, self._pl_r2 = self.plasma_tracker2.find(frame2, error_raise)
         return self._pl_x2, self._pl_y2, self._pl_r2
 
+    def _next_frame_pair(self, timeout_s: float = 3) -> Optional[Tuple[np.ndarray, np.ndarray, float]]:
+        """Gibt das nächste noch nicht ausgewertete synchrone Paar von Frames mit seiner Aufnahmezeit
+        (frame1, frame2, timestamp) zurück, wenn beide Kameras streamen. Sonst, oder wenn innerhalb von timeout_s kein
+        Paar gebildet wurde, wird None zurückgegeben."""
+
+        if not (self.camera1.is_streaming() and self.camera2.is_streaming()):
+            return None
+        try:
+            with _metrics.stage('PlasmaWatcher.acquire'), self.clock.detached():
+                self._pair_seq, pair = self.frame_sync.wait_pair(self._pair_seq, timeout_s)
+        except FrameTimeoutError:
+            logging.warning('Kein synchrones Paar von Frames bekommen, die Frames werden einzeln abgefragt.')
+            return None
+        return pair.frame1, pair.frame2, pair.timestamp()
+
+    def wait_frame_pair(self, skip: int = 0, timeout_s: float = 3) -> bool:
+        """Wartet, bis aus den Streams beider Kameras skip + 1 neue synchrone Paare von Frames gebildet wurden. Die
+        übersprungenen Paare werden nicht ausgewertet, das letzte beim nächsten Aufruf von find_plasma oder
+        get_jet_position. Gibt False zurück, wenn die Kameras nicht streamen oder innerhalb von timeout_s kein Paar
+        gebildet wurde."""
+
+        if not (self.camera1.is_streaming() and self.camera2.is_streaming()):
+            return False
+        try:
+            with self.clock.detached():
+                seq, _ = self.frame_sync.wait_pair(self._pair_seq + skip, timeout_s)
+        except FrameTimeoutError:
+            return False
+        self._pair_seq = seq - 1
+        return True
+
+    @_measured('PlasmaWatcher.get_jet_position')
     def get_jet_position(self, error_raise: bool = False) -> Optional[Tuple[float, float]]:
         """Gibt Jet-Position in Raum (x, y) zurück."""
 
-        x1_p = self._get_j_x1(error_raise)
-        x2_p = self._get_j_x2(error_raise)
+        frame1, frame2, _ = self._next_frame_pair() or (None, None, None)
+        x1_p, x2_p = self._for_both_cameras(partial(self._get_j_x1, error_raise, frame1),
+                                            partial(self._get_j_x2, error_raise, frame2))
         if x1_p is None or x2_p is None:
             return None
 
-        x1 = self.g1*(x1_p - self.res_x/2)
-        x2 = self.g2*(x2_p - self.res_x/2)
+        with _metrics.stage('PlasmaWatcher.triangulation'):
+            x1 = self.g1*(x1_p - self.res_x/2)
+            x2 = self.g2*(x2_p - self.res_x/2)
 
-        x_ = (x1 * cos(self._phi) - x2) / sin(self._phi)
-        z_ = x1
+            x_ = (x1 * cos(self._phi) - x2) / sin(self._phi)
+            z_ = x1
 
-        x, z = self.camera1_coord.cc_to_mc(x_, z_)
+            x, z = self.camera1_coord.cc_to_mc(x_, z_)
 
         return x, z
 
+    @_measured('PlasmaWatcher.find_plasma')
     def find_plasma(self, error_raise: bool = False) \
             -> Union[Tuple[float, float, float, float], Tuple[None, None, None, None]]:
         """Gibt die Plasma-Position in Raum und den Radius (x, y, z, r) zurück."""
 
-        x1, y1, r1 = self._find_plasma1(error_raise)
-        x2, y2, r2 = self._find_plasma2(error_raise)
+        frame1, frame2, timestamp = self._next_frame_pair() or (None, None, None)
+        if timestamp is None:
+            # einzeln abgefragte Frames werden jetzt aufgenommen
+            timestamp = self.clock.time()
+        (x1, y1, r1), (x2, y2, r2) = self._for_both_cameras(partial(self._find_plasma1, error_raise, frame1),
+                                                            partial(self._find_plasma2, error_raise, frame2))
         if x1 is None or x2 is None:
+            self.plasma_filter.miss()
             return None, None, None, None
 
-        x1 = self.g1*(x1 - self.res_x/2)
-        y1 = self.g1*(-y1 + self.res_y/2)
-        r1 *= self.g1
+        with _metrics.stage('PlasmaWatcher.triangulation'):
+            x1 = self.g1*(x1 - self.res_x/2)
+            y1 = self.g1*(-y1 + self.res_y/2)
+            r1 *= self.g1
 
-        x2 = self.g2*(x2 - self.res_x/2)
+            x2 = self.g2*(x2 - self.res_x/2)
 
-        x_ = (x1*cos(self._phi) - x2)/sin(self._phi)
-        z_ = x1
+            x_ = (x1*cos(self._phi) - x2)/sin(self._phi)
+            z_ = x1
 
-        x, z = self.camera1_coord.cc_to_mc(x_, z_)
+            x, z = self.camera1_coord.cc_to_mc(x_, z_)
         y = y1
         r = r1
 
+        # der Filter bekommt die Aufnahmezeit, sonst ginge die Wartezeit und Auswertung in die Geschwindigkeit ein
+        self.plasma_filter.update(timestamp, x, y, z, r, self.get_plasma_sigma())
         return x, y, z, r
 
+    def get_filtered_plasma(self) -> Optional[PlasmaState]:
+        """Gibt den geglätteten Zustand des Plasmas (Position, Geschwindigkeit und Radius mit Kovarianzen) aus den
+        bisherigen Messungen von find_plasma zurück, vorhergesagt auf die aktuelle Zeit. None, wenn das Plasma in den
+        letzten Frames nicht gefunden wurde."""
+
+        return self.plasma_filter.state(self.clock.time())
+
     def get_plasma_radius(self) -> Union[float, None]:
         """Gibt den Radius der Plasma zurück, laut 1. Camera."""
 
@@ -807,6 +1431,40 @@ class PlasmaWatcher:
         x, y, z, r = self.find_plasma(error_raise)
         return x, y, z
 
+    def get_jet_position_sigma(self) -> Optional[Tuple[float, float]]:
+        """Gibt die Standardabweichungen (x, z) der letzten Jet-Position aus get_jet_position zurück, berechnet aus
+        den Standardabweichungen der beiden Kameras. None, wenn das Verfahren der Erkennung keine liefert (nur
+        'centroid' liefert sie, siehe set_ray_strategies)."""
+
+        sigma1, sigma2 = self.ray_tracker1.sigma, self.ray_tracker2.sigma
+        if sigma1 is None or sigma2 is None:
+            return None
+        return self._triangulation_sigma(sigma1, sigma2)
+
+    def get_plasma_sigma(self) -> Optional[Tuple[float, float, float, float]]:
+        """Gibt die Standardabweichungen (x, y, z, r) der letzten Plasma-Position und des Radius aus find_plasma
+        zurück. None, wenn das Verfahren der Erkennung keine liefert (method='contour' der PlasmaTracker)."""
+
+        sigma1, sigma2 = self.plasma_tracker1.sigma, self.plasma_tracker2.sigma
+        if sigma1 is None or sigma2 is None:
+            return None
+        sigma_x, sigma_z = self._triangulation_sigma(sigma1[0], sigma2[0])
+        return sigma_x, self.g1*sigma1[1], sigma_z, self.g1*sigma1[2]
+
+    def _triangulation_sigma(self, sigma1: float, sigma2: float) -> Tuple[float, float]:
+        """Rechnet die Standardabweichungen der x-Pixelpositionen auf beiden Kameras in die Standardabweichungen
+        (x, z) im Raum um."""
+
+        # Ableitungen von (x_, z_) nach den Pixelpositionen auf beiden Kameras, dann die Drehung von cc_to_mc
+        jacobian = np.array([[self.g1*cos(self._phi)/sin(self._phi), -self.g2/sin(self._phi)],
+                             [self.g1, 0]])
+        psi = self.camera1_coord.psi
+        rotation = np.array([[cos(psi), -sin(psi)],
+                             [sin(psi), cos(psi)]])
+        m = rotation @ jacobian
+        covariance = m @ np.diag([sigma1**2, sigma2**2]) @ m.T
+        return float(np.sqrt(covariance[0, 0])), float(np.sqrt(covariance[1, 1]))
+
     def j_x(self, error_raise: bool = False) -> Optional[float]:
         """Gibt x-Koordinate von der Jet-Position in Raum zurück."""
 
@@ -825,11 +1483,22 @@ class PlasmaWatcher:
         else:
             return pos[1]
 
+    def _predict_jet_shift(self, shift_x: float, shift_z: float):
+        """Kündigt den Ray-Trackern eine Verschiebung des Jets (in displ-Einheiten) an."""
+
+        self.ray_tracker1.predict_shift(self.camera1_coord.mc_to_cc(shift_x, shift_z)[1]/self.g1)
+        self.ray_tracker2.predict_shift(self.camera2_coord.mc_to_cc(shift_x, shift_z)[1]/self.g2)
+
     def move_jet(self, shift_x: float, shift_z: float, units: str = 'displ', wait: bool = False,
                  stop_indicator: Optional[StopIndicator] = None):
         """Bewegt Jet-Strahl zu den angegebenen Verschiebungen."""
 
-        self.motors_cl.go({'JetX': shift_x, 'JetZ': shift_z}, units=units, wait=wait, stop_indicator=stop_indicator)
+        if units == 'displ':
+            self._predict_jet_shift(shift_x, shift_z)
+        with _metrics.stage('PlasmaWatcher.motor'):
+            self.motors_cl.go({'JetX': shift_x, 'JetZ': shift_z}, units=units, wait=wait,
+                              stop_indicator=stop_indicator)
+        self.plasma_filter.reset()
 
     def move_jet_to(self, target_x: Optional[float], target_z: Optional[float], wait: bool = False,
                     stop_indicator: Optional[StopIndicator] = None):
@@ -859,16 +1528,14 @@ class PlasmaWatcher:
         z_centre = round(self.camera1.get_resolution()[0]/2)
 
         # die Vergröserungen der Kameras abschätzen
-        z1, d1 = self.get_nozzle_z1()
-        z2, d2 = self.get_nozzle_z2()
+        (z1, d1), (z2, d2) = self._for_both_cameras(self.get_nozzle_z1, self.get_nozzle_z2)
 
         g1 = self.nozzle_d/d1
         g2 = self.nozzle_d/d2
 
         # zentrieren
         while not stop_indicator.has_stop_requested():
-            z1 = self.get_nozzle_z1()[0]
-            z2 = self.get_nozzle_z2()[0]
+            (z1, d1), (z2, d2) = self._for_both_cameras(self.get_nozzle_z1, self.get_nozzle_z2)
 
             if abs(z_centre - z1) < tol and abs(z_centre - z2) < tol:
                 logging.info('Die Zentrierung der Düse ist abgeschlossen.')
@@ -884,12 +1551,18 @@ class PlasmaWatcher:
 
     def calibrate_enl(self, init_step: float = 1000, rel_err: float = 0.01, n_points: int = 10,
                       stop_indicator: Optional[StopIndicator] = None) -> str:
-        """Führt eine Messung von den Vergröserungkoeffizienten g1 und g2 und speichert die Werte."""
+        """Führt eine Messung von den Vergröserungkoeffizienten g1 und g2 und speichert die Werte.
+
+        Pro Kamera werden höchstens n_points Punkte gemessen, zuerst die Enden des Bereichs, dann die Mitten der
+        größten Lücken. Es wird aufgehört, sobald der aus den Abweichungen vom Fit bestimmte relative Fehler von g
+        kleiner als rel_err ist. Liefert die Erkennung eine Standardabweichung (Verfahren 'centroid'), muss auch der
+        daraus fortgepflanzte Fehler kleiner sein, dann frühestens nach 3 Punkten, sonst frühestens nach 5."""
 
-        def measure_run(m_targets: np.ndarray, camera_coord: CameraCoordinates, get_jet_x: Callable) \
-                -> (np.ndarray, np.ndarray):
+        def measure_run(m_targets: np.ndarray, camera_coord: CameraCoordinates, get_jet_x: Callable,
+                        ray_tracker: RayTracker) -> (np.ndarray, np.ndarray):
             x_array_pixel = []
             x_array_displ = []
+            sigmas = []
 
             for m_target in m_targets:
                 target_x, target_z = camera_coord.cc_to_mc(0, m_target)
@@ -902,6 +1575,21 @@ class PlasmaWatcher:
                 jet_x_pos, jet_z_pos = self.jet_x.position('displ'), self.jet_z.position('displ')
                 x_projection = camera_coord.mc_to_cc(jet_x_pos, jet_z_pos)[1]
                 x_array_displ.append(x_projection)
+                sigmas.append(ray_tracker.sigma)
+
+                if None not in sigmas:
+                    if len(x_array_pixel) < 3:
+                        continue
+                    spread = np.std(x_array_pixel)*np.sqrt(len(x_array_pixel))
+                    # relativer Fehler der Steigung aus dem Fehler der Pixelpositionen, 3 sigma wie bei fit_the_data
+                    if 3*np.sqrt(np.mean(np.square(sigmas)))/spread >= rel_err:
+                        continue
+                elif len(x_array_pixel) < 5:
+                    # ohne Standardabweichung ist der Fehler aus wenigen Abweichungen vom Fit zu unsicher
+                    continue
+                koef, err = fit_the_data(np.array(x_array_pixel), np.array(x_array_displ), 'linear')
+                if err[0]/abs(koef[0]) < rel_err:
+                    break
             x_array_pixel = np.array(x_array_pixel) - self.res_x / 2
             x_array_displ = np.array(x_array_displ)
             return x_array_pixel, x_array_displ
@@ -921,6 +1609,7 @@ class PlasmaWatcher:
         jet_z_0_pos = self.jet_z.position('displ')
 
         while abs(x1_0_pixel - self._get_j_x1(error_raise=True)) < self.res_x/10:
+            self._predict_jet_shift(0, -init_step)
             self.jet_z.go(-init_step, units='displ', wait=True, stop_indicator=stop_indicator)
 
             if stop_indicator is not None:
@@ -932,6 +1621,7 @@ class PlasmaWatcher:
         self.g1 = self.camera1_coord.mc_to_cc(0, delta_z_displ)[1] / (self._get_j_x1(error_raise=True) - x1_0_pixel)
         self.g2 = self.camera2_coord.mc_to_cc(0, delta_z_displ)[1] / (self._get_j_x2(error_raise=True) - x2_0_pixel)
 
+        self._predict_jet_shift(0, jet_z_0_pos - self.jet_z.position('displ'))
         self.jet_z.go(jet_z_0_pos - self.jet_z.position('displ'), units='displ', wait=True,
                       stop_indicator=stop_indicator)
         if stop_indicator is not None:
@@ -939,14 +1629,16 @@ class PlasmaWatcher:
                 return "stopped"
 
         # Messungen durchführen
-        m_targets = np.linspace(-1/10, 1/10, n_points) * self.res_x
-        x1_array_pixel, x1_array_displ = measure_run(m_targets * self.g1, self.camera1_coord, self._get_j_x1)
+        m_targets = np.linspace(-1/10, 1/10, n_points)[spread_order(n_points)] * self.res_x
+        x1_array_pixel, x1_array_displ = measure_run(m_targets * self.g1, self.camera1_coord, self._get_j_x1,
+                                                     self.ray_tracker1)
 
         if stop_indicator is not None:
             if stop_indicator.has_stop_requested():
                 return "stopped"
 
-        x2_array_pixel, x2_array_displ = measure_run(m_targets * self.g2, self.camera2_coord, self._get_j_x2)
+        x2_array_pixel, x2_array_displ = measure_run(m_targets * self.g2, self.camera2_coord, self._get_j_x2,
+                                                     self.ray_tracker2)
 
         if stop_indicator is not None:
             if stop_indicator.has_stop_requested():
@@ -1024,7 +1716,7 @@ class PlasmaWatcher:
                         r = self.get_plasma_radius()
                         if r is None:
                             break
-                        sleep(time_per_point / mess_per_point)
+                        self.clock.sleep(time_per_point / mess_per_point)
                     if r is not None:
                         stop_search = True
                         start_point = point
@@ -1040,14 +1732,20 @@ class PlasmaWatcher:
         def measure_point(repeats: int) -> (float, float, float):
             position = self.jet_z.position('displ')
             pl_r_values = []
+            pl_r_sigmas = []
             for _ in range(repeats):
                 r = self.get_plasma_radius()
                 if r is not None:
                     pl_r_values.append(r)
+                    if self.plasma_tracker1.sigma is not None:
+                        pl_r_sigmas.append(self.g1*self.plasma_tracker1.sigma[2])
 
             if len(pl_r_values) >= 3 * mess_per_point / 4:
                 r_mean = mean(pl_r_values)
                 r_sigma = pstdev(pl_r_values)
+                # bei wenigen Messungen ist die Streuung unzuverlässig, dann die Unsicherheit der einzelnen Messungen
+                if pl_r_sigmas:
+                    r_sigma = max(r_sigma, mean(pl_r_sigmas))
             else:
                 r_mean = None
                 r_sigma = None
@@ -1145,6 +1843,7 @@ class PlasmaWatcher:
 
         # in die optimale Position fahren
         self.jet_z.go_to(max_position, 'displ', wait=True)
+        self.plasma_filter.reset()
 
         # alle nötige Daten speichern
         self.pl_r_max = self.find_plasma()[3]
@@ -1158,9 +1857,12 @@ class PlasmaWatcher:
     def compensate_motor_error(self):
         """Prüfen, ob der Abstand zwischen Jet- und Laserstrahl sich geändert hat, und korrigieren."""
 
-        if abs(self.laser_z.position('displ') - self.jet_z.position('displ') - self.jett_laser_dz) > self.laser_z.tol():
+        with _metrics.stage('PlasmaWatcher.motor'):
+            drift = self.laser_z.position('displ') - self.jet_z.position('displ') - self.jett_laser_dz
+        if abs(drift) > self.laser_z.tol():
             plasma_position = self.get_plasma_position(error_raise=True)
-            self.jet_z.go_to(self.laser_z.position('displ') + self.jett_laser_dz, 'displ', wait=True)
+            with _metrics.stage('PlasmaWatcher.motor'):
+                self.jet_z.go_to(self.laser_z.position('displ') + self.jett_laser_dz, 'displ', wait=True)
             self.move_plasma_to(*plasma_position, wait=True, br_control=False)
 
     # def check_plasma_brightness(self, keep_position: bool = True, calibrate: bool = True, actions: List[Callable] = [])\
@@ -1198,12 +1900,15 @@ class PlasmaWatcher:
         if br_control and not wait:
             self.check_plasma_brightness(keep_position=True)
 
-        self.motors_cl.go({'JetX': shift_x, 'JetZ': shift_z, 'LaserX': shift_x, 'LaserY': shift_y},
-                          units=units, wait=wait)
+        with _metrics.stage('PlasmaWatcher.motor'):
+            self.motors_cl.go({'JetX': shift_x, 'JetZ': shift_z, 'LaserX': shift_x, 'LaserY': shift_y},
+                              units=units, wait=wait)
+        self.plasma_filter.reset()
 
         if br_control and wait:
             self.check_plasma_brightness(keep_position=True)
 
+    @_measured('PlasmaWatcher.move_plasma_to')
     def move_plasma_to(self, target_x: Optional[float], target_y: Optional[float], target_z: Optional[float],
                        wait: bool = False, br_control: bool = True):
         """Bewegt Plasma zur absoluten Position, die als target gegeben wird. Wenn als target None gegeben ist,
@@ -1231,16 +1936,32 @@ class PlasmaWatcher:
 
 
 class PlasmaHolder(threading.Thread):
-    """Thread-Objekt für PlasmaWatcher, der die Position und Helligkeit des Plasmas aufbewahrt."""
+    """Thread-Objekt für PlasmaWatcher, der die Position und Helligkeit des Plasmas aufbewahrt.
 
-    def __init__(self, pl_watcher: PlasmaWatcher, freq: float = 1 / 3, brightness_tol: float = 0.1):
+    Wenn beide Kameras streamen, wird jedes decimation-te synchrone Paar von Frames ausgewertet, sobald es gebildet
+    ist. Sonst werden die Frames mit der Frequenz freq abgefragt. Korrekturen (Kalibrierung und die Aktionen) werden
+    höchstens max_correction_rate-mal pro Sekunde ausgelöst, dazwischen wird eine Abweichung nur gemeldet.
+
+    Mit use_filter werden die Entscheidungen über den geglätteten Zustand aus PlasmaWatcher.plasma_filter getroffen:
+    eine Abweichung zählt erst, wenn sie größer als decision_sigma Standardabweichungen ist, und ein einzelner Frame
+    ohne Plasma (z.B. durch Flackern) löst noch keine Kalibrierung aus."""
+
+    def __init__(self, pl_watcher: PlasmaWatcher, freq: float = 1 / 3, brightness_tol: float = 0.1,
+                 use_filter: bool = True, decision_sigma: float = 2, decimation: int = 1,
+                 max_correction_rate: float = 1 / 3):
         super().__init__()
         self.pl_watcher = pl_watcher
         self.freq = freq
+        self.decimation = decimation
+        self.max_correction_rate = max_correction_rate
 
         self.brightness_tol = brightness_tol
+        self.use_filter = use_filter
+        self.decision_sigma = decision_sigma
 
-        self._stop = False
+        # nicht _stop, das würde threading.Thread._stop überdecken
+        self._stop_event = threading.Event()
+        self._last_correction = float('-inf')
 
         self.dont_move = False
         self.br_control = False
@@ -1256,8 +1977,11 @@ class PlasmaHolder(threading.Thread):
 
         self._brightness = 1
 
-    def stop(self):
-        self._stop = True
+    def stop(self, wait: bool = False):
+        """Beendet den Thread nach der laufenden Prüfung. Mit wait wird auf das Ende gewartet."""
+        self.pl_watcher.clock.set(self._stop_event)
+        if wait and self.is_alive() and threading.current_thread() is not self:
+            self.join()
 
     def is_running(self):
         return self.is_alive()
@@ -1266,22 +1990,57 @@ class PlasmaHolder(threading.Thread):
         return self._brightness
 
     def start(self, do_shift_actions: bool = True, do_dimming_actions: bool = True):
-        self._stop = False
+        self._stop_event.clear()
         self.do_shift_actions_in_run = do_shift_actions
         self.do_dimming_actions_in_run = do_dimming_actions
+        self.pl_watcher.clock.register(self)
         super().start()
 
     def run(self):
-        while not self._stop:
-
-            self._check(brightness=True,
-                        calibrate=True,
-                        do_dimming_actions=self.do_dimming_actions_in_run,
-                        position=self.position_control,
-                        do_shift_actions=self.do_shift_actions_in_run)
-
-            sleep(1 / self.freq)
+        clock = self.pl_watcher.clock
+        try:
+            while not self._stop_event.is_set():
+                if self.pl_watcher.camera1.is_streaming() and self.pl_watcher.camera2.is_streaming():
+                    # kurze Wartezeit, damit stop auch ohne neue Frames schnell wirkt
+                    if not self.pl_watcher.wait_frame_pair(self.decimation - 1, timeout_s=0.1):
+                        continue
+                    if self._stop_event.is_set():
+                        break
+                    self._safe_check_and_correct()
+                else:
+                    self._safe_check_and_correct()
+                    clock.wait(self._stop_event, 1 / self.freq)
+        finally:
+            clock.unregister(self)
+
+    def _safe_check_and_correct(self):
+        """Wie _check_and_correct, ein Fehler (z.B. eine Kamera liefert keine Frames) wird nur protokolliert, damit
+        der Thread weiterläuft."""
+
+        try:
+            self._check_and_correct()
+        except Exception:
+            _metrics.count('PlasmaHolder.errors')
+            logging.exception('Die Prüfung des Plasmas ist fehlgeschlagen.')
+
+    def _check_and_correct(self):
+        """Eine Prüfung im Thread. Korrekturen nur, wenn die letzte mindestens 1/max_correction_rate s zurückliegt."""
+
+        clock = self.pl_watcher.clock
+        correct = clock.time() - self._last_correction >= 1 / self.max_correction_rate
+        result = self._check(brightness=True,
+                             calibrate=correct,
+                             do_dimming_actions=correct and self.do_dimming_actions_in_run,
+                             position=self.position_control,
+                             do_shift_actions=correct and self.do_shift_actions_in_run)
+        if False in result:
+            if correct:
+                self._last_correction = clock.time()
+                _metrics.count('PlasmaHolder.corrections')
+            else:
+                _metrics.count('PlasmaHolder.corrections_suppressed')
 
+    @_measured('PlasmaHolder.check', failed=lambda result: False in result)
     def _check(self, position: bool = False, brightness: bool = False, brightness_tol: Optional[float] = None,
                calibrate: bool = False, keep_position_by_cal: bool = False, do_shift_actions: bool = False,
                do_dimming_actions: bool = False, move_by_shift: bool = False) -> (Optional[bool], Optional[bool]):
@@ -1289,6 +2048,14 @@ class PlasmaHolder(threading.Thread):
         x, y, z, r = self.pl_watcher.find_plasma(error_raise=not brightness)
         brightness_is_ok = None
         position_is_ok = None
+        sigma = (0, 0, 0, 0)
+        if self.use_filter:
+            state = self.pl_watcher.get_filtered_plasma()
+            if state is None:
+                x, y, z, r = None, None, None, None
+            else:
+                (x, y, z), r = state.position, state.r.value
+                sigma = state.sigma
 
         if brightness_tol is None:
             brightness_tol = self.brightness_tol
@@ -1302,7 +2069,7 @@ class PlasmaHolder(threading.Thread):
                     self.pl_watcher.calibrate_plasma(keep_position=False, on_the_spot=True, fine_step=0,
                                           mess_per_point=4, brightness_decr=0)
                 brightness_is_ok = False
-            elif r < self.pl_watcher.pl_r_max*(1 - self.brightness_tol):
+            elif r + self.decision_sigma*sigma[3] < self.pl_watcher.pl_r_max*(1 - brightness_tol):
                 if do_dimming_actions:
                     self._do_actions_by_dimming()
                 if calibrate and not self.dont_move:
@@ -1313,11 +2080,12 @@ class PlasmaHolder(threading.Thread):
                 brightness_is_ok = True
 
         # check position
-        if position:
+        if position and x is not None:
             x0, y0, z0 = self.position
             self.pl_shift = (x - x0, y - y0, z - z0)
 
-            if not np.all(np.array(self.pl_shift) < self.pl_watcher.jet_x.tol()):
+            limit = np.maximum(self.pl_watcher.jet_x.tol(), self.decision_sigma*np.array(sigma[:3]))
+            if np.any(np.abs(self.pl_shift) >= limit):
                 if do_shift_actions:
                     self._do_actions_by_shift()
                 if not self.dont_move and move_by_shift:
@@ -1361,12 +2129,14 @@ class PlasmaHolder(threading.Thread):
 
 
 def PlasmaWatcher_BoxInput(camera1: CameraInterf, camera2: CameraInterf,
-                           box: Box, phi: float, psi: float, nozzle_d: float = 1000, tol_pixel: float = 1) -> PlasmaWatcher:
+                           box: Box, phi: float, psi: float, nozzle_d: float = 1000, tol_pixel: float = 1,
+                           clock: Optional[WallClock] = None) -> PlasmaWatcher:
     jet_x = box.get_motor_by_name('JetX')
     jet_z = box.get_motor_by_name('JetZ')
     laser_z = box.get_motor_by_name('LaserZ')
     laser_y = box.get_motor_by_name('LaserY')
-    return PlasmaWatcher(camera1, camera2, jet_x, jet_z, laser_z, laser_y, phi, psi, nozzle_d, tol_pixel)
+    return PlasmaWatcher(camera1, camera2, jet_x, jet_z, phi, psi, laser_z=laser_z, laser_y=laser_y,
+                         nozzle_d=nozzle_d, tol_pixel=tol_pixel, clock=clock)
 
 
 class RecognitionError(Exception):
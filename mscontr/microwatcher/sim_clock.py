@@ -0,0 +1,129 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Set
+
+
+class WallClock:
+    """Echte Zeit (time.monotonic und time.sleep). Teilnehmer werden nicht gebraucht und ignoriert."""
+
+    def time(self) -> float:
+        return time.monotonic()
+
+    def sleep(self, seconds: float):
+        time.sleep(seconds)
+
+    def wait(self, event: threading.Event, seconds: float) -> bool:
+        """Wartet höchstens seconds auf event und gibt zurück, ob es gesetzt ist."""
+        return event.wait(seconds)
+
+    def set(self, event: threading.Event):
+        """Setzt event und weckt die Threads, die mit wait darauf warten."""
+        event.set()
+
+    def register(self, thread: Optional[threading.Thread] = None):
+        pass
+
+    def unregister(self, thread: Optional[threading.Thread] = None):
+        pass
+
+    @contextmanager
+    def participant(self):
+        yield
+
+    @contextmanager
+    def detached(self):
+        """Für das Warten auf andere Threads (z.B. auf Frames): der aktuelle Thread hält die Zeit für die Dauer des
+        with-Blocks nicht an."""
+        yield
+
+
+class VirtualClock(WallClock):
+    """Simulierte Zeit für die Emulatoren, die so schnell läuft, wie der Rechner es erlaubt.
+
+    Die Zeit steht, solange ein Teilnehmer-Thread arbeitet. Erst wenn alle Teilnehmer in sleep warten, springt sie auf
+    den frühesten Weckzeitpunkt und weckt die fälligen Threads. Threads, die keine Teilnehmer sind, können auch sleep
+    aufrufen, halten die Zeit aber nicht an. Ein Teilnehmer darf nur über sleep warten (nicht z.B. auf einen Frame
+    aus einem anderen Thread), sonst bleibt die Zeit stehen.
+
+    Threads werden mit register vor ihrem Start angemeldet, damit der Ablauf nicht davon abhängt, wann sie loslaufen.
+    """
+
+    def __init__(self, start: float = 0):
+        self._now = start
+        self._cond = threading.Condition()
+        self._participants: Set[threading.Thread] = set()
+        # wartender Thread -> Weckzeitpunkt
+        self._sleeping: Dict[threading.Thread, float] = {}
+
+    def time(self) -> float:
+        with self._cond:
+            return self._now
+
+    def sleep(self, seconds: float):
+        thread = threading.current_thread()
+        with self._cond:
+            self._sleeping[thread] = self._now + max(seconds, 0)
+            self._advance()
+            self._cond.wait_for(lambda: thread not in self._sleeping)
+
+    def wait(self, event: threading.Event, seconds: float) -> bool:
+        """Wie sleep, endet aber, sobald event mit set gesetzt wird. Ein direkt gesetztes Ereignis (event.set())
+        bemerkt der Thread erst, wenn er das nächste Mal geweckt wird."""
+        thread = threading.current_thread()
+        with self._cond:
+            self._sleeping[thread] = self._now + max(seconds, 0)
+            self._advance()
+            self._cond.wait_for(lambda: thread not in self._sleeping or event.is_set())
+            self._sleeping.pop(thread, None)
+        return event.is_set()
+
+    def set(self, event: threading.Event):
+        with self._cond:
+            event.set()
+            self._cond.notify_all()
+
+    def register(self, thread: Optional[threading.Thread] = None):
+        """Meldet thread (Standard: der aktuelle Thread) als Teilnehmer an."""
+        with self._cond:
+            self._participants.add(thread or threading.current_thread())
+
+    def unregister(self, thread: Optional[threading.Thread] = None):
+        with self._cond:
+            self._participants.discard(thread or threading.current_thread())
+            self._advance()
+
+    @contextmanager
+    def participant(self):
+        """Meldet den aktuellen Thread für die Dauer des with-Blocks als Teilnehmer an."""
+        self.register()
+        try:
+            yield
+        finally:
+            self.unregister()
+
+    @contextmanager
+    def detached(self):
+        """Ein Teilnehmer wird für die Dauer des with-Blocks abgemeldet, damit die Zeit weiterläuft, während er auf
+        andere Threads wartet."""
+        thread = threading.current_thread()
+        with self._cond:
+            registered = thread in self._participants
+        if not registered:
+            yield
+            return
+        self.unregister(thread)
+        try:
+            yield
+        finally:
+            self.register(thread)
+
+    def _advance(self):
+        if not self._sleeping or not self._participants.issubset(self._sleeping):
+            return
+        self._now = max(self._now, min(self._sleeping.values()))
+        # die geweckten Threads werden sofort ausgetragen, damit die Zeit nicht weiterspringt, bevor sie laufen
+        for thread, deadline in list(self._sleeping.items()):
+            if deadline <= self._now:
+                del self._sleeping[thread]
+        self._cond.notify_all()
@@ -70,6 +70,8 @@ class Camera(CameraInterf):
 
         self.stream_delay = 0
         self.attempts_limit: int = 10
+        # Abstand zwischen der Uhr der Kamera und self.time in s, wird beim ersten Frame eines Streams bestimmt
+        self._timestamp_offset: Optional[float] = None
 
     def is_streaming(self) -> bool:
         return self.camera.is_streaming()
@@ -116,6 +118,7 @@ class Camera(CameraInterf):
 
     def start_stream(self, delay: float = 0):
         # print('start stream', self.id(), self.mode)
+        self._timestamp_offset = None
         self.camera.start_streaming(handler=self._new_frame_event, buffer_count=5)
         # print(self.id(), self.mode)
         self.stream_delay = delay
@@ -140,9 +143,18 @@ class Camera(CameraInterf):
         # print(frame.get_id(), frame.get_status())
         if not frame.get_status():
             numpy_frame = frame.as_numpy_ndarray().reshape((1088, 2048))
-            self.new_frame_event(numpy_frame)
+            self.new_frame_event(numpy_frame, timestamp=self._host_timestamp(frame), frame_id=frame.get_id())
         cam.queue_frame(frame)
 
+    def _host_timestamp(self, frame: VimbaFrame) -> float:
+        """Rechnet den Zeitstempel der Kamera (ns, Uhr der Kamera) in die Zeitbasis von self.time um. Der Abstand
+        der Uhren wird beim ersten Frame des Streams genommen, die Übertragungszeit dieses Frames steckt also als
+        konstanter Fehler in allen Zeitstempeln, die Abstände zwischen den Frames sind aber die der Kamera."""
+        camera_time = frame.get_timestamp()*1e-9
+        if self._timestamp_offset is None:
+            self._timestamp_offset = self.time() - camera_time
+        return camera_time + self._timestamp_offset
+
     def __del__(self):
 
         # self.stop_stream()
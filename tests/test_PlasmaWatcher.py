@@ -1,3 +1,7 @@
+import random
+import subprocess
+import sys
+import textwrap
 import time
 from copy import deepcopy
 from math import pi
@@ -9,17 +13,24 @@ import cv2
 # from MicroWatcher.camera_emulator import make_ray_photo
 
 from mscontr.microwatcher.plasma_camera_emulator import paint_circle, paint_line, JetEmulator, CameraEmulator, \
-    paint_nozzle
+    paint_nozzle, NozzleSprite, render_frame, SharedFrames, _init_render_worker, _close_render_worker, \
+    _worker_state
+from mscontr.microwatcher.sim_clock import VirtualClock
+from mscontr.microwatcher.camera_interface import CameraInterf, FrameTimeoutError
 from mscontr.microwatcher.plasma_watcher import find_ray, find_plasma, draw_circle, PlasmaWatcher, \
-    PlasmaWatcher_BoxInput, NoPlasmaError, merge_close_lines, CameraCoordinates, show, find_nozzle
+    PlasmaWatcher_BoxInput, NoPlasmaError, merge_close_lines, CameraCoordinates, show, find_nozzle, PlasmaTracker, \
+    RayTracker, RayDetector, RayFrame, RecognitionError, NoJetError, find_ray_subpixel, find_plasma_moments, \
+    set_metrics, CentroidRay, spread_order
+from mscontr.microwatcher.metrics import MetricsRegistry
 
 
 def prepare_jet_watcher_to_test(phi = 90, psi = 45, g1 = 10, g2 = 10, shift = 43, laser_on = True, jet_cal = True,
                                 pl_cal = True):
-    jet_emulator = JetEmulator(phi=phi, psi=psi, g1=g1, g2=g2, jet_d=g1 * 7, laser_jet_shift=shift)
+    clock = VirtualClock()
+    jet_emulator = JetEmulator(phi=phi, psi=psi, g1=g1, g2=g2, jet_d=g1 * 7, laser_jet_shift=shift, clock=clock)
     camera1 = CameraEmulator(1, jet_emulator)
     camera2 = CameraEmulator(2, jet_emulator)
-    plasma_watcher = PlasmaWatcher_BoxInput(camera1, camera2, jet_emulator.box, phi=phi, psi=psi)
+    plasma_watcher = PlasmaWatcher_BoxInput(camera1, camera2, jet_emulator.box, phi=phi, psi=psi, clock=clock)
     if jet_cal:
         plasma_watcher.g1 = g1
         plasma_watcher.g2 = g2
@@ -33,6 +44,71 @@ def prepare_jet_watcher_to_test(phi = 90, psi = 45, g1 = 10, g2 = 10, shift = 43
     return plasma_watcher, jet_emulator, camera1, camera2
 
 
+def find_ray_row_loop(frame: np.ndarray, crop=()):
+    """Die ursprüngliche zeilenweise Implementierung von find_ray als Referenz für die Tests."""
+    gray = cv2.GaussianBlur(frame, (11, 11), 0)
+    if crop:
+        gray = gray[crop[0]:crop[1], :]
+    ym, zm = gray.shape
+    z_values = np.zeros(gray.shape)
+    medians = []
+    for i in range(ym):
+        frame_line = gray[i, :]
+        line_max = np.max(frame_line)
+        if line_max >= 40:
+            z_values[i, :] = np.arange(zm)
+            z_values[i, frame_line != line_max] = 0
+            medians.append(np.median(z_values[i, frame_line == line_max]))
+
+    if np.sum(z_values != 0) > 150:
+        z = np.median(z_values[z_values != 0])
+        if np.sum(np.abs(np.array(medians) - z) < 20) >= 0.7*ym:
+            return z
+    return None
+
+
+def paint_circle_row_loop(frame: np.ndarray, x: float, y: float, radius: float):
+    """Die ursprüngliche zeilenweise Implementierung von paint_circle als Referenz für die Tests."""
+    if radius > 0:
+        i_a = np.arange(2048)
+        range_ = np.arange(1088)
+        range_ = range_[np.abs(1088 - range_ - y - 1088 / 2) < radius + 60]
+        for j in range_:
+            r = np.sqrt((i_a - x - 2048 / 2) ** 2 + (1088 - j - y - 1088 / 2) ** 2)
+            line = frame[j, :] + 255 / (0.1 * (r - radius + 1) ** 2 + 1)
+            line[r < radius] = 255
+            line[line > 255] = 255
+            frame[j, :] = line
+
+
+def paint_line_column_loop(frame: np.ndarray, line_x: float, d: float, transp=0.8):
+    """Die ursprüngliche spaltenweise Implementierung von paint_line als Referenz für die Tests."""
+    range_ = np.arange(2048)
+    range_ = range_[np.abs(range_ - line_x - 2048 / 2) < d/2]
+    line_frame = 254*np.ones(frame.shape)
+    for i in range_:
+        line_frame[:, i] = line_frame[:, i]*(1-transp)*np.sin(np.arccos((i - line_x - 2048 / 2)*2/d))
+
+    mask = np.array(frame)
+    frame[:, :] = frame[:, :] + line_frame[:, :]
+    mask[:, :] = mask[:, :] + line_frame[:, :]
+    frame[mask > 254] = 254
+
+
+def paint_nozzle_copy(frame: np.ndarray, nozzle: np.ndarray, nozzle_x: float):
+    """Die ursprüngliche Implementierung von paint_nozzle über ein verschobenes Hilfsbild als Referenz für die Tests."""
+    nozzle = nozzle.copy()
+    ym, xm = nozzle.shape
+    if nozzle_x < - xm/2 - 200 or nozzle_x > xm/2 + 200:
+        return
+    big_nozzle_frame = np.ones((300, xm*3))
+    shift = round(nozzle_x)
+    big_nozzle_frame[0:300, xm+shift:2*xm+shift] = nozzle[0:300, :]
+    nozzle[:300, :] = big_nozzle_frame[:, xm:2*xm]
+    mask = nozzle != 1
+    frame[mask] = nozzle[mask]
+
+
 class TestExternalFunctions(TestCase):
     # def test_find_ray(self):
     #     frame = cv2.imread('test_data/img_test2.bmp')
@@ -45,6 +121,14 @@ class TestExternalFunctions(TestCase):
         # cv2.imshow('image', img)
         # cv2.waitKey(0)
 
+        rng = np.random.default_rng(0)
+        bg = rng.integers(0, 256, (1088, 2048)).astype('uint8')
+        for x, y, radius in [(-500, -100, 20), (1000.3, 530.7, 45.5), (-1040, 0, 10), (0, 0, 0), (3000, 0, 10)]:
+            img, expected = bg.copy(), bg.copy()
+            paint_circle(img, x, y, radius)
+            paint_circle_row_loop(expected, x, y, radius)
+            np.testing.assert_array_equal(expected, img)
+
     def test_paint_line(self):
         img = 255*np.ones((1088, 2048), dtype='uint8')
         paint_line(img, -200, 7, 0.3)
@@ -52,6 +136,23 @@ class TestExternalFunctions(TestCase):
         # cv2.imshow('image', img)
         # cv2.waitKey(0)
 
+        rng = np.random.default_rng(0)
+        bg = rng.integers(0, 256, (1088, 2048)).astype('uint8')
+        for line_x, d, transp in [(-200, 7, 0.3), (512.4, 7, 0.6), (-1022.7, 12.5, 0.8), (2000, 7, 0.6),
+                                  (1021.5, 7, 0.6), (-200.25, 7, 0.3), (511.4, 7, 0.6)]:
+            img, expected = bg.copy(), bg.copy()
+            paint_line(img, line_x, d, transp)
+            paint_line_column_loop(expected, line_x, d, transp)
+            # Im Jet stimmt paint_line mit der ursprünglichen Implementierung überein, solange die Summe nicht
+            # über 254 geht. Dort lief uint8 in der ursprünglichen Fassung über, jetzt wird auf 254 begrenzt.
+            columns = np.arange(2048)
+            jet = np.abs(columns - line_x - 2048/2) < d/2
+            total = bg[:, jet] + 254*(1-transp)*np.sin(np.arccos((columns[jet] - line_x - 2048/2)*2/d))
+            np.testing.assert_array_equal(expected[:, jet][total <= 254], img[:, jet][total <= 254])
+            np.testing.assert_array_equal(254, img[:, jet][total > 254])
+            # Neben dem Jet lief uint8 beim Addieren von 254 ebenfalls über, jetzt bleibt der Hintergrund unverändert
+            np.testing.assert_array_equal(bg[:, ~jet], img[:, ~jet])
+
     def test_find_ray(self):
         bg0 = cv2.imread('test_data/hintg.bmp', 0)
         bg0[:, :] = bg0[:, :] * 0.1
@@ -63,6 +164,33 @@ class TestExternalFunctions(TestCase):
             # show(bg)
             self.assertAlmostEqual(find_ray(bg)-2048/2, x, delta=0.6)
 
+    def test_find_ray_matches_row_loop(self):
+        bg0 = cv2.imread('test_data/hintg.bmp', 0)
+        bg0[:, :] = bg0[:, :] * 0.1
+        points = np.linspace(-1000, 1000, 10)
+        for x in points:
+            bg = deepcopy(bg0)
+            paint_line(bg, x, 7)
+            for crop in [(), (300, 800)]:
+                self.assertEqual(find_ray_row_loop(bg, crop), find_ray(bg, crop=crop))
+        self.assertIsNone(find_ray(bg0))
+        self.assertIsNone(find_ray_row_loop(bg0))
+
+    def test_paint_nozzle(self):
+        rng = np.random.default_rng(0)
+        nozzle = np.ones((1088, 2048), dtype='uint8')
+        nozzle[:280, 900:1150] = rng.integers(2, 256, (280, 250))
+        nozzle[600:610, 10:20] = 7
+        sprite = NozzleSprite(nozzle)
+        bg = rng.integers(0, 256, (1088, 2048)).astype('uint8')
+        for x in [0, 0.5, -640.2, 1100, -1224, 1224.6]:
+            img, img2, expected = bg.copy(), bg.copy(), bg.copy()
+            paint_nozzle(img, sprite, x)
+            paint_nozzle(img2, nozzle, x)
+            paint_nozzle_copy(expected, nozzle, x)
+            np.testing.assert_array_equal(expected, img)
+            np.testing.assert_array_equal(expected, img2)
+
     def test_find_nozzle(self):
         bg0 = cv2.imread('test_data/hintg.bmp', 0)
         nozzle = cv2.imread('test_data/nozzle.bmp', 0)
@@ -97,6 +225,144 @@ class TestExternalFunctions(TestCase):
                 self.assertAlmostEqual(x_-2048/2, x, delta=1)
                 self.assertAlmostEqual(-z_ + 1088 / 2, z, delta=1)
 
+    def test_plasma_tracker(self):
+        bg0 = cv2.imread('test_data/hintg.bmp', 0)
+        bg0[:, :] = bg0[:, :] * 0.25
+        tracker = PlasmaTracker(crop_top=300)
+        # kleine Schritte werden im Fenster verfolgt, der große Sprung erfordert eine Suche im ganzen Frame
+        points = [(100, -100), (103, -98), (105, -101), (600, -150), (602, -148)]
+        for x, z in points:
+            bg = deepcopy(bg0)
+            paint_line(bg, x, 7)
+            paint_circle(bg, x, z, 7)
+            np.testing.assert_allclose(tracker.find(bg), find_plasma(bg, crop_top=300), rtol=0, atol=1e-6)
+        self.assertEqual(1, tracker._roi_hits)
+
+        self.assertEqual((None, None, None), tracker.find(bg0))
+        self.assertIsNone(tracker.last)
+
+    def test_find_plasma_moments(self):
+        rng = np.random.default_rng(2)
+        bg0 = 60 + rng.normal(0, 3, (1088, 2048))
+        self.assertEqual((None,)*6, find_plasma_moments(bg0.astype('uint8')))
+        with self.assertRaises(NoPlasmaError):
+            find_plasma_moments(bg0.astype('uint8'), error_raise=True)
+
+        errors, sigmas, contour_errors = [], [], []
+        for x, z in rng.uniform(-400, 400, (20, 2)):
+            bg = bg0.copy()
+            paint_circle(bg, x, z, 15)
+            bg = bg.astype('uint8')
+            estimate = find_plasma_moments(bg)
+            errors.append((estimate.x - 2048/2 - x, -estimate.y + 1088/2 - z))
+            sigmas.append((estimate.sigma_x, estimate.sigma_y))
+            x_, z_, r = find_plasma(bg)
+            contour_errors.append((x_ - 2048/2 - x, -z_ + 1088/2 - z))
+            self.assertAlmostEqual(15, estimate.r, delta=1)
+
+        rms = np.sqrt(np.mean(np.square(errors)))
+        self.assertLess(rms, 0.05)
+        self.assertLess(rms, np.sqrt(np.mean(np.square(contour_errors)))/4)
+        # die angegebene Unsicherheit passt zur tatsächlichen Abweichung
+        self.assertLess(np.sqrt(np.mean(np.square(np.array(errors)/sigmas))), 2)
+
+        # zwei gleich große Objekte
+        paint_circle(bg, x + 200, z, 15)
+        with self.assertRaises(RecognitionError):
+            find_plasma_moments(bg)
+
+        tracker = PlasmaTracker(crop_top=300, method='moments')
+        bg = bg0.copy()
+        paint_circle(bg, 100, -100, 15)
+        bg = bg.astype('uint8')
+        for _ in range(2):
+            estimate = find_plasma_moments(bg, crop_top=300)
+            np.testing.assert_allclose(tracker.find(bg), estimate[:3], atol=1e-6)
+            np.testing.assert_allclose(tracker.sigma, estimate[3:], rtol=0.2)
+        self.assertEqual(1, tracker._roi_hits)
+
+    def test_ray_tracker(self):
+        bg0 = cv2.imread('test_data/hintg.bmp', 0)
+        bg0[:, :] = bg0[:, :] * 0.1
+        tracker = RayTracker(crop=(300, 800))
+        # die Verschiebungen werden angekündigt, der letzte Sprung nicht und ist zu groß für das Fenster
+        x_prev = None
+        for x in [-400, -380, -300, -310, 500]:
+            if x_prev is not None and x != 500:
+                tracker.predict_shift(x - x_prev)
+            bg = deepcopy(bg0)
+            paint_line(bg, x, 7)
+            self.assertEqual(find_ray(bg, crop=(300, 800)), tracker.find(bg))
+            x_prev = x
+        self.assertEqual(0, tracker._roi_hits)
+
+        tracker.predict_shift(10)
+        bg = deepcopy(bg0)
+        paint_line(bg, 510, 7)
+        self.assertAlmostEqual(tracker.find(bg) - 2048/2, 510, delta=0.6)
+        self.assertEqual(1, tracker._roi_hits)
+
+    def test_ray_detector(self):
+        rng = np.random.default_rng(0)
+        noisy0 = (rng.integers(0, 256, (1088, 2048))*0.1).astype('uint8')
+        clean0 = np.full((1088, 2048), 10, dtype='uint8')
+        for x in [-900.3, 0, 640.7]:
+            noisy, clean = noisy0.copy(), clean0.copy()
+            paint_line(noisy, x, 7, 0.5)
+            paint_line(clean, x, 7, 0.3)
+            for strategies, frame in [('row_max', noisy), ('max_hough', noisy), ('edge_hough', clean)]:
+                detector = RayDetector(strategies, crop=(300, 800))
+                self.assertAlmostEqual(detector.find(frame) - 2048/2, x, delta=0.6)
+            self.assertEqual(find_ray(noisy, crop=(300, 800), x_crop=(900, 1500)),
+                             RayDetector(crop=(300, 800)).find(noisy, x_crop=(900, 1500)))
+
+            # auf dem verrauschten Frame findet edge_hough zu viele Geraden, dann wird max_hough probiert
+            detector = RayDetector(['edge_hough', 'max_hough'], crop=(300, 800))
+            with self.assertRaises(RecognitionError):
+                detector.strategies[0].find(RayFrame(noisy, (300, 800)))
+            self.assertAlmostEqual(detector.find(noisy) - 2048/2, x, delta=0.6)
+
+        self.assertIsNone(RayDetector(['row_max', 'max_hough']).find(noisy0))
+        self.assertEqual((None, None), find_ray_subpixel(noisy0))
+        with self.assertRaises(NoJetError):
+            RayDetector('max_hough').find(noisy0, error_raise=True)
+        with self.assertRaises(ValueError):
+            RayDetector('unknown')
+
+    def test_find_ray_subpixel(self):
+        rng = np.random.default_rng(1)
+        bg0 = (rng.integers(0, 256, (1088, 2048))*0.1).astype('uint8')
+        errors, sigmas, median_errors = [], [], []
+        for x in rng.uniform(-900, 900, 20):
+            bg = bg0.copy()
+            paint_line(bg, x, 7, 0.5)
+            x_sub, sigma = find_ray_subpixel(bg, crop=(300, 800))
+            errors.append(x_sub - 2048/2 - x)
+            sigmas.append(sigma)
+            median_errors.append(find_ray(bg, crop=(300, 800)) - 2048/2 - x)
+
+        rms = np.sqrt(np.mean(np.square(errors)))
+        self.assertLess(rms, 0.15)
+        self.assertLess(rms, np.sqrt(np.mean(np.square(median_errors)))/2)
+        # die angegebene Unsicherheit passt zur tatsächlichen Abweichung
+        self.assertLess(np.sqrt(np.mean(np.square(np.array(errors)/sigmas))), 2)
+
+        tracker = RayTracker(crop=(300, 800), strategies='centroid')
+        self.assertAlmostEqual(x_sub, tracker.find(bg))
+        self.assertAlmostEqual(sigma, tracker.sigma)
+
+        # Zeilen, deren Fenster über den Rand reicht, werden nicht verwendet statt die Randspalte zu wiederholen
+        gray = np.zeros((3, 40))
+        gray[:, 2:5] = [50, 100, 50]
+        gray[:, 30:33] = [50, 100, 50]
+        x = CentroidRay(half_width=8)._row_centroids(gray, np.arange(3), np.array([3, 31, 35]), 40)
+        np.testing.assert_array_equal([np.nan, 31, np.nan], x)
+
+    def test_spread_order(self):
+        self.assertEqual([0, 4, 2, 1, 3], spread_order(5))
+        for n in range(12):
+            self.assertEqual(list(range(n)), sorted(spread_order(n)))
+
     def test_merge_close_lines(self):
         lines = np.array([[1075, 1087, 1075, 0],
                           [1070, 1087, 1070, 144],
@@ -116,6 +382,25 @@ class TestExternalFunctions(TestCase):
         # self.assertEqual(res.tolist(), merge_close_lines(lines).tolist())
         np.testing.assert_almost_equal(merge_close_lines(lines), res)
 
+    def test_merge_close_lines_chain(self):
+        # 10 und 12 werden erst über die spätere 11 verbunden, die doppelte 10 zählt im Mittelwert nur einmal
+        lines = np.array([[10, 900, 10, 100],
+                          [500, 900, 501, 100],
+                          [12, 1000, 12, 300],
+                          [10, 950, 10, 50],
+                          [11, 800, 11, 200]])
+        np.testing.assert_almost_equal(merge_close_lines(lines), [[11, 1000, 11, 50], [500, 900, 501, 100]])
+        self.assertEqual((0, 4), merge_close_lines(np.zeros((0, 4))).shape)
+
+        # viele Geraden in weit auseinander liegenden Gruppen, jede Gruppe enthält ihre Mitte
+        rng = np.random.default_rng(0)
+        centers = np.arange(100, 2000, 10)
+        x1 = np.concatenate([centers, np.repeat(centers, 10) + rng.integers(-1, 2, 10*len(centers))])
+        lines = np.column_stack([x1, rng.integers(500, 1088, len(x1)), x1, rng.integers(0, 500, len(x1))])
+        merged = merge_close_lines(rng.permutation(lines))
+        self.assertEqual(len(centers), len(merged))
+        np.testing.assert_allclose(np.sort(merged[:, 0]), centers, atol=2)
+
 class TestCameraCoordinates(TestCase):
 
     def test_1(self):
@@ -132,10 +417,129 @@ class TestCameraCoordinates(TestCase):
         self.assertAlmostEqual(0, z2)
 
 
+class TestJetEmulator(TestCase):
+
+    def test_static_cache(self):
+        jet_emulator = JetEmulator(def_init=False, laser_jet_shift=10)
+        uncached = JetEmulator(def_init=False, laser_jet_shift=10)
+        uncached.static_cache_size = 0
+        for emulator in [jet_emulator, uncached]:
+            emulator.laser_on = True
+
+        for x, z, exposure in [(0, 0, 40000), (0, 0, 40000), (1230.5, -456, 40000), (0, 0, 10000)]:
+            for emulator in [jet_emulator, uncached]:
+                emulator.jet_x_pos, emulator.jet_z_pos, emulator.laser_z_pos = x, z, z
+                emulator.exposure = exposure
+            for camera_n in [1, 2]:
+                frame = jet_emulator.get_frame(camera_n)
+                np.testing.assert_array_equal(uncached.get_frame(camera_n), frame)
+                # das Plasma wird auf eine Kopie gezeichnet
+                frame[:, :] = 0
+
+        self.assertEqual(6, len(jet_emulator._static_cache))
+
+    def test_virtual_clock(self):
+        clock = VirtualClock()
+        jet_emulator = JetEmulator(def_init=False, clock=clock, seed=1, flicker_sigma=0.1)
+        jet_emulator.laser_on = True
+        camera = CameraEmulator(1, jet_emulator, fps=30)
+
+        start = time.time()
+        with clock.participant():
+            camera.start_stream()
+            jet_emulator.plasma_drift_on(speed=2, update_freq=4)
+            clock.sleep(10)
+            camera.stop_stream()
+            jet_emulator.plasma_drift_off()
+            clock.sleep(1)
+
+        self.assertLess(time.time() - start, 10)
+        self.assertAlmostEqual(300, camera.get_frame_seq(), delta=1)
+        self.assertAlmostEqual(10, camera.get_frame_info().timestamp, delta=0.05)
+        self.assertAlmostEqual(20, jet_emulator.laser_jet_shift, delta=0.5)
+
+        # das Flackern ist bei gleichem seed reproduzierbar
+        emulators = [JetEmulator(def_init=False, seed=1, flicker_sigma=0.1) for _ in range(2)]
+        for emulator in emulators:
+            emulator.laser_on = True
+        np.testing.assert_array_equal(emulators[0].get_frame(1), emulators[1].get_frame(1))
+
+
+    def test_render_batch(self):
+        jet_emulator = JetEmulator(def_init=False, laser_jet_shift=10, flicker_sigma=0.1)
+        jet_emulator.laser_on = True
+        x = np.array([0, 0, 1230.5, -2000])
+        z = np.array([0, 0, -456, 300])
+        exposure = np.array([40000, 40000, 40000, 10000])
+
+        frames1, frames2, truth1, truth2 = jet_emulator.render_batch(x, z, l_y=100, l_z=z, exposure=exposure,
+                                                                     seeds=[1, 2, 3, 4])
+        self.assertEqual((4, 1088, 2048), frames1.shape)
+        # der gleiche Frame mit anderem seed flackert anders
+        self.assertNotEqual(truth1['plasma_r'][0], truth1['plasma_r'][1])
+
+        for i in range(4):
+            settings = jet_emulator.render_settings()._replace(exposure=exposure[i])
+            frame, truth = render_frame(settings, 2, x[i], z[i], 100, z[i], random.Random(f'{i + 1}/2'))
+            np.testing.assert_array_equal(frame, frames2[i])
+            self.assertEqual(truth, tuple(truth2[i]))
+
+            x_, y_, r_ = find_plasma(frames1[i])
+            self.assertAlmostEqual(truth1['plasma_x'][i], x_, delta=1)
+            self.assertAlmostEqual(truth1['plasma_y'][i], y_, delta=1)
+
+        parallel = jet_emulator.render_batch(x, z, l_y=100, l_z=z, exposure=exposure, seeds=[1, 2, 3, 4],
+                                             processes=2)
+        np.testing.assert_array_equal(frames1, parallel[0])
+        np.testing.assert_array_equal(frames2, parallel[1])
+        np.testing.assert_array_equal(truth1, parallel[2])
+
+        # direkt in Shared Memory, ohne Kopie
+        with SharedFrames(4) as shared:
+            parallel = jet_emulator.render_batch(x, z, l_y=100, l_z=z, exposure=exposure, seeds=[1, 2, 3, 4],
+                                                 processes=2, shared=shared)
+            self.assertIs(shared.frames1, parallel[0])
+            np.testing.assert_array_equal(frames1, shared.frames1)
+            np.testing.assert_array_equal(frames2, shared.frames2)
+            np.testing.assert_array_equal(truth2, parallel[3])
+            del parallel
+
+    def test_render_worker_shared_memory(self):
+        jet_emulator = JetEmulator(def_init=False)
+        with SharedFrames(2) as shared:
+            _init_render_worker(jet_emulator.render_settings(), shared.name, shared.frames.shape, np.zeros((2, 6)))
+            shm = _worker_state['shm']
+            _close_render_worker()
+            # der Prozess schließt nur seinen Zugriff, der Block selbst bleibt für shared bestehen
+            self.assertIsNone(shm.buf)
+            self.assertEqual({}, _worker_state)
+            shared.frames1[:] = 1
+
+        # die Prozesse melden den Block nicht beim resource_tracker ab (oder an), der meldet sich sonst auf stderr
+        script = textwrap.dedent("""
+            from concurrent.futures import ProcessPoolExecutor
+            from multiprocessing import get_context
+            import numpy as np
+            from mscontr.microwatcher.plasma_camera_emulator import JetEmulator, SharedFrames, _init_render_worker
+
+            if __name__ == '__main__':
+                settings = JetEmulator(def_init=False).render_settings()
+                for method in ('fork', 'spawn'):
+                    with SharedFrames(2) as shared:
+                        initargs = (settings, shared.name, shared.frames.shape, np.zeros((2, 6)))
+                        with ProcessPoolExecutor(2, get_context(method), _init_render_worker, initargs) as pool:
+                            list(pool.map(abs, range(4)))
+            """)
+        result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, timeout=120)
+        self.assertEqual(0, result.returncode, result.stderr)
+        self.assertEqual('', result.stderr)
+
+
 class TestPlasmaWatcher(TestCase):
 
     def test_calibrate_enl(self):
         plasma_watcher, jet_emulator, camera1, camera2 = prepare_jet_watcher_to_test(laser_on=False, jet_cal=False)
+        self.addCleanup(plasma_watcher.close)
 
         # jet_emulator.realtime(True)
         # camera1.start_video_record(start_stream=True, fps=60)
@@ -150,8 +554,37 @@ class TestPlasmaWatcher(TestCase):
         self.assertAlmostEqual(jet_emulator.g1, plasma_watcher.g1, delta=0.005)
         self.assertAlmostEqual(jet_emulator.g2, plasma_watcher.g2, delta=0.005)
 
+    def test_calibrate_enl_early_stop(self):
+        n_points = 20
+        # mit 'centroid' über die Standardabweichung, mit 'row_max' (ohne) nur über die Abweichungen vom Fit
+        for strategies in ('centroid', 'row_max'):
+            with self.subTest(strategies=strategies):
+                plasma_watcher, jet_emulator, camera1, camera2 = prepare_jet_watcher_to_test(laser_on=False,
+                                                                                            jet_cal=False)
+                self.addCleanup(plasma_watcher.close)
+                plasma_watcher.set_ray_strategies(strategies)
+                moves = []
+                move_jet_to = plasma_watcher.move_jet_to
+                plasma_watcher.move_jet_to = lambda *args, **kwargs: moves.append(args) or move_jet_to(*args, **kwargs)
+
+                plasma_watcher.calibrate_enl(init_step=jet_emulator.g1 * 100, rel_err=0.01, n_points=n_points)
+                self.assertLess(len(moves), n_points)
+                self.assertLess(abs(plasma_watcher.g1 - jet_emulator.g1)/jet_emulator.g1, 0.01)
+                self.assertLess(abs(plasma_watcher.g2 - jet_emulator.g2)/jet_emulator.g2, 0.01)
+
+    def test_close(self):
+        plasma_watcher, jet_emulator, camera1, camera2 = prepare_jet_watcher_to_test(laser_on=False)
+        plasma_watcher.get_jet_position()
+        pool = plasma_watcher._camera2_pool
+        self.assertIsNotNone(pool)
+        plasma_watcher.close()
+        self.assertIsNone(plasma_watcher._camera2_pool)
+        with self.assertRaises(RuntimeError):
+            pool.submit(print)
+
     def test_move_jet_to(self):
         plasma_watcher, jet_emulator, camera1, camera2 = prepare_jet_watcher_to_test(laser_on=False)
+        self.addCleanup(plasma_watcher.close)
         destinations = np.array([(1230, 4560), (3676.7, 456.5), (-2740.6, 100.5), (-2356.6, -566.8)])
 
         for point in destinations:
@@ -160,42 +593,49 @@ class TestPlasmaWatcher(TestCase):
 
     def test_move_plasma_to(self):
         plasma_watcher, jet_emulator, camera1, camera2 = prepare_jet_watcher_to_test()
+        self.addCleanup(plasma_watcher.close)
         destinations = np.array([(1230, 4560, 456.6), (3676.7, 456.5, 2567.67), (-2740.6, 100.5, -1726.4),
                                  (-2356.6, -566.8, -345.6)])
 
-        jet_emulator.realtime(True)
-        camera1.start_video_record(start_stream=True, fps=60)
-        try:
-            for point in destinations:
-                plasma_watcher.move_plasma_to(*point, wait=True)
-                np.testing.assert_allclose(np.array(plasma_watcher.get_plasma_position()), point, 0,
-                                           plasma_watcher.tol())
-                time.sleep(3)
-        finally:
-            camera1.stop_video_record()
-            camera1.stop_stream()
+        clock = plasma_watcher.clock
+        with clock.participant():
+            camera1.start_video_record(start_stream=True, fps=60)
+            try:
+                for point in destinations:
+                    plasma_watcher.move_plasma_to(*point, wait=True)
+                    np.testing.assert_allclose(np.array(plasma_watcher.get_plasma_position()), point, 0,
+                                               plasma_watcher.tol())
+                    clock.sleep(3)
+            finally:
+                camera1.stop_video_record()
+                camera1.stop_stream()
+        self.assertGreaterEqual(clock.time(), 3*len(destinations))
 
     def test_calibrate_plasma(self):
         mess_per_point = 5
         plasma_watcher, jet_emulator, camera1, camera2 = prepare_jet_watcher_to_test(pl_cal=False, shift=1500)
+        self.addCleanup(plasma_watcher.close)
         jet_emulator.flicker_sigma = 0.1
+        clock = plasma_watcher.clock
         record_video = False
-        if record_video:
-            jet_emulator.realtime(True)
-            camera1.start_video_record(start_stream=True, fps=60)
+        with clock.participant():
+            if record_video:
+                camera1.start_video_record(start_stream=True, fps=60)
             try:
-                plasma_watcher.calibrate_plasma(mess_per_point=mess_per_point)
+                plasma_watcher.calibrate_plasma(mess_per_point=mess_per_point, time_per_point=1)
             finally:
-                camera1.stop_video_record()
-                camera1.stop_stream()
-        else:
-            plasma_watcher.calibrate_plasma(mess_per_point=mess_per_point)
+                if record_video:
+                    camera1.stop_video_record()
+                    camera1.stop_stream()
         self.assertAlmostEqual(plasma_watcher.jett_laser_dz, jet_emulator.laser_jet_shift,
                                delta=plasma_watcher.laser_z.tol())
+        # die Wartezeiten zwischen den Messungen laufen auf der simulierten Uhr
+        self.assertGreater(clock.time(), 0)
 
     def test_calibrate_plasma_silent(self):
         mess_per_point = 5
         plasma_watcher, jet_emulator, camera1, camera2 = prepare_jet_watcher_to_test(pl_cal=True, shift=1500)
+        self.addCleanup(plasma_watcher.close)
         jet_emulator.flicker_sigma = 0.03
         record_video = False
         if record_video:
@@ -213,3 +653,109 @@ class TestPlasmaWatcher(TestCase):
         self.assertAlmostEqual(plasma_watcher.jett_laser_dz, jet_emulator.laser_jet_shift,
                                delta=plasma_watcher.laser_z.tol())
 
+
+    def test_plasma_holder_filter(self):
+        plasma_watcher, jet_emulator, camera1, camera2 = prepare_jet_watcher_to_test()
+        self.addCleanup(plasma_watcher.close)
+        jet_emulator.flicker_sigma = 0.1
+        holder = plasma_watcher.plasma_holder
+        holder.position = plasma_watcher.get_plasma_position(error_raise=True)
+        failed = {}
+        for use_filter in (False, True):
+            holder.use_filter = use_filter
+            plasma_watcher.plasma_filter.reset()
+            results = [holder._check(brightness=True, position=True) for _ in range(40)]
+            failed[use_filter] = [i for i, result in enumerate(results) if not all(result)]
+
+        # ungefiltert meldet das Flackern immer wieder zu dunkles Plasma, gefiltert nur am Anfang
+        self.assertGreater(len(failed[False]), 0)
+        self.assertEqual([], [i for i in failed[True] if i >= 10])
+        state = plasma_watcher.get_filtered_plasma()
+        np.testing.assert_allclose(state.position, holder.position, 0, plasma_watcher.tol())
+        self.assertAlmostEqual(plasma_watcher.pl_r_max, state.r.value, delta=0.05*plasma_watcher.pl_r_max)
+
+    def test_filter_capture_time(self):
+        plasma_watcher, jet_emulator, camera1, camera2 = prepare_jet_watcher_to_test()
+        self.addCleanup(plasma_watcher.close)
+        clock = plasma_watcher.clock
+        with clock.participant():
+            camera1.start_stream()
+            camera2.start_stream()
+            try:
+                clock.sleep(1)
+                plasma_watcher.find_plasma(error_raise=True)
+                _, pair = plasma_watcher.frame_sync.latest_pair()
+            finally:
+                camera1.stop_stream()
+                camera2.stop_stream()
+
+        # der Filter bekommt die Aufnahmezeit des Paares, nicht die Zeit nach der Auswertung
+        state = plasma_watcher.plasma_filter.state()
+        # (zwischen dem Paar und latest_pair kann noch ein Frame gekommen sein)
+        self.assertAlmostEqual(pair.timestamp(), state.t, delta=1.5/camera1.fps)
+        self.assertLessEqual(state.t, clock.time())
+
+    def test_plasma_holder_stream(self):
+        plasma_watcher, jet_emulator, camera1, camera2 = prepare_jet_watcher_to_test()
+        self.addCleanup(plasma_watcher.close)
+        holder = plasma_watcher.plasma_holder
+        holder.decimation = 2
+        metrics = MetricsRegistry()
+        previous = set_metrics(metrics)
+        camera1.start_stream()
+        camera2.start_stream()
+        try:
+            plasma_watcher.hold_plasma()
+            time.sleep(2)
+            start = time.monotonic()
+            holder.stop(wait=True)
+            self.assertLess(time.monotonic() - start, 1)
+        finally:
+            camera1.stop_stream()
+            camera2.stop_stream()
+            set_metrics(previous)
+
+        self.assertFalse(holder.is_alive())
+        # im Stream wird jedes zweite Paar von Frames geprüft, nicht nur alle 1/freq = 3 s
+        self.assertGreater(metrics.histogram('PlasmaHolder.check')['count'], 5)
+        self.assertEqual(0, metrics.counter('PlasmaHolder.corrections'))
+
+    def test_stalled_stream(self):
+        plasma_watcher, jet_emulator, camera1, camera2 = prepare_jet_watcher_to_test()
+        self.addCleanup(plasma_watcher.close)
+        # die erste Kamera meldet einen Stream, liefert aber keine Frames mehr
+        camera1.mode = 'stream'
+        camera1.get_frame = lambda: CameraInterf.get_frame(camera1, timeout_s=0.2)
+
+        plasma_watcher._frame1_is_new = True
+        self.assertIsNone(plasma_watcher.get_jet_position())
+        plasma_watcher._frame1_is_new = True
+        self.assertEqual((None, None, None, None), plasma_watcher.find_plasma())
+        plasma_watcher._frame1_is_new = True
+        with self.assertRaises(FrameTimeoutError):
+            plasma_watcher.find_plasma(error_raise=True)
+
+        # eine fehlgeschlagene Prüfung beendet den PlasmaHolder nicht
+        holder = plasma_watcher.plasma_holder
+        calls = []
+
+        def check(**kwargs):
+            calls.append(kwargs)
+            if len(calls) == 1:
+                raise FrameTimeoutError('kein Frame')
+            return True, None
+
+        holder._check = check
+        metrics = MetricsRegistry()
+        previous = set_metrics(metrics)
+        try:
+            holder.start()
+            deadline = time.monotonic() + 5
+            while len(calls) < 3 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertTrue(holder.is_alive())
+            holder.stop(wait=True)
+        finally:
+            set_metrics(previous)
+        self.assertGreaterEqual(len(calls), 3)
+        self.assertEqual(1, metrics.counter('PlasmaHolder.errors'))
@@ -0,0 +1,206 @@
+import os
+import tempfile
+import threading
+from unittest import TestCase
+
+import cv2
+import numpy as np
+
+from mscontr.microwatcher.camera_interface import CameraInterf, FramePairSynchronizer, FrameRingBuffer, \
+    FrameTimeoutError, VideoRecorder
+
+
+class DummyCamera(CameraInterf):
+    """Kamera ohne Hardware, die Frames werden im Test mit new_frame_event eingespeist."""
+
+    def __init__(self):
+        super().__init__()
+        self.streaming = False
+
+    def is_streaming(self) -> bool:
+        return self.streaming
+
+    def get_resolution(self) -> (int, int):
+        return 8, 4
+
+    def get_single_frame(self, timeout_s: float) -> np.ndarray:
+        return np.zeros((4, 8), dtype='uint8')
+
+
+def frame(value: int) -> np.ndarray:
+    return value*np.ones((4, 8), dtype='uint8')
+
+
+class TestFrameInfo(TestCase):
+
+    def test_timestamp_and_id(self):
+        camera = DummyCamera()
+        infos = []
+        subscriber = camera.connect_to_stream(lambda frame, info: infos.append(info), with_info=True, queue_size=3)
+
+        camera.new_frame_event(frame(1), timestamp=10.0)
+        camera.new_frame_event(frame(2), timestamp=10.5, frame_id=7)
+        camera.new_frame_event(frame(3))
+        self.assertTrue(subscriber.flush(timeout_s=1))
+
+        self.assertEqual([(10.0, 0), (10.5, 7)], [tuple(info) for info in infos[:2]])
+        self.assertEqual(8, infos[2].frame_id)
+        self.assertEqual(infos[2], camera.get_frame_info())
+
+
+class TestWaitFrame(TestCase):
+
+    def test_many_waiters(self):
+        camera = DummyCamera()
+        camera.new_frame_event(frame(1))
+        seq = camera.get_frame_seq()
+        results = []
+
+        def waiter():
+            results.append(camera.wait_frame(seq, timeout_s=1))
+
+        threads = [threading.Thread(target=waiter) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        camera.new_frame_event(frame(2))
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([seq + 1]*3, [result[0] for result in results])
+        self.assertEqual([2]*3, [result[1][0, 0] for result in results])
+
+        # ein schon angekommener Frame wird sofort zurückgegeben
+        self.assertEqual(seq + 1, camera.wait_frame(seq, timeout_s=0)[0])
+        with self.assertRaises(FrameTimeoutError):
+            camera.wait_frame(timeout_s=0.01)
+
+
+class TestStreamSubscriber(TestCase):
+
+    def test_latest_frame_wins(self):
+        camera = DummyCamera()
+        release = threading.Event()
+        values = []
+
+        def slow_action(frame):
+            release.wait(1)
+            values.append(frame[0, 0])
+
+        fast = []
+        subscriber = camera.connect_to_stream(slow_action)
+        fast_subscriber = camera.connect_to_stream(lambda frame: fast.append(frame[0, 0]), queue_size=10)
+        for value in range(1, 6):
+            camera.new_frame_event(frame(value))
+
+        # der erste Frame wird gerade verarbeitet, von den übrigen bleibt nur der letzte
+        release.set()
+        self.assertTrue(subscriber.flush(timeout_s=1))
+        self.assertEqual(5, values[-1])
+        self.assertEqual(5 - len(values), subscriber.dropped)
+        self.assertEqual(subscriber.dropped, camera.get_dropped_frames()[slow_action])
+        # die schnelle action wird von der langsamen nicht aufgehalten und verliert keinen Frame
+        self.assertTrue(fast_subscriber.flush(timeout_s=1))
+        self.assertEqual([1, 2, 3, 4, 5], fast)
+
+        camera.disconnect_from_stream(slow_action)
+        camera.new_frame_event(frame(6))
+        self.assertEqual(5, values[-1])
+
+
+class TestFrameRingBuffer(TestCase):
+
+    def test_slots_are_reused_after_release(self):
+        ring = FrameRingBuffer(size=2)
+        view1 = ring.store(frame(1))
+        crop = view1[1:, 2:].T
+        view2 = ring.store(frame(2))
+        self.assertFalse(view1.flags.writeable)
+        self.assertEqual(2, ring.used_slots())
+
+        # beide Plätze belegt: der Frame wird kopiert
+        view3 = ring.store(frame(3))
+        self.assertEqual(1, ring.overflows)
+        del view3
+
+        # der Ausschnitt hält den ersten Platz weiterhin fest
+        del view1
+        ring.store(frame(4))
+        self.assertEqual(2, ring.overflows)
+        self.assertEqual(1, crop[0, 0])
+
+        del crop
+        view5 = ring.store(frame(5))
+        self.assertEqual(2, ring.overflows)
+        self.assertEqual((5, 2), (view5[0, 0], view2[0, 0]))
+
+    def test_get_frame(self):
+        camera = DummyCamera()
+        camera.streaming = True
+
+        threading.Timer(0.05, camera.new_frame_event, (frame(1),)).start()
+        view = camera.get_frame(timeout_s=1)
+        with self.assertRaises(ValueError):
+            view[0, 0] = 0
+        threading.Timer(0.05, camera.new_frame_event, (frame(2),)).start()
+        copy = camera.get_frame(timeout_s=1, writable=True)
+        copy[0, 0] = 0
+        self.assertEqual(1, view[0, 0])
+
+        camera.streaming = False
+        self.assertFalse(camera.get_frame().flags.writeable)
+
+
+class TestFramePairSynchronizer(TestCase):
+
+    def test_pairs(self):
+        camera1, camera2 = DummyCamera(), DummyCamera()
+        sync = FramePairSynchronizer(camera1, camera2, max_skew=0.01)
+
+        camera1.new_frame_event(frame(1), timestamp=1.000)
+        camera1.new_frame_event(frame(2), timestamp=1.033)
+        self.assertEqual(0, sync.latest_pair()[0])
+
+        # der zweite Frame der ersten Kamera passt, der erste wird verworfen
+        camera2.new_frame_event(frame(12), timestamp=1.038)
+        seq, pair = sync.wait_pair(0, timeout_s=0)
+        self.assertEqual(1, seq)
+        self.assertEqual((2, 12), (pair.frame1[0, 0], pair.frame2[0, 0]))
+        self.assertAlmostEqual(0.005, pair.skew())
+        self.assertAlmostEqual(1.0355, pair.timestamp())
+        self.assertEqual(1, sync.dropped)
+
+        # zu großer Zeitabstand: kein Paar
+        camera2.new_frame_event(frame(13), timestamp=1.071)
+        camera1.new_frame_event(frame(3), timestamp=1.090)
+        with self.assertRaises(FrameTimeoutError):
+            sync.wait_pair(seq, timeout_s=0.01)
+
+        sync.close()
+        camera1.new_frame_event(frame(4), timestamp=1.104)
+        camera2.new_frame_event(frame(14), timestamp=1.104)
+        self.assertEqual(1, sync.latest_pair()[0])
+
+
+class TestVideoRecorder(TestCase):
+
+    def test_synchronized_files(self):
+        camera1, camera2 = DummyCamera(), DummyCamera()
+        with tempfile.TemporaryDirectory() as directory:
+            paths = [os.path.join(directory, 'camera1.avi'), os.path.join(directory, 'camera2.avi')]
+            recorder = VideoRecorder([camera1, camera2], paths, fps=10, queue_size=10)
+            recorder.start(t0=100.0)
+
+            # Kamera 1: Lücke bei 100.2, zwei Frames für die Stelle 3
+            for t in (100.0, 100.1, 100.3, 100.32):
+                camera1.new_frame_event(frame(100), timestamp=t)
+            # Kamera 2 beginnt später
+            for t in (100.21, 100.4):
+                camera2.new_frame_event(frame(200), timestamp=t)
+            recorder.stop(t_stop=100.6)
+
+            self.assertEqual([{'written': 6, 'duplicated': 3, 'dropped': 1},
+                              {'written': 6, 'duplicated': 4, 'dropped': 0}], recorder.stats())
+            for path in paths:
+                capture = cv2.VideoCapture(path)
+                self.assertEqual(6, capture.get(cv2.CAP_PROP_FRAME_COUNT))
+                capture.release()
@@ -0,0 +1,65 @@
+import os
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from mscontr.microwatcher.diagnostics import AsyncImageSink, DiagnosticsSink
+from mscontr.microwatcher.plasma_watcher import find_plasma, set_diagnostics_sink, NoPlasmaError
+
+
+class RecordingSink(DiagnosticsSink):
+    enabled = True
+
+    def __init__(self):
+        self.names = []
+
+    def dump(self, name, image):
+        self.names.append(name)
+
+
+class TestAsyncImageSink(TestCase):
+
+    def test_rate_limit(self):
+        with tempfile.TemporaryDirectory() as directory:
+            sink = AsyncImageSink(directory, min_interval=60)
+            calls = []
+
+            def image():
+                calls.append(1)
+                return np.zeros((10, 10), dtype='uint8')
+
+            for _ in range(5):
+                sink.dump('errors/test.png', image)
+            sink.dump('errors/test2.png', np.zeros((10, 10), dtype='uint8'))
+            sink.flush()
+            sink.close()
+
+            self.assertEqual(1, len(calls))
+            self.assertEqual(['test.png', 'test2.png'], sorted(os.listdir(os.path.join(directory, 'errors'))))
+
+
+class TestRecognitionDiagnostics(TestCase):
+
+    def test_plasma_error_goes_to_sink(self):
+        sink = RecordingSink()
+        previous = set_diagnostics_sink(sink)
+        try:
+            with self.assertRaises(NoPlasmaError):
+                find_plasma(np.zeros((1088, 2048), dtype='uint8'), error_raise=True)
+        finally:
+            set_diagnostics_sink(previous)
+
+        self.assertEqual(['PW_errors/no_plasma_error.png', 'PW_errors/no_plasma_error_mask.png'], sink.names)
+
+    def test_disabled_by_default(self):
+        frame = np.zeros((1088, 2048), dtype='uint8')
+        frame[500:520, 1000:1020] = 255
+        with tempfile.TemporaryDirectory() as directory:
+            cwd = os.getcwd()
+            os.chdir(directory)
+            try:
+                find_plasma(frame)
+            finally:
+                os.chdir(cwd)
+            self.assertEqual([], os.listdir(directory))
@@ -0,0 +1,97 @@
+import json
+import os
+import tempfile
+import threading
+from unittest import TestCase
+
+import numpy as np
+
+from mscontr.microwatcher.metrics import Histogram, Metrics, MetricsRegistry
+from mscontr.microwatcher.plasma_watcher import find_plasma, find_ray, set_metrics, NoPlasmaError
+
+
+class TestHistogram(TestCase):
+
+    def test_quantiles(self):
+        histogram = Histogram()
+        for value in np.linspace(0.001, 0.1, 1000):
+            histogram.add(value)
+
+        summary = histogram.summary()
+        self.assertEqual(1000, summary['count'])
+        self.assertAlmostEqual(50.5, summary['mean_ms'])
+        self.assertEqual((1, 100), (summary['min_ms'], summary['max_ms']))
+        # die Klassen sind etwa 26 % breit
+        self.assertAlmostEqual(50.5, summary['p50_ms'], delta=0.13*50.5)
+        self.assertAlmostEqual(99, summary['p99_ms'], delta=0.13*99)
+        self.assertEqual({'count': 0}, Histogram().summary())
+
+
+class TestMetricsRegistry(TestCase):
+
+    def test_threads_and_dump(self):
+        metrics = MetricsRegistry()
+
+        def work():
+            for _ in range(1000):
+                with metrics.stage('stage'):
+                    pass
+                metrics.count('calls')
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        metrics.record_call('call', 0.002, ok=False)
+
+        self.assertEqual(4000, metrics.counter('calls'))
+        self.assertEqual(4000, metrics.histogram('stage')['count'])
+        self.assertEqual(1, metrics.counter('call.failed'))
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'metrics.json')
+            metrics.dump(path)
+            with open(path) as file:
+                data = json.load(file)
+        self.assertEqual(data, json.loads(json.dumps(metrics.snapshot())))
+        self.assertAlmostEqual(2, data['histograms']['call']['max_ms'])
+
+        metrics.reset()
+        self.assertEqual({'counters': {}, 'histograms': {}}, metrics.snapshot())
+
+
+class TestRecognitionMetrics(TestCase):
+
+    def setUp(self):
+        self.metrics = MetricsRegistry()
+        self.previous = set_metrics(self.metrics)
+
+    def tearDown(self):
+        set_metrics(self.previous)
+
+    def test_stages_and_counters(self):
+        frame = np.zeros((1088, 2048), dtype='uint8')
+        self.assertIsNone(find_ray(frame))
+        with self.assertRaises(NoPlasmaError):
+            find_plasma(frame, error_raise=True)
+        frame[500:540, 1000:1040] = 255
+        self.assertAlmostEqual(1019.5, find_plasma(frame)[0])
+
+        self.assertEqual(1, self.metrics.counter('find_ray.failed'))
+        self.assertEqual((1, 1), (self.metrics.counter('find_plasma.ok'), self.metrics.counter('find_plasma.failed')))
+        snapshot = self.metrics.snapshot()['histograms']
+        for name in ('find_ray', 'ray.blur', 'ray.threshold', 'find_plasma.threshold',
+                     'find_plasma.contours'):
+            self.assertIn(name, snapshot)
+        self.assertEqual(2, snapshot['find_plasma.contours']['count'])
+
+    def test_disabled_by_default(self):
+        self.assertIs(Metrics, type(self.previous))
+        self.assertFalse(self.previous.enabled)
+
+    def test_disabled(self):
+        set_metrics(None)
+        find_ray(np.zeros((1088, 2048), dtype='uint8'))
+        self.assertEqual({'counters': {}, 'histograms': {}}, Metrics().snapshot())
+        self.assertEqual(0, self.metrics.counter('find_ray.failed'))
@@ -0,0 +1,76 @@
+from unittest import TestCase
+
+import numpy as np
+
+from mscontr.microwatcher.plasma_filter import AxisKalman, PlasmaFilter
+
+
+class TestAxisKalman(TestCase):
+
+    def test_constant_rate(self):
+        rng = np.random.default_rng(0)
+        axis = AxisKalman(process_noise=0.01, measurement_noise=1)
+        self.assertIsNone(axis.state())
+        times = np.arange(0, 20, 0.1)
+        values = 5 + 0.5*times
+        errors = []
+        for t, value in zip(times, values):
+            self.assertTrue(axis.update(t, value + rng.normal(0, 1)))
+            errors.append(axis.state().value - value)
+
+        state = axis.state()
+        self.assertEqual(len(times), axis.samples)
+        self.assertAlmostEqual(0.5, state.rate, delta=3*state.rate_sigma)
+        self.assertLess(state.sigma, 0.5)
+        self.assertLess(np.sqrt(np.mean(np.square(errors[50:]))), 0.5)
+        # Vorhersage
+        self.assertAlmostEqual(values[-1] + 0.5*10, axis.state(times[-1] + 10).value, delta=1)
+        self.assertGreater(axis.state(times[-1] + 10).sigma, state.sigma)
+
+    def test_outliers(self):
+        axis = AxisKalman(process_noise=0.01, measurement_noise=1, max_outliers=3)
+        for t in range(10):
+            axis.update(t, 0)
+        # einzelne Ausreißer werden verworfen, erst nach 3 hintereinander wird neu angefangen
+        self.assertFalse(axis.update(10, 50))
+        self.assertTrue(axis.update(11, 0))
+        self.assertFalse(axis.update(12, 50))
+        self.assertFalse(axis.update(13, 50))
+        self.assertTrue(axis.update(14, 50))
+        self.assertEqual((50, 1), (axis.state().value, axis.samples))
+
+
+class TestPlasmaFilter(TestCase):
+
+    def test_flicker(self):
+        rng = np.random.default_rng(1)
+        plasma_filter = PlasmaFilter(position_noise=0.5, radius_noise=0.1)
+        raw, filtered = [], []
+        for i in range(100):
+            r = 100*max(rng.normal(1, 0.1), 0)
+            plasma_filter.update(i*0.1, 10 + rng.normal(0, 0.5), -5, 3, r, sigma=(0.1, 0.1, 0.1, 0.5))
+            raw.append(r)
+            filtered.append(plasma_filter.state().r.value)
+
+        state = plasma_filter.state()
+        self.assertEqual(100, state.samples)
+        np.testing.assert_allclose((10, -5, 3), state.position, atol=0.5)
+        self.assertLess(np.std(filtered[50:]), np.std(raw[50:])/3)
+        self.assertAlmostEqual(100, state.r.value, delta=3*state.r.sigma + 1)
+        self.assertEqual(4, len(state.sigma))
+
+    def test_misses(self):
+        plasma_filter = PlasmaFilter(max_misses=2)
+        self.assertTrue(plasma_filter.lost)
+        self.assertIsNone(plasma_filter.state())
+        plasma_filter.update(0, 1, 2, 3, 10)
+        plasma_filter.miss()
+        self.assertEqual((1, 2, 3), plasma_filter.state(1).position)
+        plasma_filter.miss()
+        self.assertTrue(plasma_filter.lost)
+        self.assertIsNone(plasma_filter.state())
+
+        plasma_filter.update(2, 1, 2, 3, 10)
+        self.assertFalse(plasma_filter.lost)
+        plasma_filter.reset()
+        self.assertIsNone(plasma_filter.state())
@@ -0,0 +1,87 @@
+import threading
+import time
+from unittest import TestCase
+
+from mscontr.microwatcher.sim_clock import VirtualClock
+
+
+class TestVirtualClock(TestCase):
+
+    def test_participants(self):
+        clock = VirtualClock()
+        events = []
+
+        def ticker(name: str, period: float, n: int):
+            try:
+                for _ in range(n):
+                    clock.sleep(period)
+                    events.append((round(clock.time(), 6), name))
+            finally:
+                clock.unregister()
+
+        threads = [threading.Thread(target=ticker, args=('a', 0.5, 200)),
+                   threading.Thread(target=ticker, args=('b', 2, 50))]
+        start = time.monotonic()
+        for thread in threads:
+            clock.register(thread)
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # 100 s simulierte Zeit
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(100, clock.time())
+        self.assertEqual(250, len(events))
+        self.assertEqual([(0.5, 'a'), (1, 'a'), (1.5, 'a'), (2, 'a'), (2, 'b')], sorted(events)[:5])
+        # die Zeit springt erst weiter, wenn beide Threads wieder schlafen
+        times = [t for t, _ in events]
+        self.assertEqual(sorted(times), times)
+
+    def test_non_participant(self):
+        clock = VirtualClock(start=10)
+        start = time.monotonic()
+        clock.sleep(3600)
+        self.assertEqual(3610, clock.time())
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_wait_and_detached(self):
+        clock = VirtualClock()
+        stop = threading.Event()
+        woken = []
+
+        def waiter():
+            try:
+                while not clock.wait(stop, 100):
+                    woken.append(clock.time())
+                woken.append(clock.time())
+            finally:
+                clock.unregister()
+
+        def stopper():
+            try:
+                clock.sleep(250)
+                clock.set(stop)
+                # solange dieser Teilnehmer arbeitet, steht die Zeit
+                threading.Event().wait(0.2)
+                # abgemeldet hält er sie nicht an
+                with clock.detached():
+                    clock.sleep(30)
+                clock.sleep(1)
+            finally:
+                clock.unregister()
+
+        threads = [threading.Thread(target=waiter), threading.Thread(target=stopper)]
+        for thread in threads:
+            clock.register(thread)
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # das Ereignis wird sofort bemerkt, nicht erst nach 100 s
+        self.assertEqual([100, 200, 250], woken)
+        self.assertEqual(281, clock.time())
+
+        self.assertTrue(clock.wait(stop, 10))
+        self.assertFalse(VirtualClock().wait(threading.Event(), 10))